@@ -68,6 +68,7 @@ INSTALLED_APPS = [
     "allauth.account",
     "allauth.socialaccount",
     "django.contrib.contenttypes",
+    "django.contrib.postgres",
     "django.contrib.sessions",
     "django.contrib.staticfiles",
     "rest_framework",
@@ -133,6 +134,37 @@ DATABASES = {
     }
 }
 
+# Cache
+# Rendered stanza HTML and edition data are cached here. The local-memory
+# default is per process; point CACHE_URL at a shared cache (e.g.
+# redis://localhost:6379/1) so management commands can warm it for every worker.
+CACHES = {"default": env.cache("CACHE_URL", default="locmemcache://")}
+
+# IIIF manifests
+# Remote manifests are fetched with these (connect, read) timeouts, served from
+# the cache for IIIF_MANIFEST_FRESH_FOR seconds and revalidated in the
+# background after that; see manuscript/iiif.py.
+IIIF_MANIFEST_TIMEOUT = (
+    env.float("IIIF_CONNECT_TIMEOUT", default=3.05),
+    env.float("IIIF_READ_TIMEOUT", default=10),
+)
+IIIF_MANIFEST_FRESH_FOR = env.int("IIIF_MANIFEST_FRESH_FOR", default=60 * 60 * 24)
+# Bytes of manifest JSON each worker keeps parsed in memory in front of the
+# shared cache
+IIIF_MANIFEST_MEMORY_BUDGET = env.int(
+    "IIIF_MANIFEST_MEMORY_BUDGET", default=32 * 1024 * 1024
+)
+
+# Local snapshot of the manifests, written by `manage.py mirror_manifests`.
+# With IIIF_MANIFEST_MIRROR set to "local" manifests are read from it instead
+# of the IIIF servers; set it to the base URL of `manage.py
+# serve_manifest_mirror` (e.g. http://127.0.0.1:8001) to fetch them over HTTP
+# from that stand-in server instead.
+IIIF_MANIFEST_MIRROR_ROOT = env(
+    "IIIF_MANIFEST_MIRROR_ROOT", default=str(BASE_DIR / "iiif_mirror")
+)
+IIIF_MANIFEST_MIRROR = env("IIIF_MANIFEST_MIRROR", default="")
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -195,6 +227,10 @@ STATICFILES_DIRS = [
 MEDIA_ROOT = str(BASE_DIR / "media")
 MEDIA_URL = "/media/"
 
+# Tiles and thumbnails rendered by the built-in IIIF image server for uploaded
+# images; see manuscript/iiif_image.py. Safe to delete at any time.
+IIIF_IMAGE_CACHE_ROOT = str(BASE_DIR / "media" / "iiif_cache")
+
 ADMINS = [
     ("Jason Heppler", "jheppler@gmu.edu"),
 ]
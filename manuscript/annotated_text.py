@@ -0,0 +1,149 @@
+"""Rendering and caching of stanza HTML with its annotations marked up.
+
+Wrapping annotated passages in spans needs the stanza HTML parsed, which is
+too slow to repeat for every stanza on every page view. Rendered HTML is
+cached under a key made of the stanza id, a digest of its text and a digest
+of its annotations, so editing either the stanza or one of its
+``TextAnnotation`` rows yields a new key and the stale entry is never read
+again.
+"""
+
+import hashlib
+import json
+from html import unescape
+
+from bs4 import BeautifulSoup
+from django.conf import settings
+from django.core.cache import cache
+
+# Stale entries are never read again, so they only need to outlive a deploy
+ANNOTATED_HTML_TIMEOUT = getattr(
+    settings, "ANNOTATED_STANZA_CACHE_TIMEOUT", 60 * 60 * 24 * 30
+)
+
+
+def render_annotated_html(html_content, annotations):
+    """
+    Takes HTML content and list of annotations, returns HTML with annotated spans
+    """
+    if not annotations:
+        # Strip outer div tags but preserve inner HTML
+        soup = BeautifulSoup(html_content, "html.parser")
+        return soup.div.decode_contents() if soup.div else html_content
+
+    # Parse the HTML
+    soup = BeautifulSoup(html_content, "html.parser")
+
+    # Get the inner content without the outer div
+    inner_html = soup.div.decode_contents() if soup.div else html_content
+
+    # Sort annotations by start position
+    sorted_annotations = sorted(annotations, key=lambda x: x.from_pos)
+
+    result = []
+    last_pos = 0
+
+    for annotation in sorted_annotations:
+        # Find the actual text we're looking for
+        target_text = annotation.selected_text
+
+        # Find where this text appears in the inner HTML
+        text_start = inner_html.find(target_text, last_pos)
+        if text_start != -1:
+            # Add any content before the annotation
+            if text_start > last_pos:
+                result.append(inner_html[last_pos:text_start])
+
+            # Add the annotated content
+            text_end = text_start + len(target_text)
+            annotated_content = inner_html[text_start:text_end]
+
+            # Determine the appropriate class based on annotation type
+            annotation_type = annotation.annotation_type.lower()
+            css_class = (
+                "textual-variant" if annotation_type == "variant" else "annotated-text"
+            )
+
+            result.append(
+                f'<span class="{css_class}" '
+                f'data-annotation-id="{annotation.id}" '
+                f'data-annotation-type="{annotation_type}" '
+                f'onclick="showAnnotation(event, this)">'
+                f"{annotated_content}"
+                f"</span>"
+            )
+
+            last_pos = text_end
+
+    # Add any remaining content
+    if last_pos < len(inner_html):
+        result.append(inner_html[last_pos:])
+
+    return "".join(result)
+
+
+def stanza_html(stanza):
+    """Return the unescaped HTML of a stanza or stanza translation."""
+    text = getattr(stanza, "unescaped_stanza_text", None)
+    if text is None:
+        text = unescape(stanza.stanza_text or "")
+    return text
+
+
+def annotation_digest(annotations):
+    """Digest of everything about an annotation set that affects rendering."""
+    fingerprint = sorted(
+        (
+            annotation.id,
+            annotation.selected_text,
+            annotation.annotation_type,
+            json.dumps(annotation.from_pos, sort_keys=True, default=str),
+        )
+        for annotation in annotations
+    )
+    return hashlib.md5(json.dumps(fingerprint).encode()).hexdigest()
+
+
+def annotated_html_cache_key(stanza, text, annotations):
+    text_revision = hashlib.md5(text.encode()).hexdigest()
+    return (
+        f"annotated_stanza_{stanza.id}_{text_revision}_"
+        f"{annotation_digest(annotations)}"
+    )
+
+
+def annotated_stanza_html(stanza):
+    """Return a stanza's annotated HTML, rendering it only on a cache miss."""
+    text = stanza_html(stanza)
+    annotations = list(stanza.annotations.all())
+    cache_key = annotated_html_cache_key(stanza, text, annotations)
+    html = cache.get(cache_key)
+    if html is None:
+        html = render_annotated_html(text, annotations)
+        cache.set(cache_key, html, ANNOTATED_HTML_TIMEOUT)
+    return html
+
+
+def warm_annotated_stanzas(stanzas, force=False):
+    """Render and cache the annotated HTML of many stanzas.
+
+    Returns the number of stanzas rendered; with ``force`` cached entries
+    are rendered again as well.
+    """
+    entries = {}
+    for stanza in stanzas:
+        text = stanza_html(stanza)
+        annotations = list(stanza.annotations.all())
+        entries[annotated_html_cache_key(stanza, text, annotations)] = (
+            text,
+            annotations,
+        )
+
+    cached = set() if force else set(cache.get_many(list(entries)))
+    rendered = {
+        cache_key: render_annotated_html(text, annotations)
+        for cache_key, (text, annotations) in entries.items()
+        if cache_key not in cached
+    }
+    cache.set_many(rendered, ANNOTATED_HTML_TIMEOUT)
+    return len(rendered)
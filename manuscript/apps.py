@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ManuscriptConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'manuscript'
+
+    def ready(self):
+        from manuscript import signals  # noqa: F401
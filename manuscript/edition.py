@@ -0,0 +1,314 @@
+"""Materialized edition layout for the manuscript stanza pages.
+
+The book/stanza/translation/folio structure rendered by ``stanzas.html`` is
+computed once per manuscript and stored as JSON on ``EditionLayout``. The
+stanza page then only has to load that row; the signal handlers in
+``manuscript.signals`` drop it again whenever its inputs change so that the
+next request rebuilds it.
+"""
+
+import logging
+from collections import defaultdict
+from html import unescape
+from types import SimpleNamespace
+
+from django.db.models import Prefetch, Q
+
+from manuscript.folio_index import FolioRangeIndex
+from manuscript.models import (
+    EditionLayout,
+    Folio,
+    Stanza,
+    StanzaTranslated,
+    line_code_to_numeric,
+)
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the serialized shape changes so stale rows get rebuilt.
+LAYOUT_VERSION = 2
+
+
+class RelatedList(list):
+    """A list that answers the ``all``/``first`` calls templates make on
+    related managers, so hydrated layout entries render like model objects."""
+
+    def all(self):
+        return self
+
+    def first(self):
+        return self[0] if self else None
+
+
+def process_stanzas(stanzas, is_translated=False):
+    books = defaultdict(lambda: defaultdict(list))
+    for stanza in stanzas:
+        book_number = int(stanza.stanza_line_code_starts.split(".")[0])
+        stanza_number = int(stanza.stanza_line_code_starts.split(".")[1])
+
+        if is_translated:
+            stanza.unescaped_stanza_text = unescape(stanza.stanza_text)
+        else:
+            stanza.unescaped_stanza_text = unescape(stanza.stanza_text)
+
+        books[book_number][stanza_number].append(stanza)
+
+        # Sort stanzas within each stanza number by line code for proper ordering
+        books[book_number][stanza_number].sort(
+            key=lambda s: line_code_to_numeric(s.stanza_line_code_starts)
+        )
+
+    # Return books with keys sorted by book number
+    return {k: dict(v) for k, v in sorted(books.items())}
+
+
+class TranslationPairing:
+    """Pairs stanzas with their translations using maps built once.
+
+    Translations are looked up by the book and stanza number of their line
+    code and, failing that, by the stanza they are attached to.
+    """
+
+    def __init__(self, translated_stanzas):
+        self.by_code = defaultdict(list)
+        self.by_stanza = defaultdict(list)
+        for translated in translated_stanzas:
+            self.by_stanza[translated.stanza_id].append(translated)
+            if translated.stanza_line_code_starts:
+                parts = translated.stanza_line_code_starts.split(".")
+                self.by_code[(int(parts[0]), int(parts[1]))].append(translated)
+
+    def translations_for(self, book, stanza_number, original_stanzas, by_fk=False):
+        """Return the translations of a stanza group, sorted by line code.
+
+        The group's line code is tried first; the translations attached to
+        its stanzas are used if that finds none, or always with ``by_fk``.
+        """
+        translations = self.by_code.get((book, stanza_number), [])
+        if (not translations or by_fk) and original_stanzas:
+            linked_translations = [
+                translated
+                for stanza in original_stanzas
+                for translated in self.by_stanza.get(stanza.id, [])
+            ]
+            if linked_translations:
+                translations = linked_translations
+
+        # Ensure translations are always sorted by line code
+        return sorted(
+            translations,
+            key=lambda s: line_code_to_numeric(s.stanza_line_code_starts) or 0,
+        )
+
+
+def stanza_folios_prefetch():
+    """Prefetch a stanza's folios in folio-number order, so the first one and
+    the full list can be read without further queries."""
+    return Prefetch("folios", queryset=Folio.objects.order_by("folio_number"))
+
+
+def mark_folio_change(stanza_group, stanza, current_folio):
+    """Flag ``stanza_group`` when ``stanza`` opens a new folio.
+
+    Reads the folios prefetched by ``stanza_folios_prefetch`` and returns the
+    folio now current, for the caller to pass in with the next group.
+    """
+    stanza_folios = stanza.folios.all()
+    if stanza_folios and stanza_folios[0] != current_folio:
+        stanza_group["new_folio"] = True
+        stanza_group["folios"] = [folio.folio_number for folio in stanza_folios]
+        return stanza_folios[0]
+    stanza_group["new_folio"] = False
+    return current_folio
+
+
+def select_edition_stanzas(manuscript):
+    """Return the stanzas shown for a manuscript and whether they are the
+    shared fallback set (every stanza with a line code)."""
+    folios = manuscript.folio_set.all()
+    if folios.exists():
+        stanzas = Stanza.objects.filter(
+            folios__in=folios, folios__manuscript=manuscript
+        ).distinct()
+        if stanzas.exists():
+            return stanzas, False
+        logger.info(
+            f"No stanzas found using folios for {manuscript.siglum}, using all stanzas with line codes"
+        )
+    return Stanza.objects.exclude(stanza_line_code_starts__isnull=True), True
+
+
+def _serialize_stanza(stanza):
+    entry = {
+        "id": stanza.id,
+        "stanza_line_code_starts": stanza.stanza_line_code_starts,
+        "unescaped_stanza_text": stanza.unescaped_stanza_text,
+        "annotations": [
+            {
+                "id": annotation.id,
+                "selected_text": annotation.selected_text,
+                "annotation_type": annotation.annotation_type,
+                "from_pos": annotation.from_pos,
+            }
+            for annotation in stanza.annotations.all()
+        ],
+    }
+    if isinstance(stanza, Stanza):
+        entry["folios"] = [
+            {"id": folio.id, "folio_number": folio.folio_number}
+            for folio in stanza.folios.all()
+        ]
+    return entry
+
+
+def build_edition_layout(manuscript):
+    """Compute the serializable paired-books structure for a manuscript."""
+    siglum = manuscript.siglum
+    stanzas, uses_shared_stanzas = select_edition_stanzas(manuscript)
+    stanzas = stanzas.prefetch_related("annotations", "folios")
+    translated_stanzas = list(
+        StanzaTranslated.objects.filter(stanza__in=stanzas)
+        .distinct()
+        .prefetch_related("annotations")
+    )
+
+    books = process_stanzas(stanzas)
+    for translated in translated_stanzas:
+        translated.unescaped_stanza_text = unescape(translated.stanza_text or "")
+    pairing = TranslationPairing(translated_stanzas)
+
+    folio_index = FolioRangeIndex.for_manuscript(manuscript)
+
+    paired_books = []
+    for book_number, stanza_dict in books.items():
+        pairs = []
+        current_folio = None
+
+        for stanza_number in sorted(stanza_dict.keys()):
+            original_stanzas = stanza_dict[stanza_number]
+
+            # Yale3 prefers the translations attached to its stanzas
+            translated_stanza_group = pairing.translations_for(
+                book_number, stanza_number, original_stanzas, by_fk=siglum == "Yale3"
+            )
+
+            pair = {
+                "original": original_stanzas,
+                "translated": translated_stanza_group,
+            }
+
+            if folio_index and original_stanzas:
+                first_stanza = original_stanzas[0]
+                try:
+                    stanza_code = line_code_to_numeric(
+                        first_stanza.stanza_line_code_starts
+                    )
+                    matching_folio = folio_index.folio_at(stanza_code)
+                    if matching_folio is not None and matching_folio != current_folio:
+                        current_folio = matching_folio
+                        pair["new_folio"] = True
+                        pair["current_folio"] = {
+                            "id": current_folio.folio_id,
+                            "folio_number": current_folio.folio_number,
+                        }
+                except Exception as e:
+                    logger.warning(
+                        f"Error determining folio for stanza {first_stanza.id}: {e}"
+                    )
+
+            pairs.append(pair)
+
+        paired_books.append({"number": book_number, "pairs": pairs})
+
+    for book in paired_books:
+        for pair in book["pairs"]:
+            pair["original"] = [_serialize_stanza(s) for s in pair["original"]]
+            pair["translated"] = [_serialize_stanza(s) for s in pair["translated"]]
+
+    layout = {"version": LAYOUT_VERSION, "books": paired_books}
+    return layout, uses_shared_stanzas
+
+
+def rebuild_edition_layout(manuscript):
+    """Build and store the layout for a manuscript, returning the stored row."""
+    layout, uses_shared_stanzas = build_edition_layout(manuscript)
+    edition_layout, _ = EditionLayout.objects.update_or_create(
+        manuscript=manuscript,
+        defaults={"layout": layout, "uses_shared_stanzas": uses_shared_stanzas},
+    )
+    logger.info(f"Rebuilt edition layout for {manuscript.siglum}")
+    return edition_layout
+
+
+def manuscript_edition_layout(manuscript):
+    """Return the stored ``EditionLayout`` row, rebuilding it if missing."""
+    edition_layout = EditionLayout.objects.filter(manuscript=manuscript).first()
+    if edition_layout is None or edition_layout.layout.get("version") != LAYOUT_VERSION:
+        edition_layout = rebuild_edition_layout(manuscript)
+    return edition_layout
+
+
+def get_edition_layout(manuscript):
+    """Return the stored layout for a manuscript, rebuilding it if missing."""
+    return manuscript_edition_layout(manuscript).layout
+
+
+def _hydrate_stanza(entry):
+    stanza = SimpleNamespace(**entry)
+    stanza.annotations = RelatedList(
+        SimpleNamespace(**annotation) for annotation in entry["annotations"]
+    )
+    stanza.folios = RelatedList(
+        SimpleNamespace(**folio) for folio in entry.get("folios", [])
+    )
+    return stanza
+
+
+def paired_books_from_layout(layout, book_numbers=None):
+    """Turn a stored layout into the ``paired_books`` context of stanzas.html.
+
+    ``book_numbers`` limits the result to those books.
+    """
+    paired_books = {}
+    for book in layout["books"]:
+        if book_numbers is not None and book["number"] not in book_numbers:
+            continue
+        pairs = []
+        for pair in book["pairs"]:
+            stanza_group = {
+                "original": [_hydrate_stanza(s) for s in pair["original"]],
+                "translated": [_hydrate_stanza(s) for s in pair["translated"]],
+            }
+            if pair.get("new_folio"):
+                stanza_group["new_folio"] = True
+                stanza_group["current_folio"] = SimpleNamespace(**pair["current_folio"])
+            pairs.append(stanza_group)
+        paired_books[book["number"]] = pairs
+    return paired_books
+
+
+def layout_book_numbers(layout):
+    """Return the numbers of the books in a stored layout, in order."""
+    return [book["number"] for book in layout["books"]]
+
+
+def invalidate_edition_layouts(manuscript_ids=(), shared=False):
+    """Drop stored layouts so they are rebuilt on their next request.
+
+    ``shared`` also drops every layout built from the shared fallback set of
+    stanzas, which any stanza change can affect.
+    """
+    query = Q(manuscript_id__in=[pk for pk in manuscript_ids if pk is not None])
+    if shared:
+        query |= Q(uses_shared_stanzas=True)
+    EditionLayout.objects.filter(query).delete()
+
+
+def invalidate_for_stanzas(stanza_ids):
+    """Drop the layouts that can include any of the given stanzas."""
+    manuscript_ids = (
+        Folio.objects.filter(stanzas__in=stanza_ids)
+        .values_list("manuscript_id", flat=True)
+        .distinct()
+    )
+    invalidate_edition_layouts(list(manuscript_ids), shared=True)
@@ -0,0 +1,133 @@
+"""Numeric line-code field and its lookups.
+
+Line codes are entered as "BB.SS.LL" strings. ``LineCodeField`` keeps the
+numeric BBSSLL form of such a string in an indexed integer column next to it,
+so that range and overlap queries on line codes run in the database.
+"""
+
+from django.db import models
+from django.db.models.lookups import Lookup, Range
+
+
+class LineCodeField(models.PositiveIntegerField):
+    """Indexed BBSSLL integer derived from a line-code string field.
+
+    ``source`` names the string field the value is taken from on save. Line
+    codes entered as a range ("01.01.04-01.01.16") contribute their first code,
+    or their last one when ``bound`` is "end". ``end_field`` names the field
+    holding the end of the span that starts here, which the ``overlaps`` lookup
+    compares against; with ``open_ended`` a missing end means the span runs to
+    the end of the poem rather than ending where it starts.
+
+    The value is computed in ``pre_save``, so ``QuerySet.update()`` and
+    ``bulk_update()`` on the source field leave it stale.
+    """
+
+    def __init__(
+        self,
+        *args,
+        source=None,
+        bound="start",
+        end_field=None,
+        open_ended=False,
+        **kwargs,
+    ):
+        self.source = source
+        self.bound = bound
+        self.end_field = end_field
+        self.open_ended = open_ended
+        kwargs.setdefault("blank", True)
+        kwargs.setdefault("null", True)
+        kwargs.setdefault("editable", False)
+        kwargs.setdefault("db_index", True)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs["source"] = self.source
+        if self.bound != "start":
+            kwargs["bound"] = self.bound
+        if self.end_field is not None:
+            kwargs["end_field"] = self.end_field
+        if self.open_ended:
+            kwargs["open_ended"] = True
+        for option in ("blank", "null", "editable", "db_index"):
+            kwargs.pop(option, None)
+        return name, path, args, kwargs
+
+    def code_from_string(self, line_code):
+        """Return the numeric form of a line-code string, or None."""
+        from manuscript.models import line_code_to_numeric
+
+        if not line_code:
+            return None
+        parts = line_code.strip().split("-")
+        try:
+            return line_code_to_numeric(parts[-1] if self.bound == "end" else parts[0])
+        except ValueError:
+            return None
+
+    def pre_save(self, model_instance, add):
+        value = self.code_from_string(getattr(model_instance, self.source))
+        setattr(model_instance, self.attname, value)
+        return value
+
+    def get_prep_value(self, value):
+        # Allow filtering with line-code strings as well as numbers
+        if isinstance(value, str) and "." in value:
+            return self.code_from_string(value)
+        return super().get_prep_value(value)
+
+
+@LineCodeField.register_lookup
+class InRange(Range):
+    """``field__in_range=(start, end)``: the code lies within start..end."""
+
+    lookup_name = "in_range"
+
+
+@LineCodeField.register_lookup
+class Overlaps(Lookup):
+    """``field__overlaps=(start, end)``: the span beginning at this field and
+    ending at its ``end_field`` shares at least one line with start..end.
+
+    ``end`` may be None for a query span that runs to the end of the poem.
+    """
+
+    lookup_name = "overlaps"
+    prepare_rhs = False
+
+    def get_prep_lookup(self):
+        start, end = self.rhs
+        return (
+            self.lhs.output_field.get_prep_value(start),
+            self.lhs.output_field.get_prep_value(end),
+        )
+
+    def as_sql(self, compiler, connection):
+        field = self.lhs.output_field
+        start_sql, start_params = compiler.compile(self.lhs)
+        if field.end_field is not None:
+            end_column = field.model._meta.get_field(field.end_field)
+            end_sql, end_params = compiler.compile(end_column.get_col(self.lhs.alias))
+        else:
+            end_sql, end_params = start_sql, start_params
+        query_start, query_end = self.rhs
+
+        if field.open_ended:
+            reaches = f"({end_sql} IS NULL OR {end_sql} >= %s)"
+            reaches_params = [*end_params, *end_params, query_start]
+        else:
+            reaches = f"COALESCE({end_sql}, {start_sql}) >= %s"
+            reaches_params = [*end_params, *start_params, query_start]
+
+        if query_end is None:
+            return f"{start_sql} IS NOT NULL AND {reaches}", [
+                *start_params,
+                *reaches_params,
+            ]
+        return f"{start_sql} <= %s AND {reaches}", [
+            *start_params,
+            query_end,
+            *reaches_params,
+        ]
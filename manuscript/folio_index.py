@@ -0,0 +1,122 @@
+"""Sorted interval index over a manuscript's folio line-code ranges.
+
+Folios record the span of the poem they carry as a pair of line codes. The
+index keeps those spans sorted by their numeric start (see
+``line_code_to_numeric``) so a line code resolves to its folio with a binary
+search, and its size is proportional to the number of folios rather than the
+numeric width of their ranges.
+"""
+
+import logging
+from bisect import bisect_right
+from collections import namedtuple
+
+from django.core.cache import cache
+
+from manuscript.models import line_code_to_numeric
+
+logger = logging.getLogger(__name__)
+
+# A folio without an end code runs until the end of the poem
+OPEN_END = float("inf")
+
+FolioRange = namedtuple("FolioRange", ["start", "end", "folio_id", "folio_number"])
+
+
+def folio_index_cache_key(manuscript_id):
+    return f"folio_range_index_{manuscript_id}"
+
+
+class FolioRangeIndex:
+    """Resolve numeric line codes (BBSSLL) to the folio they appear on.
+
+    Where ranges touch or overlap, as they do when a folio's end code is the
+    next folio's first line, the folio that starts latest wins.
+    """
+
+    def __init__(self, ranges):
+        self.ranges = sorted(ranges, key=lambda r: (r.start, r.folio_id))
+        self.starts = [r.start for r in self.ranges]
+        self.by_folio = {r.folio_id: r for r in self.ranges}
+
+        # Furthest end reached by any range up to each position, so lookups
+        # can step back past shorter ranges nested inside longer ones
+        self.reach = []
+        furthest = -1
+        for folio_range in self.ranges:
+            furthest = max(furthest, folio_range.end)
+            self.reach.append(furthest)
+
+    def __len__(self):
+        return len(self.ranges)
+
+    @classmethod
+    def from_folios(cls, folios):
+        ranges = []
+        for folio in folios:
+            if not folio.line_code_range_start:
+                continue
+            try:
+                start = line_code_to_numeric(folio.line_code_range_start)
+                end = line_code_to_numeric(folio.line_code_range_end) or OPEN_END
+            except ValueError as e:
+                logger.warning(f"Error mapping folio {folio.folio_number}: {e}")
+                continue
+            if end < start:
+                logger.warning(
+                    f"Folio {folio.folio_number} ends before it starts, skipping"
+                )
+                continue
+            ranges.append(FolioRange(start, end, folio.id, folio.folio_number))
+        return cls(ranges)
+
+    @classmethod
+    def for_manuscript(cls, manuscript):
+        """Return the cached index for a manuscript, building it if needed.
+
+        The cached copy is dropped by ``manuscript.signals`` whenever one of
+        the manuscript's folios is saved or deleted.
+        """
+        cache_key = folio_index_cache_key(manuscript.pk)
+        ranges = cache.get(cache_key)
+        if ranges is None:
+            index = cls.from_folios(manuscript.folio_set.all())
+            cache.set(cache_key, index.ranges, None)
+            return index
+        return cls(ranges)
+
+    def folio_at(self, code):
+        """Return the ``FolioRange`` containing a numeric line code, or None."""
+        if code is None:
+            return None
+        position = bisect_right(self.starts, code) - 1
+        while position >= 0 and self.reach[position] >= code:
+            if self.ranges[position].end >= code:
+                return self.ranges[position]
+            position -= 1
+        return None
+
+    def folios_between(self, start, end):
+        """Return the folios carrying any line in ``start..end``, in order."""
+        if start is None:
+            return []
+        end = start if end is None else end
+        found = []
+        first = self.folio_at(start)
+        if first is not None:
+            found.append(first)
+        # Every folio that begins inside the span also carries part of it
+        position = bisect_right(self.starts, start)
+        while position < len(self.ranges) and self.starts[position] <= end:
+            folio_range = self.folio_at(self.starts[position])
+            if folio_range is not None and folio_range not in found:
+                found.append(folio_range)
+            position += 1
+        return found
+
+    def span(self, folio_id):
+        """Return the ``(start, end)`` codes indexed for a folio, or None."""
+        folio_range = self.by_folio.get(folio_id)
+        if folio_range is None:
+            return None
+        return folio_range.start, folio_range.end
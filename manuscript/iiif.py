@@ -0,0 +1,545 @@
+"""Client for the remote IIIF manifests of the manuscripts.
+
+Manifests are fetched through one pooled ``requests`` session with connect
+and read timeouts, and cached with the validators the server sent. Within
+``IIIF_MANIFEST_FRESH_FOR`` a cached manifest is served as is; after that it
+is still served, while a background thread revalidates it with
+``If-None-Match``/``If-Modified-Since``. Failed fetches are remembered for
+``IIIF_MANIFEST_FAILURE_TTL`` so an unreachable server is not asked again on
+every request. ``IIIF_MANIFEST_MIRROR`` redirects all of this to a local
+snapshot of the manifests (see ``manuscript.iiif_mirror``).
+
+The cache has two tiers. Each process keeps the manifests it used last,
+already parsed, in an LRU bounded to ``IIIF_MANIFEST_MEMORY_BUDGET`` bytes;
+behind it the shared Django cache holds every manifest, and has to unpickle
+one on each read.
+
+Each cached manifest carries a canvas index, built once when it is fetched,
+that resolves a folio label or a page number to its canvas id without
+walking the canvases.
+
+Pages that only show a few folios of a manuscript use a projection instead
+of the manifest: the canvas id, label, page and thumbnail of just those
+folios, cached on its own so the full manifest is not loaded to render them.
+
+Views that need several manifests resolve them as a batch on a shared thread
+pool, waiting at most ``IIIF_MANIFEST_BATCH_DEADLINE`` seconds in all. What
+is not ready by then is marked as pending and keeps loading into the cache
+for the next request.
+"""
+
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# (connect, read) in seconds
+MANIFEST_TIMEOUT = getattr(settings, "IIIF_MANIFEST_TIMEOUT", (3.05, 10))
+MANIFEST_FRESH_FOR = getattr(settings, "IIIF_MANIFEST_FRESH_FOR", 60 * 60 * 24)
+# How long a manifest is kept to be served stale while it is revalidated
+MANIFEST_KEEP_FOR = getattr(settings, "IIIF_MANIFEST_KEEP_FOR", 60 * 60 * 24 * 30)
+MANIFEST_FAILURE_TTL = getattr(settings, "IIIF_MANIFEST_FAILURE_TTL", 60 * 5)
+THUMBNAIL_WIDTH = getattr(settings, "IIIF_THUMBNAIL_WIDTH", 200)
+# Overall wait, in seconds, for a batch of manifests
+MANIFEST_BATCH_DEADLINE = getattr(settings, "IIIF_MANIFEST_BATCH_DEADLINE", 5)
+MANIFEST_BATCH_WORKERS = getattr(settings, "IIIF_MANIFEST_BATCH_WORKERS", 8)
+# "local" to read manifests from the mirror, or the base URL of a stand-in
+# server for it; see manuscript.iiif_mirror
+MANIFEST_MIRROR = getattr(settings, "IIIF_MANIFEST_MIRROR", "")
+# Bytes of manifest JSON each process keeps parsed in memory
+MANIFEST_MEMORY_BUDGET = getattr(
+    settings, "IIIF_MANIFEST_MEMORY_BUDGET", 32 * 1024 * 1024
+)
+
+_session = None
+_session_lock = threading.Lock()
+
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Status of a manifest in a batch result
+READY = "ready"
+PENDING = "pending"
+FAILED = "failed"
+
+BatchResult = namedtuple("BatchResult", ["value", "status"])
+
+
+class ManifestUnavailable(requests.RequestException):
+    """A manifest could not be fetched, now or recently."""
+
+
+class ManifestLRU:
+    """Per-process LRU of manifest cache entries, bounded by the total size
+    of the manifests' JSON rather than by their number.
+
+    Parsed manifests take several times their JSON size in memory, so set
+    the budget accordingly.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = self.shared_hits = self.misses = self.evictions = 0
+
+    def get(self, manifest_url):
+        with self.lock:
+            entry = self.entries.get(manifest_url)
+            if entry is not None:
+                self.entries.move_to_end(manifest_url)
+                self.hits += 1
+            return entry
+
+    def count(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def put(self, manifest_url, entry):
+        size = entry.get("size") or 0
+        with self.lock:
+            previous = self.entries.pop(manifest_url, None)
+            if previous is not None:
+                self.size -= previous.get("size") or 0
+            if size > self.budget:
+                return
+            self.entries[manifest_url] = entry
+            self.size += size
+            while self.size > self.budget:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.get("size") or 0
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "budget": self.budget,
+            }
+
+
+local_manifests = ManifestLRU(MANIFEST_MEMORY_BUDGET)
+
+
+def manifest_cache_stats():
+    """Return this process's manifest cache counters: ``hits`` in memory,
+    ``shared_hits`` in the shared cache, ``misses``, ``evictions`` from
+    memory, and the ``entries``, ``bytes`` and ``budget`` held in memory.
+    """
+    return local_manifests.stats()
+
+
+def get_session():
+    """Return the process-wide HTTP session used for IIIF requests."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16, max_retries=1)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+            _session.headers["Accept"] = "application/ld+json, application/json"
+        return _session
+
+
+def get_executor():
+    """Return the process-wide thread pool that resolves manifest batches."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=MANIFEST_BATCH_WORKERS, thread_name_prefix="iiif"
+            )
+        return _executor
+
+
+def manifest_cache_key(manifest_url):
+    return f"iiif_manifest_{hashlib.md5(manifest_url.encode()).hexdigest()}"
+
+
+def failure_cache_key(manifest_url):
+    return f"iiif_manifest_failed_{hashlib.md5(manifest_url.encode()).hexdigest()}"
+
+
+def projection_cache_key(manifest_url, labels):
+    url = hashlib.md5(manifest_url.encode()).hexdigest()
+    folios = hashlib.md5("|".join(sorted(labels)).encode()).hexdigest()
+    return f"iiif_projection_{url}_{folios}"
+
+
+# "fol. 1r", "f.1r", "c. 1r", "Folio 1r" and "001r" all name folio 1r
+FOLIO_PREFIX = re.compile(r"^(?:folio|fol|carta|f|c)(?:\.\s*|\s+|(?=\d))")
+
+
+def label_text(label):
+    """Return a Presentation 2 or 3 label as plain text."""
+    if isinstance(label, dict):
+        # IIIF Presentation 3 language map
+        label = next(iter(label.values()), [""])
+    if isinstance(label, list):
+        label = label[0] if label else ""
+    return str(label or "").strip()
+
+
+def normalize_folio_label(label):
+    """Reduce a folio or canvas label to a comparable key."""
+    key = FOLIO_PREFIX.sub("", label_text(label).lower())
+    key = re.sub(r"\s+", "", key)
+    return re.sub(r"^0+(?=\d)", "", key)
+
+
+def manifest_canvases(manifest):
+    """Return the canvases of a Presentation 2 or 3 manifest, in order.
+
+    Raises ``ValueError`` if the manifest isn't shaped like one.
+    """
+    if not isinstance(manifest, dict):
+        raise ValueError("The manifest is not a JSON object")
+    if "sequences" in manifest:
+        sequence = _first(manifest["sequences"])
+        items = sequence.get("canvases", []) if isinstance(sequence, dict) else []
+    else:
+        items = manifest.get("items", [])
+        if isinstance(items, list):
+            items = [
+                item
+                for item in items
+                if isinstance(item, dict) and item.get("type") == "Canvas"
+            ]
+    if not isinstance(items, list) or not all(isinstance(c, dict) for c in items):
+        raise ValueError("The manifest's canvases are malformed")
+    return items
+
+
+def build_canvas_index(manifest):
+    """Map normalized labels and page positions to canvas ids.
+
+    ``labels`` holds the first canvas for each normalized label; ``pages``
+    lists canvas ids by position, so page n (1-based) is ``pages[n - 1]``.
+    """
+    labels = {}
+    pages = []
+    for canvas in manifest_canvases(manifest):
+        canvas_id = canvas.get("@id") or canvas.get("id")
+        pages.append(canvas_id)
+        labels.setdefault(normalize_folio_label(canvas.get("label", "")), canvas_id)
+    return {"labels": labels, "pages": pages}
+
+
+def _first(value):
+    return value[0] if isinstance(value, list) and value else value
+
+
+def _resource_id(resource):
+    if isinstance(resource, dict):
+        resource = resource.get("@id") or resource.get("id")
+    return resource if isinstance(resource, str) and resource else None
+
+
+def canvas_thumbnail(canvas, width=THUMBNAIL_WIDTH):
+    """Return a thumbnail URL for a canvas, or None.
+
+    The canvas's own thumbnail is preferred; otherwise one is requested from
+    the image service of its first image.
+    """
+    thumbnail = _resource_id(_first(canvas.get("thumbnail")))
+    if thumbnail:
+        return thumbnail
+
+    if "images" in canvas:
+        image = _first(canvas["images"])
+        resource = image.get("resource") if isinstance(image, dict) else None
+    else:
+        page = _first(canvas.get("items"))
+        annotation = _first(page.get("items")) if isinstance(page, dict) else None
+        resource = annotation.get("body") if isinstance(annotation, dict) else None
+    resource = _first(resource)
+    if not isinstance(resource, dict):
+        return None
+    service = _resource_id(_first(resource.get("service")))
+    if not service:
+        return None
+    return f"{service.rstrip('/')}/full/{width},/0/default.jpg"
+
+
+def build_manifest_projection(manifest, labels):
+    """Extract what a page needs to show the folios ``labels`` of a
+    manifest: its label and, for each folio found, the canvas id, label,
+    1-based page and thumbnail, in page order.
+    """
+    wanted = {normalize_folio_label(label): label for label in labels}
+    canvases = []
+    for position, canvas in enumerate(manifest_canvases(manifest)):
+        folio = wanted.pop(normalize_folio_label(canvas.get("label", "")), None)
+        if folio is None:
+            continue
+        canvases.append(
+            {
+                "folio": folio,
+                "canvas_id": canvas.get("@id") or canvas.get("id"),
+                "label": label_text(canvas.get("label")),
+                "page": position + 1,
+                "thumbnail": canvas_thumbnail(canvas),
+            }
+        )
+        if not wanted:
+            break
+    return {"label": label_text(manifest.get("label")), "canvases": canvases}
+
+
+def request_manifest(manifest_url, headers):
+    """Request a manifest from its server, or from the mirror when
+    ``IIIF_MANIFEST_MIRROR`` is set.
+
+    Returns ``(status, content, etag, last_modified)``; raises
+    ``requests.RequestException`` on errors.
+    """
+    if MANIFEST_MIRROR == "local":
+        from manuscript.iiif_mirror import read_manifest
+
+        content, digest = read_manifest(manifest_url)
+        etag = f'"{digest}"'
+        if headers.get("If-None-Match") == etag:
+            return 304, b"", etag, None
+        return 200, content, etag, None
+
+    if MANIFEST_MIRROR:
+        from manuscript.iiif_mirror import mirror_url
+
+        manifest_url = mirror_url(manifest_url, MANIFEST_MIRROR)
+    response = get_session().get(
+        manifest_url, headers=headers, timeout=MANIFEST_TIMEOUT
+    )
+    if response.status_code != 304:
+        response.raise_for_status()
+    return (
+        response.status_code,
+        response.content,
+        response.headers.get("ETag"),
+        response.headers.get("Last-Modified"),
+    )
+
+
+def fetch_manifest(manifest_url, entry=None):
+    """Download a manifest, revalidating ``entry`` if one is given, and
+    cache the result.
+
+    Returns the cache entry: a dict holding the ``manifest``, its
+    ``canvases`` index and the validators needed to revalidate it. Raises
+    ``ManifestUnavailable``.
+    """
+    headers = {}
+    if entry:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    started = time.monotonic()
+    try:
+        status, content, etag, last_modified = request_manifest(manifest_url, headers)
+        if entry and status == 304:
+            entry = {**entry, "fetched_at": time.time(), "status": 304}
+        else:
+            manifest = json.loads(content)
+            entry = {
+                "manifest": manifest,
+                "canvases": build_canvas_index(manifest),
+                "etag": etag,
+                "last_modified": last_modified,
+                "fetched_at": time.time(),
+                "size": len(content),
+                "status": status,
+            }
+    except (requests.RequestException, ValueError) as e:
+        logger.warning(f"Could not fetch IIIF manifest {manifest_url}: {e}")
+        cache.set(failure_cache_key(manifest_url), str(e), MANIFEST_FAILURE_TTL)
+        raise ManifestUnavailable(f"{manifest_url}: {e}") from e
+
+    entry["latency"] = time.monotonic() - started
+    cache.set(manifest_cache_key(manifest_url), entry, MANIFEST_KEEP_FOR)
+    local_manifests.put(manifest_url, entry)
+    cache.delete(failure_cache_key(manifest_url))
+    return entry
+
+
+def refresh_in_background(manifest_url, entry):
+    """Revalidate a stale manifest on a daemon thread, once at a time."""
+    with _refreshing_lock:
+        if manifest_url in _refreshing:
+            return
+        _refreshing.add(manifest_url)
+
+    def refresh():
+        try:
+            fetch_manifest(manifest_url, entry)
+        except ManifestUnavailable:
+            pass  # Keep serving the stale copy
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(manifest_url)
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+
+def get_manifest_entry(manifest_url):
+    """Return the cache entry for a manifest, fetching it if needed."""
+    entry = local_manifests.get(manifest_url)
+    if entry is None:
+        entry = cache.get(manifest_cache_key(manifest_url))
+        if entry is not None:
+            local_manifests.count("shared_hits")
+            if "canvases" not in entry:
+                # Cached before canvas indexes were stored with the manifest
+                entry["canvases"] = build_canvas_index(entry["manifest"])
+                cache.set(manifest_cache_key(manifest_url), entry, MANIFEST_KEEP_FOR)
+            local_manifests.put(manifest_url, entry)
+
+    if entry is not None:
+        stale = time.time() - entry["fetched_at"] > MANIFEST_FRESH_FOR
+        if stale and cache.get(failure_cache_key(manifest_url)) is None:
+            refresh_in_background(manifest_url, entry)
+        return entry
+
+    local_manifests.count("misses")
+    failure = cache.get(failure_cache_key(manifest_url))
+    if failure is not None:
+        raise ManifestUnavailable(f"{manifest_url}: {failure}")
+    return fetch_manifest(manifest_url)
+
+
+def get_manifest(manifest_url):
+    """Return a manifest as parsed JSON. Raises ``ManifestUnavailable``."""
+    return get_manifest_entry(manifest_url)["manifest"]
+
+
+def get_canvas_index(manifest_url):
+    """Return the canvas index of a manifest. Raises ``ManifestUnavailable``."""
+    return get_manifest_entry(manifest_url)["canvases"]
+
+
+def canvas_id_for_label(manifest_url, label):
+    """Return the id of the canvas labelled like ``label``, or None."""
+    if not manifest_url or not label:
+        return None
+    try:
+        labels = get_canvas_index(manifest_url)["labels"]
+    except ManifestUnavailable:
+        return None
+    return labels.get(normalize_folio_label(label))
+
+
+def canvas_id_for_page(manifest_url, page_number):
+    """Return the id of the canvas at a 1-based page number, or None."""
+    if not manifest_url:
+        return None
+    try:
+        position = int(page_number) - 1
+        pages = get_canvas_index(manifest_url)["pages"]
+    except (ValueError, TypeError, ManifestUnavailable):
+        return None
+    return pages[position] if 0 <= position < len(pages) else None
+
+
+def get_manifest_projection(manifest_url, labels):
+    """Return the projection of a manifest onto the folios ``labels``,
+    building it from the manifest only on a cache miss. Raises
+    ``ManifestUnavailable``.
+    """
+    labels = [str(label) for label in labels if label]
+    cache_key = projection_cache_key(manifest_url, labels)
+    projection = cache.get(cache_key)
+    if projection is None:
+        manifest = get_manifest_entry(manifest_url)["manifest"]
+        projection = build_manifest_projection(manifest, labels)
+        cache.set(cache_key, projection, MANIFEST_FRESH_FOR)
+    return projection
+
+
+def resolve_batch(function, arguments, deadline=None):
+    """Call ``function(*args)`` for each ``key: args`` in ``arguments``
+    concurrently and wait until all are done or ``deadline`` seconds pass.
+
+    Returns ``{key: BatchResult}``. An exception raised by a call marks its
+    result ``FAILED``; calls still running at the deadline
+    are marked ``PENDING`` and left to finish in the background.
+    """
+    deadline = MANIFEST_BATCH_DEADLINE if deadline is None else deadline
+    executor = get_executor()
+    futures = {key: executor.submit(function, *args) for key, args in arguments.items()}
+    wait(futures.values(), timeout=deadline)
+
+    results = {}
+    for key, future in futures.items():
+        if not future.done():
+            results[key] = BatchResult(None, PENDING)
+            continue
+        try:
+            results[key] = BatchResult(future.result(), READY)
+        except ManifestUnavailable:
+            results[key] = BatchResult(None, FAILED)
+        except Exception:
+            # A manifest the projection can't make sense of fails on its own
+            logger.exception(f"Could not resolve {key}")
+            results[key] = BatchResult(None, FAILED)
+    return results
+
+
+def get_manifests(manifest_urls, deadline=None):
+    """Return ``{url: BatchResult}`` holding each manifest's parsed JSON."""
+    return resolve_batch(
+        get_manifest, {url: (url,) for url in set(manifest_urls)}, deadline
+    )
+
+
+def get_manifest_projections(folios_by_url, deadline=None):
+    """Project many manifests at once; ``folios_by_url`` maps each manifest
+    URL to the folio labels wanted from it.
+
+    Returns ``{url: BatchResult}``. Projections already cached are read in
+    one round trip; only the others are built on the thread pool.
+    """
+    folios_by_url = {
+        url: [str(label) for label in labels if label]
+        for url, labels in folios_by_url.items()
+    }
+    cache_keys = {
+        url: projection_cache_key(url, labels) for url, labels in folios_by_url.items()
+    }
+    cached = cache.get_many(list(cache_keys.values()))
+
+    results = {}
+    missing = {}
+    for url, labels in folios_by_url.items():
+        if cache_keys[url] in cached:
+            results[url] = BatchResult(cached[cache_keys[url]], READY)
+        else:
+            missing[url] = (url, labels)
+    if missing:
+        results.update(resolve_batch(get_manifest_projection, missing, deadline))
+    return results
@@ -0,0 +1,467 @@
+"""IIIF Image API 3.0 server for the images uploaded to the site.
+
+Folio images (``Folio.image``) and manuscript photographs
+(``SingleManuscript.photographs``) are served under the identifiers
+``folio-<id>`` and ``photograph-<id>``, so Tify and Mirador can deep-zoom them
+tile by tile instead of downloading the originals. The tiles and sizes
+``info.json`` advertises are rendered with Pillow on first request and written
+under ``IIIF_IMAGE_CACHE_ROOT``, keyed on the source file's name, size and
+modification time, so a replaced upload gets fresh tiles and everything else
+is served straight from disk. Any other region or size is rendered in memory
+and not stored, and only up to ``IIIF_IMAGE_MAX_UNCACHED_AREA`` pixels, so
+arbitrary requests can't fill the disk.
+
+``image_manifest`` builds a Presentation 3 manifest of a manuscript's local
+images for the viewers.
+"""
+
+import hashlib
+import math
+import os
+import tempfile
+from collections import namedtuple
+from io import BytesIO
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from manuscript.folio_index import FolioRangeIndex
+from manuscript.models import Folio, SingleManuscript
+
+TILE_SIZE = getattr(settings, "IIIF_IMAGE_TILE_SIZE", 512)
+# Largest width or height the server renders
+MAX_SIZE = getattr(settings, "IIIF_IMAGE_MAX_SIZE", 4096)
+# Largest output, in pixels, rendered for a request that isn't stored
+MAX_UNCACHED_AREA = getattr(settings, "IIIF_IMAGE_MAX_UNCACHED_AREA", 1024 * 1024)
+THUMBNAIL_WIDTH = getattr(settings, "IIIF_THUMBNAIL_WIDTH", 200)
+CACHE_ROOT = getattr(
+    settings,
+    "IIIF_IMAGE_CACHE_ROOT",
+    os.path.join(settings.MEDIA_ROOT, "iiif_cache"),
+)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".tif", ".tiff")
+FORMATS = {
+    "jpg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+    "webp": ("WEBP", "image/webp"),
+}
+QUALITIES = ("default", "color", "gray")
+
+IMAGE_CONTEXT = "http://iiif.io/api/image/3/context.json"
+
+# ``key`` names the rendered image uniquely; ``path`` is set when it is
+# stored on disk, ``content`` when it was rendered in memory
+RenderedImage = namedtuple("RenderedImage", ["key", "content_type", "path", "content"])
+PRESENTATION_CONTEXT = "http://iiif.io/api/presentation/3/context.json"
+
+
+class InvalidImageRequest(ValueError):
+    """A region, size, rotation, quality or format the server can't serve."""
+
+
+class ImageSource:
+    """An uploaded image and its pixel dimensions."""
+
+    def __init__(self, identifier, name):
+        self.identifier = identifier
+        self.name = name
+        try:
+            modified = default_storage.get_modified_time(name).timestamp()
+        except NotImplementedError:
+            modified = ""
+        self.fingerprint = hashlib.md5(
+            f"{name}:{default_storage.size(name)}:{modified}".encode()
+        ).hexdigest()
+
+        size_key = f"iiif_image_size_{self.fingerprint}"
+        size = cache.get(size_key)
+        if size is None:
+            with default_storage.open(name) as f:
+                size = Image.open(f).size
+            cache.set(size_key, size, None)
+        self.width, self.height = size
+
+
+def source_name(identifier):
+    """Return the storage name of the upload behind an identifier, or None."""
+    kind, _, pk = identifier.partition("-")
+    if not pk.isdigit():
+        return None
+    if kind == "folio":
+        name = Folio.objects.filter(pk=pk).values_list("image", flat=True).first()
+    elif kind == "photograph":
+        name = (
+            SingleManuscript.objects.filter(pk=pk)
+            .values_list("photographs", flat=True)
+            .first()
+        )
+    else:
+        return None
+    if not name or not name.lower().endswith(IMAGE_EXTENSIONS):
+        return None
+    return name
+
+
+def get_image_source(identifier):
+    """Return the ``ImageSource`` for an identifier, or None."""
+    name = source_name(identifier)
+    if name is None or not default_storage.exists(name):
+        return None
+    return ImageSource(identifier, name)
+
+
+def parse_region(region, width, height):
+    """Return the region as ``(x, y, w, h)`` clipped to the image."""
+    if region == "full":
+        return 0, 0, width, height
+    if region == "square":
+        side = min(width, height)
+        return (width - side) // 2, (height - side) // 2, side, side
+
+    try:
+        if region.startswith("pct:"):
+            x, y, w, h = (float(value) for value in region[4:].split(","))
+            x, y = round(x * width / 100), round(y * height / 100)
+            w, h = round(w * width / 100), round(h * height / 100)
+        else:
+            x, y, w, h = (int(value) for value in region.split(","))
+    except ValueError:
+        raise InvalidImageRequest(f"Invalid region {region!r}")
+
+    w, h = min(w, width - x), min(h, height - y)
+    if x < 0 or y < 0 or w <= 0 or h <= 0:
+        raise InvalidImageRequest(f"Region {region!r} is outside the image")
+    return x, y, w, h
+
+
+def parse_size(size, region_width, region_height):
+    """Return the output ``(width, height)`` for a size parameter."""
+    if size.startswith("^"):
+        raise InvalidImageRequest("Upscaling is not supported")
+
+    if size in ("max", "full"):
+        scale = min(1, MAX_SIZE / max(region_width, region_height))
+        return (
+            max(1, round(region_width * scale)),
+            max(1, round(region_height * scale)),
+        )
+
+    try:
+        if size.startswith("pct:"):
+            scale = float(size[4:]) / 100
+            w, h = round(region_width * scale), round(region_height * scale)
+        else:
+            confined = size.startswith("!")
+            w, _, h = size.lstrip("!").partition(",")
+            w, h = int(w) if w else None, int(h) if h else None
+            if w is None and h is None:
+                raise ValueError
+            if confined:
+                scale = min(w / region_width, h / region_height)
+                w, h = round(region_width * scale), round(region_height * scale)
+            elif h is None:
+                h = round(region_height * w / region_width)
+            elif w is None:
+                w = round(region_width * h / region_height)
+    except (ValueError, TypeError, ZeroDivisionError):
+        raise InvalidImageRequest(f"Invalid size {size!r}")
+
+    w, h = max(1, w), max(1, h)
+    if w > region_width or h > region_height:
+        raise InvalidImageRequest(f"Size {size!r} is larger than the region")
+    if max(w, h) > MAX_SIZE:
+        raise InvalidImageRequest(f"Size {size!r} is larger than {MAX_SIZE}")
+    return w, h
+
+
+def parse_rotation(rotation):
+    """Return ``(mirrored, degrees)``; only multiples of 90 are supported."""
+    mirrored = rotation.startswith("!")
+    try:
+        degrees = float(rotation.lstrip("!"))
+    except ValueError:
+        raise InvalidImageRequest(f"Invalid rotation {rotation!r}")
+    if degrees % 90 or not 0 <= degrees < 360:
+        raise InvalidImageRequest("Only rotations by multiples of 90 are supported")
+    return mirrored, int(degrees)
+
+
+def matches_size(size, listed):
+    # Viewers ask for "w," and the height is rounded, so allow it to be off by one
+    return size[0] == listed[0] and abs(size[1] - listed[1]) <= 1
+
+
+def is_canonical(source, region, size, mirrored, degrees, quality, fmt):
+    """Whether a request is one of the tiles or sizes ``info.json`` lists,
+    which are the only images stored on disk.
+    """
+    if mirrored or degrees or quality not in ("default", "color") or fmt != "jpg":
+        return False
+    x, y, w, h = region
+    if (x, y, w, h) == (0, 0, source.width, source.height):
+        return any(matches_size(size, listed) for listed in canonical_sizes(source))
+    for factor in scale_factors(source.width, source.height):
+        span = TILE_SIZE * factor
+        if (
+            x % span == 0
+            and y % span == 0
+            and w == min(span, source.width - x)
+            and h == min(span, source.height - y)
+        ):
+            return matches_size(size, (math.ceil(w / factor), math.ceil(h / factor)))
+    return False
+
+
+def draw_image(source, region, size, mirrored, degrees, quality, pil_format):
+    """Render a request with Pillow and return the encoded image."""
+    x, y, w, h = region
+    width, height = size
+    with default_storage.open(source.name) as f:
+        image = Image.open(f)
+        # Let JPEG decode at a reduced scale when the output is much smaller
+        image.draft(
+            "RGB",
+            (
+                math.ceil(source.width * width / w),
+                math.ceil(source.height * height / h),
+            ),
+        )
+        if image.mode not in ("RGB", "RGBA", "L"):
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+        factor = image.width / source.width
+        image = image.resize(
+            (width, height),
+            Image.LANCZOS,
+            box=(x * factor, y * factor, (x + w) * factor, (y + h) * factor),
+        )
+
+    if mirrored:
+        image = ImageOps.mirror(image)
+    if degrees:
+        image = image.rotate(-degrees, expand=True)
+    if quality == "gray":
+        image = image.convert("L")
+    elif pil_format == "JPEG" and image.mode == "RGBA":
+        image = image.convert("RGB")
+
+    buffer = BytesIO()
+    image.save(buffer, pil_format, quality=85)
+    return buffer.getvalue()
+
+
+def render_image(source, region, size, rotation, quality, fmt):
+    """Return the requested image as a ``RenderedImage``.
+
+    Canonical tiles and sizes are rendered once and stored on disk; anything
+    else is rendered for this request only, up to ``MAX_UNCACHED_AREA``
+    pixels.
+    """
+    if quality not in QUALITIES:
+        raise InvalidImageRequest(f"Unsupported quality {quality!r}")
+    if fmt not in FORMATS:
+        raise InvalidImageRequest(f"Unsupported format {fmt!r}")
+    pil_format, content_type = FORMATS[fmt]
+
+    x, y, w, h = parse_region(region, source.width, source.height)
+    width, height = parse_size(size, w, h)
+    mirrored, degrees = parse_rotation(rotation)
+
+    # Equivalent requests share one key
+    key = os.path.join(
+        source.identifier,
+        source.fingerprint,
+        f"{x},{y},{w},{h}",
+        f"{width},{height}",
+        f"{'!' if mirrored else ''}{degrees}",
+        f"{'gray' if quality == 'gray' else 'default'}.{fmt}",
+    )
+    request = ((x, y, w, h), (width, height), mirrored, degrees, quality)
+
+    if not is_canonical(source, *request, fmt):
+        if width * height > MAX_UNCACHED_AREA:
+            raise InvalidImageRequest(
+                f"Only the tiles and sizes in info.json are served larger than "
+                f"{MAX_UNCACHED_AREA} pixels"
+            )
+        content = draw_image(source, *request, pil_format)
+        return RenderedImage(key, content_type, None, content)
+
+    path = Path(CACHE_ROOT) / key
+    if not path.exists():
+        content = draw_image(source, *request, pil_format)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=f".{fmt}")
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp, path)
+    return RenderedImage(key, content_type, path, None)
+
+
+def scale_factors(width, height):
+    """Powers of two down to the one at which a single tile covers the image."""
+    factors = [1]
+    while max(width, height) / factors[-1] > TILE_SIZE:
+        factors.append(factors[-1] * 2)
+    return factors
+
+
+def canonical_sizes(source):
+    """The whole-image sizes ``info.json`` lists, smallest first: each scale
+    factor's, the thumbnail's and ``max``.
+    """
+    sizes = {
+        (math.ceil(source.width / factor), math.ceil(source.height / factor))
+        for factor in scale_factors(source.width, source.height)
+    }
+    if source.width > THUMBNAIL_WIDTH:
+        sizes.add(
+            (
+                THUMBNAIL_WIDTH,
+                max(1, round(source.height * THUMBNAIL_WIDTH / source.width)),
+            )
+        )
+    scale = min(1, MAX_SIZE / max(source.width, source.height))
+    sizes.add(
+        (max(1, round(source.width * scale)), max(1, round(source.height * scale)))
+    )
+    return sorted(size for size in sizes if max(size) <= MAX_SIZE)
+
+
+def image_info(source, image_url):
+    """Return the ``info.json`` of an image served at ``image_url``."""
+    sizes = [
+        {"width": width, "height": height} for width, height in canonical_sizes(source)
+    ]
+    return {
+        "@context": IMAGE_CONTEXT,
+        "id": image_url,
+        "type": "ImageService3",
+        "protocol": "http://iiif.io/api/image",
+        "profile": "level1",
+        "width": source.width,
+        "height": source.height,
+        "maxWidth": min(source.width, MAX_SIZE),
+        "maxHeight": min(source.height, MAX_SIZE),
+        "sizes": sizes,
+        "tiles": [
+            {
+                "width": TILE_SIZE,
+                "scaleFactors": scale_factors(source.width, source.height),
+            }
+        ],
+        "extraFormats": ["png", "webp"],
+        "extraQualities": ["color", "gray"],
+        "extraFeatures": [
+            "mirroring",
+            "regionByPct",
+            "rotationBy90s",
+            "sizeByConfinedWh",
+            "sizeByPct",
+        ],
+    }
+
+
+def manuscript_image_sources(manuscript):
+    """Return ``(label, ImageSource)`` for each local image of a manuscript:
+    its folio images in folio order, then its photographs.
+    """
+    # Folios follow the poem by their line-code ranges; folio numbers don't
+    # sort ("10r" < "2r"). Folios without a range come last.
+    ranges = FolioRangeIndex.for_manuscript(manuscript).ranges
+    position = {folio_range.folio_id: index for index, folio_range in enumerate(ranges)}
+    folios = sorted(
+        Folio.objects.filter(manuscript=manuscript)
+        .exclude(image="")
+        .exclude(image__isnull=True),
+        key=lambda folio: (position.get(folio.pk, len(position)), folio.pk),
+    )
+    sources = []
+    for folio in folios:
+        source = get_image_source(f"folio-{folio.pk}")
+        if source is not None:
+            sources.append((folio.folio_number or f"Folio {folio.pk}", source))
+    if manuscript.photographs:
+        source = get_image_source(f"photograph-{manuscript.pk}")
+        if source is not None:
+            sources.append(("Photographs", source))
+    return sources
+
+
+def image_manifest(manuscript, manifest_url, image_url):
+    """Return a Presentation 3 manifest of a manuscript's local images.
+
+    ``image_url(identifier)`` gives the base URL an image is served under.
+    """
+    canvases = []
+    for position, (label, source) in enumerate(manuscript_image_sources(manuscript)):
+        canvas_id = f"{manifest_url.rsplit('/', 1)[0]}/canvas/{position + 1}"
+        service = image_url(source.identifier)
+        canvases.append(
+            {
+                "id": canvas_id,
+                "type": "Canvas",
+                "label": {"none": [label]},
+                "width": source.width,
+                "height": source.height,
+                "thumbnail": [
+                    {
+                        "id": f"{service}/full/{THUMBNAIL_WIDTH},/0/default.jpg",
+                        "type": "Image",
+                        "format": "image/jpeg",
+                    }
+                ],
+                "items": [
+                    {
+                        "id": f"{canvas_id}/page",
+                        "type": "AnnotationPage",
+                        "items": [
+                            {
+                                "id": f"{canvas_id}/image",
+                                "type": "Annotation",
+                                "motivation": "painting",
+                                "target": canvas_id,
+                                "body": {
+                                    "id": f"{service}/full/max/0/default.jpg",
+                                    "type": "Image",
+                                    "format": "image/jpeg",
+                                    "width": source.width,
+                                    "height": source.height,
+                                    "service": [
+                                        {
+                                            "id": service,
+                                            "type": "ImageService3",
+                                            "profile": "level1",
+                                        }
+                                    ],
+                                },
+                            }
+                        ],
+                    }
+                ],
+            }
+        )
+    return {
+        "@context": PRESENTATION_CONTEXT,
+        "id": manifest_url,
+        "type": "Manifest",
+        "label": {"none": [manuscript.siglum or str(manuscript)]},
+        "items": canvases,
+    }
+
+
+def has_local_images(manuscript):
+    """Whether a manuscript has uploaded images to build a manifest from."""
+    if manuscript.photographs and manuscript.photographs.name.lower().endswith(
+        IMAGE_EXTENSIONS
+    ):
+        return True
+    return (
+        Folio.objects.filter(manuscript=manuscript)
+        .exclude(image="")
+        .exclude(image__isnull=True)
+        .exists()
+    )
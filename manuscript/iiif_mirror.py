@@ -0,0 +1,186 @@
+"""Content-addressed local mirror of the IIIF manifests.
+
+``manage.py mirror_manifests`` snapshots manifests into
+``IIIF_MANIFEST_MIRROR_ROOT``. Each distinct manifest body is stored once,
+under its SHA-256, in ``objects/``; ``index.json`` maps every manifest URL to
+the digest of its latest snapshot. With ``IIIF_MANIFEST_MIRROR`` set,
+``manuscript.iiif`` reads manifests from here instead of the IIIF servers,
+and ``manage.py serve_manifest_mirror`` serves the mirror over HTTP so
+latency and throughput can be measured without the network.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import requests
+from django.conf import settings
+
+from manuscript.iiif import MANIFEST_TIMEOUT, ManifestUnavailable, get_session
+
+logger = logging.getLogger(__name__)
+
+MIRROR_ROOT = getattr(settings, "IIIF_MANIFEST_MIRROR_ROOT", "iiif_mirror")
+
+_index_lock = threading.Lock()
+
+
+def url_key(manifest_url):
+    """Return the name a manifest URL is served under by the stand-in."""
+    return hashlib.md5(manifest_url.encode()).hexdigest()
+
+
+def mirror_url(manifest_url, base_url):
+    """Return the stand-in server's URL for a manifest."""
+    return f"{base_url.rstrip('/')}/manifests/{url_key(manifest_url)}.json"
+
+
+def object_path(digest, root=None):
+    return Path(root or MIRROR_ROOT) / "objects" / digest[:2] / f"{digest}.json"
+
+
+def index_path(root=None):
+    return Path(root or MIRROR_ROOT) / "index.json"
+
+
+def _write_atomic(path, content):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+
+def load_index(root=None):
+    """Return ``{manifest_url: record}`` for every mirrored manifest."""
+    try:
+        return json.loads(index_path(root).read_text())
+    except FileNotFoundError:
+        return {}
+
+
+def store_object(content, root=None):
+    """Store a manifest body under its digest, once, and return the digest."""
+    digest = hashlib.sha256(content).hexdigest()
+    path = object_path(digest, root)
+    if not path.exists():
+        _write_atomic(path, content)
+    return digest
+
+
+def snapshot_manifest(manifest_url, root=None):
+    """Download a manifest into the mirror.
+
+    Returns its index record, with ``changed`` telling whether the body
+    differs from the previous snapshot. Raises ``ManifestUnavailable``.
+    """
+    try:
+        response = get_session().get(manifest_url, timeout=MANIFEST_TIMEOUT)
+        response.raise_for_status()
+        response.json()
+    except (requests.RequestException, ValueError) as e:
+        raise ManifestUnavailable(f"{manifest_url}: {e}") from e
+
+    digest = store_object(response.content, root)
+    record = {
+        "sha256": digest,
+        "key": url_key(manifest_url),
+        "size": len(response.content),
+        "fetched_at": time.time(),
+    }
+    with _index_lock:
+        index = load_index(root)
+        previous = index.get(manifest_url, {}).get("sha256")
+        index[manifest_url] = record
+        _write_atomic(
+            index_path(root), json.dumps(index, indent=2, sort_keys=True).encode()
+        )
+    return {**record, "changed": previous != digest}
+
+
+def read_manifest(manifest_url, root=None):
+    """Return ``(content, digest)`` of the mirrored copy of a manifest.
+
+    Raises ``ManifestUnavailable`` if the manifest has not been mirrored.
+    """
+    record = load_index(root).get(manifest_url)
+    if record is None:
+        raise ManifestUnavailable(f"{manifest_url}: not in the manifest mirror")
+    try:
+        return object_path(record["sha256"], root).read_bytes(), record["sha256"]
+    except OSError as e:
+        raise ManifestUnavailable(f"{manifest_url}: {e}") from e
+
+
+class MirrorRequestHandler(BaseHTTPRequestHandler):
+    """Serve mirrored manifests as ``/manifests/<url key>.json``, with the
+    content digest as ETag, and the index as ``/index.json``.
+    """
+
+    root = None
+    delay = 0
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def send_body(self, content, etag=None):
+        if etag and self.headers.get("If-None-Match") == etag:
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/ld+json")
+        self.send_header("Content-Length", str(len(content)))
+        if etag:
+            self.send_header("ETag", etag)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(content)
+
+    def do_GET(self):
+        if self.delay:
+            time.sleep(self.delay)
+
+        path = self.path.split("?", 1)[0]
+        if path == "/index.json":
+            self.send_body(json.dumps(load_index(self.root)).encode())
+            return
+
+        key = path.removeprefix("/manifests/").removesuffix(".json")
+        record = next(
+            (
+                record
+                for record in load_index(self.root).values()
+                if record["key"] == key
+            ),
+            None,
+        )
+        try:
+            content = object_path(record["sha256"], self.root).read_bytes()
+        except (TypeError, OSError):
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        self.send_body(content, etag=f'"{record["sha256"]}"')
+
+    do_HEAD = do_GET
+
+
+def make_mirror_server(host, port, root=None, delay=0):
+    """Return an HTTP server for the mirror; ``delay`` in seconds is added to
+    every response to stand in for network latency.
+    """
+    handler = type(
+        "MirrorRequestHandler",
+        (MirrorRequestHandler,),
+        {"root": root or MIRROR_ROOT, "delay": delay},
+    )
+    return ThreadingHTTPServer((host, port), handler)
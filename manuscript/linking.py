@@ -0,0 +1,91 @@
+"""Bulk linking of stanzas to the folios they appear on.
+
+The links in ``Stanza.folios`` follow from each folio's line-code range. This
+module works them out for a whole manuscript in one pass over the stanzas,
+compares them with the links already stored, and writes only the difference
+with bulk inserts and deletes.
+"""
+
+import logging
+from collections import defaultdict, namedtuple
+
+from django.db import transaction
+
+from manuscript.edition import invalidate_edition_layouts, invalidate_for_stanzas
+from manuscript.folio_index import FolioRangeIndex
+from manuscript.models import Stanza
+from manuscript.revisions import CONTENT, bump_revision
+
+logger = logging.getLogger(__name__)
+
+StanzaFolio = Stanza.folios.through
+
+LinkChanges = namedtuple("LinkChanges", ["added", "removed", "unchanged"])
+
+
+def compute_folio_links(folio_index):
+    """Return the ``(stanza_id, folio_id)`` pairs implied by the index."""
+    links = set()
+    stanza_codes = Stanza.objects.exclude(stanza_line_code_starts_numeric__isnull=True)
+    for stanza_id, start, end in stanza_codes.values_list(
+        "id", "stanza_line_code_starts_numeric", "stanza_line_code_ends_numeric"
+    ):
+        for folio_range in folio_index.folios_between(start, end or start):
+            links.add((stanza_id, folio_range.folio_id))
+    return links
+
+
+def link_stanzas_to_folios(manuscript, dry_run=False, batch_size=1000):
+    """Bring the stanza links of a manuscript's folios in line with their
+    line-code ranges.
+
+    Only folios with a line-code range are managed here; links to folios
+    without one were made by hand and are left alone.
+    """
+    folio_index = FolioRangeIndex.for_manuscript(manuscript)
+    wanted = compute_folio_links(folio_index)
+    existing = set(
+        StanzaFolio.objects.filter(folio_id__in=list(folio_index.by_folio)).values_list(
+            "stanza_id", "folio_id"
+        )
+    )
+
+    changes = LinkChanges(
+        added=wanted - existing,
+        removed=existing - wanted,
+        unchanged=len(wanted & existing),
+    )
+    if dry_run or not (changes.added or changes.removed):
+        return changes
+
+    with transaction.atomic():
+        StanzaFolio.objects.bulk_create(
+            [
+                StanzaFolio(stanza_id=stanza_id, folio_id=folio_id)
+                for stanza_id, folio_id in changes.added
+            ],
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+
+        removed_by_folio = defaultdict(list)
+        for stanza_id, folio_id in changes.removed:
+            removed_by_folio[folio_id].append(stanza_id)
+        for folio_id, stanza_ids in removed_by_folio.items():
+            StanzaFolio.objects.filter(
+                folio_id=folio_id, stanza_id__in=stanza_ids
+            ).delete()
+
+        # Bulk writes skip m2m_changed, so drop the layouts here. Stanzas are
+        # shared, and every layout that shows a changed stanza lists its folios.
+        invalidate_edition_layouts([manuscript.pk])
+        invalidate_for_stanzas(
+            {stanza_id for stanza_id, _ in changes.added | changes.removed}
+        )
+        bump_revision(CONTENT)
+
+    logger.info(
+        f"Linked stanzas for {manuscript.siglum}: "
+        f"{len(changes.added)} added, {len(changes.removed)} removed"
+    )
+    return changes
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from manuscript.edition import rebuild_edition_layout
+from manuscript.models import SingleManuscript
+
+
+class Command(BaseCommand):
+    help = "Build the stored edition layout used by the manuscript stanza pages."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--siglum",
+            type=str,
+            help="Only rebuild the layout for the manuscript with this siglum",
+        )
+
+    def handle(self, *args, **options):
+        manuscripts = SingleManuscript.objects.all()
+        if options.get("siglum"):
+            manuscripts = manuscripts.filter(siglum=options["siglum"])
+
+        for manuscript in manuscripts:
+            try:
+                edition_layout = rebuild_edition_layout(manuscript)
+                stanza_pairs = sum(
+                    len(book["pairs"]) for book in edition_layout.layout["books"]
+                )
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"{manuscript.siglum}: {stanza_pairs} stanza pairs"
+                    )
+                )
+            except Exception as e:
+                self.stdout.write(
+                    self.style.ERROR(f"{manuscript.siglum}: error building layout: {e}")
+                )
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from manuscript.toponym_slugs import rebuild_slug_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the stored slug of every toponym and rebuild the index of "
+        "toponym and alias name slugs used to resolve gazetteer URLs."
+    )
+
+    def handle(self, *args, **options):
+        updated, rows = rebuild_slug_index()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Updated {updated} toponym slugs; indexed {rows} name slugs"
+            )
+        )
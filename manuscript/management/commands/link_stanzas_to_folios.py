@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from manuscript.linking import link_stanzas_to_folios
+from manuscript.models import SingleManuscript
+
+
+class Command(BaseCommand):
+    help = "Link stanzas to the folios they appear on, based on the folios' line-code ranges."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--siglum",
+            type=str,
+            help="Only link the folios of the manuscript with this siglum",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Show what would be done without making changes",
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options["dry_run"]
+        manuscripts = SingleManuscript.objects.all()
+        if options.get("siglum"):
+            manuscripts = manuscripts.filter(siglum=options["siglum"])
+
+        for manuscript in manuscripts:
+            changes = link_stanzas_to_folios(manuscript, dry_run=dry_run)
+            self.stdout.write(
+                f"{manuscript.siglum}: {len(changes.added)} links added, "
+                f"{len(changes.removed)} removed, {changes.unchanged} unchanged"
+            )
+
+        if dry_run:
+            self.stdout.write("\nThis was a dry run - no changes were made")
@@ -0,0 +1,74 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from manuscript.iiif import ManifestUnavailable
+from manuscript.iiif_mirror import MIRROR_ROOT, snapshot_manifest
+from manuscript.models import SingleManuscript
+from manuscript.utils import DEFAULT_MANIFEST_URL
+
+
+class Command(BaseCommand):
+    help = (
+        "Snapshot every referenced IIIF manifest into the local "
+        "content-addressed manifest mirror."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--root",
+            default=MIRROR_ROOT,
+            help="Directory of the mirror (default: IIIF_MANIFEST_MIRROR_ROOT)",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=4,
+            help="Number of manifests to download at the same time",
+        )
+        parser.add_argument(
+            "--manifest-url",
+            action="append",
+            dest="manifest_urls",
+            help="Mirror this manifest URL instead of the referenced ones (repeatable)",
+        )
+
+    def handle(self, *args, **options):
+        manifest_urls = options["manifest_urls"]
+        if not manifest_urls:
+            manifest_urls = {DEFAULT_MANIFEST_URL}
+            manifest_urls.update(
+                SingleManuscript.objects.exclude(
+                    Q(iiif_url__isnull=True) | Q(iiif_url="")
+                ).values_list("iiif_url", flat=True)
+            )
+        manifest_urls = sorted(set(manifest_urls))
+
+        failures = 0
+        with ThreadPoolExecutor(max_workers=max(1, options["concurrency"])) as pool:
+            futures = {
+                pool.submit(snapshot_manifest, url, options["root"]): url
+                for url in manifest_urls
+            }
+            for future in as_completed(futures):
+                manifest_url = futures[future]
+                try:
+                    record = future.result()
+                except ManifestUnavailable as e:
+                    failures += 1
+                    self.stdout.write(self.style.ERROR(f"FAILED {e}"))
+                    continue
+
+                status = "changed" if record["changed"] else "unchanged"
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"{manifest_url}: {status}, {record['size'] / 1024:.1f} KiB, "
+                        f"sha256 {record['sha256'][:12]}"
+                    )
+                )
+
+        self.stdout.write(
+            f"\nMirrored {len(manifest_urls) - failures} of {len(manifest_urls)} "
+            f"manifests into {options['root']}"
+        )
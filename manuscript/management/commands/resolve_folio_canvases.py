@@ -0,0 +1,80 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from manuscript.iiif import ManifestUnavailable, get_canvas_index, normalize_folio_label
+from manuscript.models import Folio, SingleManuscript
+from manuscript.revisions import bump_revision
+
+
+class Command(BaseCommand):
+    help = (
+        "Store on each folio the IIIF canvas whose label matches its folio number "
+        "in its manuscript's manifest."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--siglum",
+            type=str,
+            help="Only resolve the folios of the manuscript with this siglum",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Show what would be done without making changes",
+        )
+
+    def handle(self, *args, **options):
+        manuscripts = SingleManuscript.objects.exclude(
+            Q(iiif_url__isnull=True) | Q(iiif_url="")
+        )
+        if options.get("siglum"):
+            manuscripts = manuscripts.filter(siglum=options["siglum"])
+
+        changed = []
+        for manuscript in manuscripts:
+            try:
+                canvas_index = get_canvas_index(manuscript.iiif_url)
+            except ManifestUnavailable as e:
+                self.stdout.write(self.style.ERROR(f"{manuscript.siglum}: {e}"))
+                continue
+
+            positions = {
+                canvas_id: position
+                for position, canvas_id in enumerate(canvas_index["pages"])
+            }
+            matched = unmatched = 0
+            for folio in Folio.objects.filter(manuscript=manuscript):
+                canvas_id = None
+                if folio.folio_number:
+                    canvas_id = canvas_index["labels"].get(
+                        normalize_folio_label(folio.folio_number)
+                    )
+                if canvas_id:
+                    matched += 1
+                else:
+                    unmatched += 1
+                    if options["dry_run"]:
+                        self.stdout.write(f"  No canvas for folio {folio.folio_number}")
+
+                position = positions.get(canvas_id)
+                if (folio.canvas_id, folio.canvas_index) != (canvas_id, position):
+                    folio.canvas_id = canvas_id
+                    folio.canvas_index = position
+                    changed.append(folio)
+
+            self.stdout.write(
+                f"{manuscript.siglum}: {matched} folios matched, {unmatched} unmatched"
+            )
+
+        if options["dry_run"]:
+            self.stdout.write(f"\nWould update {len(changed)} folios (dry run)")
+            return
+
+        Folio.objects.bulk_update(
+            changed, ["canvas_id", "canvas_index"], batch_size=500
+        )
+        if changed:
+            # bulk_update sends no signals
+            bump_revision()
+        self.stdout.write(self.style.SUCCESS(f"\nUpdated {len(changed)} folios"))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from manuscript.models import SingleManuscript
+from manuscript.viewer import resolve_viewer_pages, stale_manuscripts
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the table of manifests and canvases the Mirador viewer opens "
+        "for each manuscript and page number."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--siglum",
+            type=str,
+            help="Only resolve the pages of the manuscript with this siglum",
+        )
+        parser.add_argument(
+            "--stale",
+            action="store_true",
+            help="Only resolve manuscripts whose manifest changed since the last run",
+        )
+
+    def handle(self, *args, **options):
+        if options["stale"]:
+            manuscripts = stale_manuscripts()
+        else:
+            manuscripts = SingleManuscript.objects.all()
+        if options.get("siglum"):
+            manuscripts = manuscripts.filter(siglum=options["siglum"])
+
+        resolved = resolve_viewer_pages(manuscripts)
+        for manuscript, pages in resolved.items():
+            if manuscript.iiif_url:
+                self.stdout.write(f"{manuscript.siglum}: {pages} pages resolved")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"\nResolved viewer pages for {len(resolved)} manuscripts"
+            )
+        )
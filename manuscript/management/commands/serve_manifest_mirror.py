@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from manuscript.iiif_mirror import MIRROR_ROOT, load_index, make_mirror_server
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve the local manifest mirror over HTTP as a stand-in for the IIIF "
+        "servers. Point IIIF_MANIFEST_MIRROR at the address it prints."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8001)
+        parser.add_argument(
+            "--root",
+            default=MIRROR_ROOT,
+            help="Directory of the mirror (default: IIIF_MANIFEST_MIRROR_ROOT)",
+        )
+        parser.add_argument(
+            "--delay",
+            type=float,
+            default=0,
+            help="Milliseconds to wait before each response, to simulate latency",
+        )
+
+    def handle(self, *args, **options):
+        server = make_mirror_server(
+            options["host"],
+            options["port"],
+            root=options["root"],
+            delay=options["delay"] / 1000,
+        )
+        self.stdout.write(
+            f"Serving {len(load_index(options['root']))} manifests from "
+            f"{options['root']} at http://{options['host']}:{options['port']}/"
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
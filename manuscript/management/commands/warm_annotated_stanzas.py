@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+
+from manuscript.annotated_text import warm_annotated_stanzas
+from manuscript.models import Stanza, StanzaTranslated
+
+
+class Command(BaseCommand):
+    help = (
+        "Render the annotated HTML of every stanza and translation into the cache. "
+        "Only useful with a cache shared between processes (see CACHE_URL)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Render stanzas again even if they are already cached",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of stanzas to render per cache round trip",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        for model in (Stanza, StanzaTranslated):
+            stanzas = model.objects.prefetch_related("annotations").order_by("id")
+            total = rendered = 0
+            batch = []
+            for stanza in stanzas.iterator(chunk_size=batch_size):
+                batch.append(stanza)
+                if len(batch) == batch_size:
+                    rendered += warm_annotated_stanzas(batch, force=options["force"])
+                    total += len(batch)
+                    batch = []
+            if batch:
+                rendered += warm_annotated_stanzas(batch, force=options["force"])
+                total += len(batch)
+
+            self.stdout.write(
+                f"{model._meta.verbose_name_plural.capitalize()}: rendered {rendered} of {total}"
+            )
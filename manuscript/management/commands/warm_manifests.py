@@ -0,0 +1,78 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from manuscript.iiif import ManifestUnavailable, fetch_manifest, manifest_cache_key
+from manuscript.models import SingleManuscript
+
+
+class Command(BaseCommand):
+    help = (
+        "Fetch the IIIF manifest of every manuscript into the manifest cache, "
+        "with its canvas index, and report latency and size per manifest."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=4,
+            help="Number of manifests to fetch at the same time",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Download manifests in full instead of revalidating cached copies",
+        )
+        parser.add_argument(
+            "--manifest-url",
+            action="append",
+            dest="manifest_urls",
+            help="Warm this manifest URL instead of the manuscripts' (repeatable)",
+        )
+
+    def warm(self, manifest_url, force):
+        entry = None if force else cache.get(manifest_cache_key(manifest_url))
+        return fetch_manifest(manifest_url, entry)
+
+    def handle(self, *args, **options):
+        manifest_urls = options["manifest_urls"]
+        if not manifest_urls:
+            manifest_urls = (
+                SingleManuscript.objects.exclude(
+                    Q(iiif_url__isnull=True) | Q(iiif_url="")
+                )
+                .values_list("iiif_url", flat=True)
+                .distinct()
+            )
+        manifest_urls = list(manifest_urls)
+
+        failures = 0
+        with ThreadPoolExecutor(max_workers=max(1, options["concurrency"])) as pool:
+            futures = {
+                pool.submit(self.warm, url, options["force"]): url
+                for url in manifest_urls
+            }
+            for future in as_completed(futures):
+                manifest_url = futures[future]
+                try:
+                    entry = future.result()
+                except ManifestUnavailable as e:
+                    failures += 1
+                    self.stdout.write(self.style.ERROR(f"FAILED {e}"))
+                    continue
+
+                status = "not modified" if entry["status"] == 304 else "fetched"
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"{manifest_url}: {status} in {entry['latency'] * 1000:.0f} ms, "
+                        f"{entry['size'] / 1024:.1f} KiB, "
+                        f"{len(entry['canvases']['pages'])} canvases"
+                    )
+                )
+
+        self.stdout.write(
+            f"\nWarmed {len(manifest_urls) - failures} of {len(manifest_urls)} manifests"
+        )
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("manuscript", "0116_alter_linecode_options_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EditionLayout",
+            fields=[
+                ("id", models.AutoField(primary_key=True, serialize=False)),
+                ("layout", models.JSONField(default=dict)),
+                (
+                    "uses_shared_stanzas",
+                    models.BooleanField(
+                        default=False,
+                        help_text="The layout falls back to every stanza with a line code, rather than the stanzas linked to this manuscript's folios.",
+                    ),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "manuscript",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="edition_layout",
+                        to="manuscript.singlemanuscript",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Edition layout",
+                "verbose_name_plural": "Edition layouts",
+            },
+        ),
+    ]
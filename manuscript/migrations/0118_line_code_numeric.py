@@ -0,0 +1,95 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:20
+
+from django.db import migrations
+
+import manuscript.fields
+
+
+def fill_line_code_numbers(apps, schema_editor):
+    for model_name in ("Folio", "LineCode", "Stanza", "StanzaTranslated"):
+        model = apps.get_model("manuscript", model_name)
+        code_fields = [
+            field
+            for field in model._meta.get_fields()
+            if isinstance(field, manuscript.fields.LineCodeField)
+        ]
+        objects = list(model.objects.all())
+        for obj in objects:
+            for field in code_fields:
+                setattr(
+                    obj,
+                    field.attname,
+                    field.code_from_string(getattr(obj, field.source)),
+                )
+        model.objects.bulk_update(
+            objects, [field.name for field in code_fields], batch_size=1000
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("manuscript", "0117_editionlayout"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="folio",
+            name="line_code_range_end_numeric",
+            field=manuscript.fields.LineCodeField(
+                bound="end", source="line_code_range_end"
+            ),
+        ),
+        migrations.AddField(
+            model_name="folio",
+            name="line_code_range_start_numeric",
+            field=manuscript.fields.LineCodeField(
+                end_field="line_code_range_end_numeric",
+                open_ended=True,
+                source="line_code_range_start",
+            ),
+        ),
+        migrations.AddField(
+            model_name="linecode",
+            name="code_end_numeric",
+            field=manuscript.fields.LineCodeField(bound="end", source="code"),
+        ),
+        migrations.AddField(
+            model_name="linecode",
+            name="code_numeric",
+            field=manuscript.fields.LineCodeField(
+                end_field="code_end_numeric", source="code"
+            ),
+        ),
+        migrations.AddField(
+            model_name="stanza",
+            name="stanza_line_code_ends_numeric",
+            field=manuscript.fields.LineCodeField(
+                bound="end", source="stanza_line_code_ends"
+            ),
+        ),
+        migrations.AddField(
+            model_name="stanza",
+            name="stanza_line_code_starts_numeric",
+            field=manuscript.fields.LineCodeField(
+                end_field="stanza_line_code_ends_numeric",
+                source="stanza_line_code_starts",
+            ),
+        ),
+        migrations.AddField(
+            model_name="stanzatranslated",
+            name="stanza_line_code_ends_numeric",
+            field=manuscript.fields.LineCodeField(
+                bound="end", source="stanza_line_code_ends"
+            ),
+        ),
+        migrations.AddField(
+            model_name="stanzatranslated",
+            name="stanza_line_code_starts_numeric",
+            field=manuscript.fields.LineCodeField(
+                end_field="stanza_line_code_ends_numeric",
+                source="stanza_line_code_starts",
+            ),
+        ),
+        migrations.RunPython(fill_line_code_numbers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("manuscript", "0118_line_code_numeric"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ContentRevision",
+            fields=[
+                ("id", models.AutoField(primary_key=True, serialize=False)),
+                ("name", models.CharField(max_length=50, unique=True)),
+                ("revision", models.PositiveBigIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name": "Content revision",
+                "verbose_name_plural": "Content revisions",
+            },
+        ),
+    ]
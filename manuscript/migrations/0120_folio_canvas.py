@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("manuscript", "0119_contentrevision"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="folio",
+            name="canvas_id",
+            field=models.URLField(
+                blank=True,
+                help_text="The canvas for this folio in the manuscript's IIIF manifest. Filled in by the resolve_folio_canvases command.",
+                max_length=500,
+                null=True,
+                verbose_name="IIIF canvas ID",
+            ),
+        ),
+        migrations.AddField(
+            model_name="folio",
+            name="canvas_index",
+            field=models.PositiveIntegerField(
+                blank=True,
+                help_text="The position of the canvas in the manifest, starting at 0.",
+                null=True,
+                verbose_name="IIIF canvas index",
+            ),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("manuscript", "0120_folio_canvas"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ViewerResolution",
+            fields=[
+                ("id", models.AutoField(primary_key=True, serialize=False)),
+                ("page_number", models.PositiveIntegerField(default=0)),
+                (
+                    "manifest_url",
+                    models.URLField(blank=True, max_length=255, null=True),
+                ),
+                ("canvas_id", models.URLField(blank=True, max_length=500, null=True)),
+                (
+                    "manuscript",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="viewer_resolutions",
+                        to="manuscript.singlemanuscript",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Viewer resolution",
+                "verbose_name_plural": "Viewer resolutions",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("manuscript", "page_number"),
+                        name="unique_viewer_resolution",
+                    )
+                ],
+            },
+        ),
+    ]
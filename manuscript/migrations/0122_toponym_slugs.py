@@ -0,0 +1,103 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils.text import slugify
+
+ALIAS_NAME_FIELDS = (
+    "placename_from_mss",
+    "placename_standardized",
+    "placename_modern",
+    "placename_alias",
+    "placename_ancient",
+)
+
+
+def fill_toponym_slugs(apps, schema_editor):
+    Location = apps.get_model("manuscript", "Location")
+    LocationAlias = apps.get_model("manuscript", "LocationAlias")
+    ToponymSlug = apps.get_model("manuscript", "ToponymSlug")
+
+    locations = list(Location.objects.all())
+    rows = []
+    for location in locations:
+        location.slug = (
+            slugify(location.name or "")
+            or slugify(location.placename_id or "")
+            or f"toponym-{location.id}"
+        )[:255]
+        rows.append(ToponymSlug(slug=location.slug, priority=0, location=location))
+    Location.objects.bulk_update(locations, ["slug"], batch_size=1000)
+
+    for alias in LocationAlias.objects.exclude(location__isnull=True):
+        seen = set()
+        for priority, field in enumerate(ALIAS_NAME_FIELDS, start=1):
+            slug = slugify(getattr(alias, field) or "")[:255]
+            if slug and slug not in seen:
+                seen.add(slug)
+                rows.append(
+                    ToponymSlug(
+                        slug=slug,
+                        priority=priority,
+                        location_id=alias.location_id,
+                        alias=alias,
+                    )
+                )
+    ToponymSlug.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("manuscript", "0121_viewerresolution"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="location",
+            name="slug",
+            field=models.SlugField(
+                blank=True,
+                default="",
+                editable=False,
+                help_text="Set from the name on save; names may share a slug.",
+                max_length=255,
+            ),
+        ),
+        migrations.CreateModel(
+            name="ToponymSlug",
+            fields=[
+                ("id", models.AutoField(primary_key=True, serialize=False)),
+                ("slug", models.SlugField(db_index=False, max_length=255)),
+                ("priority", models.PositiveSmallIntegerField(default=0)),
+                (
+                    "alias",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="slugs",
+                        to="manuscript.locationalias",
+                    ),
+                ),
+                (
+                    "location",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="slugs",
+                        to="manuscript.location",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Toponym slug",
+                "verbose_name_plural": "Toponym slugs",
+                "indexes": [
+                    models.Index(
+                        fields=["slug", "priority"], name="manuscript__slug_d4c856_idx"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(fill_toponym_slugs, migrations.RunPython.noop),
+    ]
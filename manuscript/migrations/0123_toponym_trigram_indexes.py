@@ -0,0 +1,51 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+TRIGRAM_INDEXES = {
+    "Location": ("name",),
+    "LocationAlias": (
+        "placename_from_mss",
+        "placename_standardized",
+        "placename_modern",
+        "placename_alias",
+        "placename_ancient",
+    ),
+}
+
+
+def trigram_index_names(apps):
+    for model_name, fields in TRIGRAM_INDEXES.items():
+        table = apps.get_model("manuscript", model_name)._meta.db_table
+        for field in fields:
+            yield table, field, f"{table}_{field}_trgm"
+
+
+def create_trigram_indexes(apps, schema_editor):
+    # GIN trigram indexes only exist on PostgreSQL; other databases search
+    # in process (see manuscript.toponym_search)
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for table, field, name in trigram_index_names(apps):
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" '
+            f'USING gin ("{field}" gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for _, _, name in trigram_index_names(apps):
+        schema_editor.execute(f'DROP INDEX IF EXISTS "{name}"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("manuscript", "0122_toponym_slugs"),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:53
+
+import re
+
+from django.db import migrations, models
+
+ORTHOGRAPHY = str.maketrans({"v": "u", "j": "i", "y": "i", "-": None, "_": None})
+DOUBLED = re.compile(r"([a-z])\1+")
+
+
+def fill_search_keys(apps, schema_editor):
+    ToponymSlug = apps.get_model("manuscript", "ToponymSlug")
+    rows = list(ToponymSlug.objects.all())
+    for row in rows:
+        row.search_key = DOUBLED.sub(r"\1", row.slug.translate(ORTHOGRAPHY))[:255]
+    ToponymSlug.objects.bulk_update(rows, ["search_key"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("manuscript", "0123_toponym_trigram_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="toponymslug",
+            name="search_key",
+            field=models.CharField(db_index=True, default="", max_length=255),
+        ),
+        migrations.RunPython(fill_search_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("manuscript", "0124_toponym_search_keys"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="viewerresolution",
+            name="stale",
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:40
+
+from django.db import migrations, models
+from django.utils.text import slugify
+
+
+def disambiguate_toponym_slugs(apps, schema_editor):
+    Location = apps.get_model("manuscript", "Location")
+    ToponymSlug = apps.get_model("manuscript", "ToponymSlug")
+
+    locations = list(Location.objects.order_by("placename_id", "id"))
+    existing = {location.slug for location in locations if location.slug}
+    taken = set()
+    changed = []
+    for location in locations:
+        slug = location.slug or None
+        if slug in taken:
+            # The lowest placename ID keeps the shared slug
+            for suffix in (slugify(location.placename_id or ""), str(location.id)):
+                candidate = f"{slug[:254 - len(suffix)]}-{suffix}"
+                if suffix and candidate not in existing and candidate not in taken:
+                    slug = candidate
+                    break
+        taken.add(slug)
+        if slug != location.slug:
+            location.slug = slug
+            changed.append(location)
+    Location.objects.bulk_update(changed, ["slug"], batch_size=1000)
+
+    for location in changed:
+        ToponymSlug.objects.filter(location=location, alias__isnull=True).update(
+            slug=location.slug
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("manuscript", "0125_viewerresolution_stale"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="location",
+            name="slug",
+            field=models.SlugField(
+                blank=True,
+                editable=False,
+                help_text="Set from the name on save; suffixed with the placename ID where names collide.",
+                max_length=255,
+                null=True,
+            ),
+        ),
+        migrations.RunPython(disambiguate_toponym_slugs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="location",
+            name="slug",
+            field=models.SlugField(
+                blank=True,
+                editable=False,
+                help_text="Set from the name on save; suffixed with the placename ID where names collide.",
+                max_length=255,
+                null=True,
+                unique=True,
+            ),
+        ),
+    ]
@@ -8,10 +8,10 @@ from django.contrib.contenttypes.fields import GenericRelation
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from django.db import models
-from django.db.models import Q
+from django.utils.text import slugify
 from prose.fields import RichTextField
 
-from manuscript.utils import get_canvas_id_for_folio
+from manuscript.fields import LineCodeField
 
 logger = logging.getLogger(__name__)
 
@@ -75,54 +75,25 @@ def get_stanzas_in_folio(folio) -> List["Stanza"]:
     Returns:
         List of Stanza objects that appear on this folio
     """
-    if not folio.line_code_range_start or not folio.line_code_range_end:
-        return []
-
-    start_book, start_stanza, _ = parse_line_code(folio.line_code_range_start)
-    end_book, end_stanza, _ = parse_line_code(folio.line_code_range_end)
-
-    # Build query to find stanzas within the range
-    stanzas = Stanza.objects.filter(related_manuscript=folio.manuscript).filter(
-        Q(stanza_line_code_starts__isnull=False)
-        | Q(stanza_line_code_ends__isnull=False)
-    )
-
-    # Convert line codes to numeric for comparison
-    start_numeric = line_code_to_numeric(folio.line_code_range_start)
-    end_numeric = line_code_to_numeric(folio.line_code_range_end)
+    from manuscript.folio_index import OPEN_END, FolioRangeIndex
 
-    # Filter stanzas that overlap with the folio's range
-    matching_stanzas = []
-    for stanza in stanzas:
-        stanza_start = line_code_to_numeric(stanza.stanza_line_code_starts)
-        stanza_end = line_code_to_numeric(
-            stanza.stanza_line_code_ends or stanza.stanza_line_code_starts
-        )
+    if folio.manuscript_id is None:
+        folio_index = FolioRangeIndex.from_folios([folio])
+    else:
+        folio_index = FolioRangeIndex.for_manuscript(folio.manuscript)
 
-        # A stanza is included if:
-        # 1. It starts within the folio range
-        # 2. It ends within the folio range
-        # 3. It spans across the folio range
-        if (
-            (
-                stanza_start
-                and stanza_start >= start_numeric
-                and stanza_start <= end_numeric
-            )
-            or (
-                stanza_end and stanza_end >= start_numeric and stanza_end <= end_numeric
-            )
-            or (
-                stanza_start
-                and stanza_end
-                and stanza_start <= start_numeric
-                and stanza_end >= end_numeric
-            )
-        ):
-            matching_stanzas.append(stanza)
+    span = folio_index.span(folio.id)
+    if span is None:
+        return []
+    start_numeric, end_numeric = span
+    if end_numeric == OPEN_END:
+        end_numeric = None
 
-    return sorted(
-        matching_stanzas, key=lambda x: line_code_to_numeric(x.stanza_line_code_starts)
+    # Stanzas that start, end or span across the folio's range
+    return list(
+        Stanza.objects.filter(
+            stanza_line_code_starts_numeric__overlaps=(start_numeric, end_numeric)
+        ).order_by("stanza_line_code_starts_numeric")
     )
 
 
@@ -134,6 +105,8 @@ class LineCode(models.Model):
         help_text="Input the text by book, stanza, and line number. For example: 01.01.01 refers to book 1, stanza 1, line 1.",
         validators=[validate_line_number_code],
     )
+    code_numeric = LineCodeField(source="code", end_field="code_end_numeric")
+    code_end_numeric = LineCodeField(source="code", bound="end")
     associated_iiif_url = models.URLField(
         max_length=255,
         blank=True,
@@ -467,6 +440,12 @@ class Stanza(models.Model):
         max_length=20,
         help_text="Indicate where the folio ends. Input the text by book, stanza, and line number. For example: 01.01.07 refers to book 1, stanza 1, line 7.",
     )
+    stanza_line_code_starts_numeric = LineCodeField(
+        source="stanza_line_code_starts", end_field="stanza_line_code_ends_numeric"
+    )
+    stanza_line_code_ends_numeric = LineCodeField(
+        source="stanza_line_code_ends", bound="end"
+    )
     stanza_text = RichTextField(blank=True, null=True)
     stanza_notes = RichTextField(blank=True, null=True)
     language = models.CharField(
@@ -580,6 +559,12 @@ class StanzaTranslated(models.Model):
         max_length=20,
         help_text="Indicate where the stanza ends. Input the text by book, stanza, and line number. For example: 01.01.07 refers to book 1, stanza 1, line 7.",
     )
+    stanza_line_code_starts_numeric = LineCodeField(
+        source="stanza_line_code_starts", end_field="stanza_line_code_ends_numeric"
+    )
+    stanza_line_code_ends_numeric = LineCodeField(
+        source="stanza_line_code_ends", bound="end"
+    )
     stanza_text = RichTextField(blank=True, null=True)
     language = models.CharField(
         max_length=2, choices=Stanza.STANZA_LANGUAGE, blank=True, null=True
@@ -632,6 +617,14 @@ class Folio(models.Model):  # (FolioStanzaMixin, models.Model):
         help_text="Input the text by book, stanza, and line number. For example: 01.01.01 refers to book 1, stanza 1, line 1.",
         validators=[validate_line_number_code],
     )
+    line_code_range_start_numeric = LineCodeField(
+        source="line_code_range_start",
+        end_field="line_code_range_end_numeric",
+        open_ended=True,
+    )
+    line_code_range_end_numeric = LineCodeField(
+        source="line_code_range_end", bound="end"
+    )
     folio_notes = RichTextField(blank=True, null=True)
     manuscript = models.ForeignKey(
         "SingleManuscript", on_delete=models.CASCADE, blank=True, null=True
@@ -647,6 +640,19 @@ class Folio(models.Model):  # (FolioStanzaMixin, models.Model):
         help_text="Provide a IIIF manifest to a page in the manuscript. If there isn't one, leave blank.",
         verbose_name="IIIF URL",
     )
+    canvas_id = models.URLField(
+        blank=True,
+        null=True,
+        max_length=500,
+        help_text="The canvas for this folio in the manuscript's IIIF manifest. Filled in by the resolve_folio_canvases command.",
+        verbose_name="IIIF canvas ID",
+    )
+    canvas_index = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        help_text="The position of the canvas in the manifest, starting at 0.",
+        verbose_name="IIIF canvas index",
+    )
     folio_includes_map = models.CharField(
         blank=True,
         null=True,
@@ -667,11 +673,8 @@ class Folio(models.Model):  # (FolioStanzaMixin, models.Model):
         return f"Folio has no folio number, but is associated with manuscript {self.manuscript}"
 
     def get_canvas_id(self):
-        """Get the IIIF canvas ID for this folio"""
-        if not self.folio_number:
-            return None
-
-        return get_canvas_id_for_folio(self.folio_number)
+        """Get the stored IIIF canvas ID for this folio"""
+        return self.canvas_id
 
     # def get_stanzas(self) -> List[Stanza]:
     #     """Get all stanzas that appear on this folio in order."""
@@ -819,6 +822,14 @@ class Location(models.Model):
         help_text="The URL to the authority file for the location. If there isn't one, leave blank.",
     )
     place_type = models.CharField(max_length=255, blank=True, null=True)
+    slug = models.SlugField(
+        max_length=255,
+        unique=True,
+        blank=True,
+        null=True,
+        editable=False,
+        help_text="Set from the name on save; suffixed with the placename ID where names collide.",
+    )
 
     class Meta:
         verbose_name = "Toponym"
@@ -868,17 +879,23 @@ class Location(models.Model):
                 self.toponym_type = "mp"
             elif prefix == "P":
                 self.toponym_type = "pm"
+        from manuscript.toponym_slugs import unique_slug
+
+        self.slug = unique_slug(self)
+        if kwargs.get("update_fields") is not None:
+            kwargs["update_fields"] = {*kwargs["update_fields"], "slug"}
         super(Location, self).save(*args, **kwargs)
 
+    def build_slug(self):
+        """Slugify the name, falling back to the placename ID and then the id."""
+        slug = slugify(self.name or "") or slugify(self.placename_id or "")
+        if not slug and self.id:
+            slug = f"toponym-{self.id}"
+        return slug[:255]
+
     def get_slug(self):
         """Get the slug for this toponym, with fallback"""
-        if not self.name or not self.name.strip():
-            # Fallback options if name is empty
-            if self.placename_id:
-                return slugify(self.placename_id)
-            else:
-                return f"toponym-{self.id}"
-        return slugify(self.name)
+        return self.slug or self.build_slug() or f"toponym-{self.id}"
 
     def get_absolute_url(self):
         """Return the URL for this toponym using the slug with fallback"""
@@ -950,3 +967,137 @@ class LocationAlias(models.Model):
 
     def __str__(self) -> str:
         return f"{self.placename_from_mss} / {self.placename_standardized} / {self.placename_modern} / {self.placename_alias}"
+
+
+class ToponymSlug(models.Model):
+    """A slug that resolves to a toponym: its own name's, or one of its
+    aliases' names.
+
+    Kept current by ``manuscript.signals`` and rebuilt by ``manage.py
+    index_toponym_slugs``. Where several toponyms share a slug the lowest
+    ``priority`` wins: 0 for a toponym's name, then the alias name fields in
+    the order of ``ALIAS_NAME_FIELDS``.
+
+    ``search_key`` is the name folded by ``manuscript.toponym_slugs.fold_slug``
+    so spelling variants of a name share it.
+    """
+
+    # Alias name fields a toponym can be found by, in order of priority
+    ALIAS_NAME_FIELDS = (
+        "placename_from_mss",
+        "placename_standardized",
+        "placename_modern",
+        "placename_alias",
+        "placename_ancient",
+    )
+
+    id = models.AutoField(primary_key=True)
+    slug = models.SlugField(max_length=255, db_index=False)
+    search_key = models.CharField(max_length=255, db_index=True, default="")
+    priority = models.PositiveSmallIntegerField(default=0)
+    location = models.ForeignKey(
+        Location, on_delete=models.CASCADE, related_name="slugs"
+    )
+    alias = models.ForeignKey(
+        LocationAlias,
+        on_delete=models.CASCADE,
+        blank=True,
+        null=True,
+        related_name="slugs",
+    )
+
+    class Meta:
+        verbose_name = "Toponym slug"
+        verbose_name_plural = "Toponym slugs"
+        indexes = [models.Index(fields=["slug", "priority"])]
+
+    def __str__(self) -> str:
+        return f"{self.slug} -> {self.location_id}"
+
+
+class EditionLayout(models.Model):
+    """The precomputed paired-books structure behind a manuscript's stanza page.
+
+    Built by ``manuscript.edition.build_edition_layout`` and dropped by the
+    signal handlers in ``manuscript.signals`` whenever a stanza, translation,
+    folio or annotation that feeds into it changes.
+    """
+
+    id = models.AutoField(primary_key=True)
+    manuscript = models.OneToOneField(
+        "SingleManuscript",
+        on_delete=models.CASCADE,
+        related_name="edition_layout",
+    )
+    layout = models.JSONField(default=dict)
+    uses_shared_stanzas = models.BooleanField(
+        default=False,
+        help_text="The layout falls back to every stanza with a line code, rather than the stanzas linked to this manuscript's folios.",
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Edition layout"
+        verbose_name_plural = "Edition layouts"
+
+    def __str__(self) -> str:
+        return f"Edition layout for {self.manuscript}"
+
+
+class ContentRevision(models.Model):
+    """A counter bumped whenever the published content it covers changes.
+
+    Pages and feeds cached under the current revision are never served again
+    once it moves on; see ``manuscript.revisions``.
+    """
+
+    id = models.AutoField(primary_key=True)
+    name = models.CharField(max_length=50, unique=True)
+    revision = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Content revision"
+        verbose_name_plural = "Content revisions"
+
+    def __str__(self) -> str:
+        return f"{self.name} revision {self.revision}"
+
+
+class ViewerResolution(models.Model):
+    """The manifest and canvas ``mirador_view`` opens for a manuscript and
+    page number.
+
+    Built by ``manuscript.viewer.resolve_viewer_pages`` from each manuscript's
+    manifest. Page 0 stands for any page of the manuscript without a canvas
+    of its own, and the row without a manuscript is the viewer shown for
+    manuscripts that have no manifest. When a manuscript's manifest changes
+    its rows are replaced by a page 0 row marked ``stale`` until its pages
+    are resolved again.
+    """
+
+    id = models.AutoField(primary_key=True)
+    manuscript = models.ForeignKey(
+        "SingleManuscript",
+        on_delete=models.CASCADE,
+        blank=True,
+        null=True,
+        related_name="viewer_resolutions",
+    )
+    page_number = models.PositiveIntegerField(default=0)
+    manifest_url = models.URLField(max_length=255, blank=True, null=True)
+    canvas_id = models.URLField(max_length=500, blank=True, null=True)
+    stale = models.BooleanField(default=False)
+
+    class Meta:
+        verbose_name = "Viewer resolution"
+        verbose_name_plural = "Viewer resolutions"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["manuscript", "page_number"],
+                name="unique_viewer_resolution",
+            )
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.manuscript or 'Default viewer'}, page {self.page_number}"
@@ -0,0 +1,104 @@
+"""A minimal Mapbox Vector Tile (MVT 2.1) encoder for point layers.
+
+Writes the protobuf wire format directly, so vector tiles need neither
+PostGIS nor a protobuf runtime. Only what the toponym map needs is
+supported: point features with scalar properties.
+"""
+
+import struct
+
+# Protobuf wire types
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+
+POINT = 1
+MOVE_TO = 1
+
+DEFAULT_EXTENT = 4096
+
+
+def varint(value):
+    encoded = bytearray()
+    while True:
+        bits = value & 0x7F
+        value >>= 7
+        if value:
+            encoded.append(bits | 0x80)
+        else:
+            encoded.append(bits)
+            return bytes(encoded)
+
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def field_key(number, wire_type):
+    return varint(number << 3 | wire_type)
+
+
+def varint_field(number, value):
+    return field_key(number, VARINT) + varint(value)
+
+
+def bytes_field(number, data):
+    if isinstance(data, str):
+        data = data.encode()
+    return field_key(number, LENGTH_DELIMITED) + varint(len(data)) + data
+
+
+def packed_field(number, values):
+    return bytes_field(number, b"".join(varint(value) for value in values))
+
+
+def encode_value(value):
+    """Encode a property value as an MVT ``Value`` message."""
+    if isinstance(value, bool):
+        return varint_field(7, int(value))
+    if isinstance(value, int):
+        if value >= 0:
+            return varint_field(5, value)
+        return varint_field(6, zigzag(value))
+    if isinstance(value, float):
+        return field_key(3, FIXED64) + struct.pack("<d", value)
+    return bytes_field(1, str(value))
+
+
+def encode_layer(name, features, extent=DEFAULT_EXTENT):
+    """Encode a layer of point features.
+
+    ``features`` yields ``(id, x, y, properties)`` with ``x`` and ``y`` in
+    tile coordinates (0 to ``extent``) and ``id`` an unsigned int or None.
+    Properties whose value is None are left out.
+    """
+    keys = {}
+    values = {}
+    encoded_features = []
+    for feature_id, x, y, properties in features:
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            tags.append(keys.setdefault(key, len(keys)))
+            # Keyed on the type too, so True and 1 stay distinct
+            tags.append(values.setdefault((type(value), value), len(values)))
+        feature = b""
+        if feature_id is not None:
+            feature += varint_field(1, feature_id)
+        feature += packed_field(2, tags)
+        feature += varint_field(3, POINT)
+        feature += packed_field(4, [MOVE_TO | 1 << 3, zigzag(x), zigzag(y)])
+        encoded_features.append(bytes_field(2, feature))
+
+    layer = varint_field(15, 2) + bytes_field(1, name)
+    layer += b"".join(encoded_features)
+    layer += b"".join(bytes_field(3, key) for key in keys)
+    layer += b"".join(bytes_field(4, encode_value(value)) for _, value in values)
+    layer += varint_field(5, extent)
+    return layer
+
+
+def encode_tile(layers):
+    """Join encoded layers into a tile."""
+    return b"".join(bytes_field(3, layer) for layer in layers)
@@ -4,7 +4,6 @@ from import_export.results import RowResult
 from django.contrib import admin
 from django.db import IntegrityError
 from django.core.exceptions import ValidationError
-from django.db.models import Q
 from typing import Optional, Dict, Any
 import logging
 
@@ -83,20 +82,23 @@ class FolioResource(resources.ModelResource):
                     },
                 )
 
-                # Handle stanza associations
-                start_line = row["line_code_starts"]
-                end_line = row["next_start_line"]
-
-                stanza_query = Q(stanza_line_code_starts__gte=start_line)
-                if end_line and end_line.strip() != "-":
-                    stanza_query &= Q(stanza_line_code_starts__lt=end_line)
-
-                stanzas = Stanza.objects.filter(stanza_query).order_by(
-                    "stanza_line_code_starts"
-                )
+                # Handle stanza associations: the stanzas starting between
+                # this folio's first line and the next folio's first line
+                start_code = folio.line_code_range_start_numeric
+                end_code = folio.line_code_range_end_numeric
+                stanza_ids = []
+                if start_code is not None:
+                    stanzas = Stanza.objects.filter(
+                        stanza_line_code_starts_numeric__gte=start_code
+                    )
+                    if end_code is not None:
+                        stanzas = stanzas.filter(
+                            stanza_line_code_starts_numeric__lt=end_code
+                        )
+                    stanza_ids = list(stanzas.values_list("id", flat=True))
 
                 folio.stanzas.clear()
-                folio.stanzas.add(*stanzas)
+                folio.stanzas.add(*stanza_ids)
             else:
                 # For dry run, we still need a folio object for proper logging
                 folio = instance or Folio(
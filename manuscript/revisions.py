@@ -0,0 +1,99 @@
+"""Content revision counters and the page cache keyed on them.
+
+Every save or delete of the edition's models bumps the ``content`` revision
+(see ``manuscript.signals``); changes to toponyms also bump ``toponyms``.
+Cached pages are stored under their URL plus the revisions they depend on,
+so an editorial change makes every page cached before it unreachable
+without anything having to be purged.
+"""
+
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.http import HttpResponse
+
+from manuscript.models import ContentRevision
+
+CONTENT = "content"
+TOPONYMS = "toponyms"
+
+PAGE_CACHE_TIMEOUT = getattr(settings, "PAGE_CACHE_TIMEOUT", 60 * 60 * 24)
+
+
+def bump_revision(*names):
+    """Advance the named revisions, or ``content`` if none are given."""
+    for name in names or (CONTENT,):
+        updated = ContentRevision.objects.filter(name=name).update(
+            revision=F("revision") + 1
+        )
+        if not updated:
+            try:
+                with transaction.atomic():
+                    ContentRevision.objects.create(name=name, revision=1)
+            except IntegrityError:
+                # Created concurrently; bump that row instead
+                ContentRevision.objects.filter(name=name).update(
+                    revision=F("revision") + 1
+                )
+
+
+def current_revisions(*names):
+    """Return the current value of each named revision, in order."""
+    names = names or (CONTENT,)
+    revisions = dict(
+        ContentRevision.objects.filter(name__in=names).values_list("name", "revision")
+    )
+    return [revisions.get(name, 0) for name in names]
+
+
+def current_revision(name=CONTENT):
+    return current_revisions(name)[0]
+
+
+def page_cache_key(request, revisions):
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    revision = "_".join(str(value) for value in revisions)
+    return f"page_{path}_{revision}"
+
+
+def cache_page_by_revision(*names, timeout=None):
+    """Cache a view's successful GET responses under the URL and the
+    current value of the named revisions (``content`` by default).
+
+    Streaming responses, and responses marked ``no-store`` (see
+    ``django.utils.cache.add_never_cache_headers``), are passed through
+    uncached.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view(request, *args, **kwargs)
+
+            cache_key = page_cache_key(request, current_revisions(*names))
+            cached = cache.get(cache_key)
+            if cached is not None:
+                content, content_type = cached
+                return HttpResponse(content, content_type=content_type)
+
+            response = view(request, *args, **kwargs)
+            if (
+                response.status_code == 200
+                and not response.streaming
+                and "no-store" not in response.get("Cache-Control", "")
+            ):
+                cache.set(
+                    cache_key,
+                    (response.content, response["Content-Type"]),
+                    PAGE_CACHE_TIMEOUT if timeout is None else timeout,
+                )
+            return response
+
+        return wrapper
+
+    return decorator
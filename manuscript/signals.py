@@ -0,0 +1,155 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+
+from manuscript.edition import invalidate_edition_layouts, invalidate_for_stanzas
+from manuscript.folio_index import folio_index_cache_key
+from manuscript.models import (
+    ContentRevision,
+    EditionLayout,
+    Folio,
+    Location,
+    LocationAlias,
+    SingleManuscript,
+    Stanza,
+    StanzaTranslated,
+    ToponymSlug,
+    ViewerResolution,
+)
+from manuscript.revisions import CONTENT, TOPONYMS, bump_revision
+from manuscript.toponym_slugs import index_alias, index_location
+from manuscript.viewer import mark_manuscript_stale, resolve_default_viewer
+from textannotation.models import TextAnnotation
+
+# Apps whose models make up the published content
+CONTENT_APPS = ("manuscript", "textannotation")
+
+# Derived data that is stored as models but isn't content itself
+DERIVED_MODELS = (ContentRevision, EditionLayout, ToponymSlug, ViewerResolution)
+
+TOPONYM_MODELS = (Location, LocationAlias)
+
+
+def content_revisions(model):
+    """Return the revisions a change to ``model`` rows should bump."""
+    if model._meta.app_label not in CONTENT_APPS or model in DERIVED_MODELS:
+        return ()
+    related = {model} | {
+        field.related_model for field in model._meta.fields if field.related_model
+    }
+    if related & set(TOPONYM_MODELS):
+        return (CONTENT, TOPONYMS)
+    return (CONTENT,)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def content_changed(sender, **kwargs):
+    revisions = content_revisions(sender)
+    if revisions:
+        bump_revision(*revisions)
+
+
+@receiver(m2m_changed)
+def content_relations_changed(sender, action, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    revisions = content_revisions(sender)
+    if revisions:
+        bump_revision(*revisions)
+
+
+@receiver(post_save, sender=Stanza)
+@receiver(pre_delete, sender=Stanza)
+def stanza_changed(sender, instance, **kwargs):
+    invalidate_for_stanzas([instance.pk])
+
+
+@receiver(post_save, sender=StanzaTranslated)
+@receiver(post_delete, sender=StanzaTranslated)
+def stanza_translation_changed(sender, instance, **kwargs):
+    invalidate_for_stanzas([instance.stanza_id])
+
+
+@receiver(pre_save, sender=Folio)
+def folio_saving(sender, instance, **kwargs):
+    # A folio moved to another manuscript leaves the old one's index stale too
+    instance._previous_manuscript_id = (
+        Folio.objects.filter(pk=instance.pk)
+        .values_list("manuscript_id", flat=True)
+        .first()
+        if instance.pk
+        else None
+    )
+
+
+@receiver(post_save, sender=Folio)
+@receiver(post_delete, sender=Folio)
+def folio_changed(sender, instance, **kwargs):
+    manuscript_ids = {
+        instance.manuscript_id,
+        getattr(instance, "_previous_manuscript_id", None),
+    } - {None}
+    cache.delete_many([folio_index_cache_key(pk) for pk in manuscript_ids])
+    invalidate_edition_layouts(list(manuscript_ids))
+
+
+@receiver(post_save, sender=Location)
+def location_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_location(instance)
+
+
+@receiver(post_save, sender=LocationAlias)
+def location_alias_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_alias(instance)
+
+
+@receiver(post_save, sender=SingleManuscript)
+def manuscript_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # Manifests are only fetched by manage.py resolve_viewer_pages
+    mark_manuscript_stale(instance)
+    transaction.on_commit(resolve_default_viewer)
+
+
+@receiver(post_delete, sender=SingleManuscript)
+def manuscript_deleted(sender, instance, **kwargs):
+    transaction.on_commit(resolve_default_viewer)
+
+
+@receiver(m2m_changed, sender=Stanza.folios.through)
+def stanza_folios_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if reverse:
+        # instance is a Folio
+        invalidate_edition_layouts([instance.manuscript_id])
+        return
+    manuscript_ids = Folio.objects.filter(pk__in=pk_set or ()).values_list(
+        "manuscript_id", flat=True
+    )
+    invalidate_edition_layouts(list(manuscript_ids))
+    invalidate_for_stanzas([instance.pk])
+
+
+@receiver(post_save, sender=TextAnnotation)
+@receiver(post_delete, sender=TextAnnotation)
+def annotation_changed(sender, instance, **kwargs):
+    model = instance.content_type.model_class()
+    if model is Stanza:
+        invalidate_for_stanzas([instance.object_id])
+    elif model is StanzaTranslated:
+        stanza_ids = StanzaTranslated.objects.filter(pk=instance.object_id).values_list(
+            "stanza_id", flat=True
+        )
+        invalidate_for_stanzas(list(stanza_ids))
@@ -1,3 +1,345 @@
+import json
+import socket
+import tempfile
+import threading
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
 from django.test import TestCase
+from django.urls import reverse
+
+from manuscript import iiif
+from manuscript.folio_index import FolioRangeIndex
+from manuscript.iiif_mirror import (
+    index_path,
+    make_mirror_server,
+    mirror_url,
+    store_object,
+    url_key,
+)
+from manuscript.models import Folio, Location, LocationAlias, SingleManuscript, Stanza
+from manuscript.resources import FolioResource
+from manuscript.toponym_search import (
+    search_folded,
+    search_in_process,
+    search_toponyms,
+    word_similarity,
+)
+from manuscript.toponym_slugs import rebuild_slug_index, resolve_toponym_slug
+from manuscript.viewer import resolve_viewer_pages, stale_manuscripts, viewer_target
+
+MANIFEST = "https://example.org/iiif/urb1/manifest.json"
+
+
+class WordSimilarityTests(TestCase):
+    def test_identical_words_match_fully(self):
+        self.assertEqual(word_similarity("roma", "Roma"), 1.0)
+
+    def test_matches_a_word_within_the_text(self):
+        self.assertEqual(word_similarity("marco", "San Marco"), 1.0)
+
+    def test_close_spelling_beats_distant_one(self):
+        self.assertGreater(
+            word_similarity("venetia", "Venezia"), word_similarity("venetia", "Verona")
+        )
+
+    def test_unrelated_words_do_not_match(self):
+        self.assertLess(word_similarity("roma", "Alexandria"), 0.3)
+
+    def test_empty_query(self):
+        self.assertEqual(word_similarity("", "Roma"), 0.0)
+
+
+class ToponymSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.venezia = Location.objects.create(placename_id="T1", name="Venezia")
+        cls.verona = Location.objects.create(placename_id="T2", name="Verona")
+        cls.roma = Location.objects.create(placename_id="T3", name="Roma")
+        LocationAlias.objects.create(
+            location=cls.venezia,
+            placename_from_mss="Vinegia",
+            placename_ancient="Venetia",
+        )
+        LocationAlias.objects.create(location=cls.roma, placename_from_mss="Rhoma")
+
+    def test_in_process_ranks_closest_name_first(self):
+        scores = search_in_process("venetia", 10)
+        self.assertIn(self.venezia.pk, scores)
+        self.assertEqual(scores[self.venezia.pk], (1.0, "Venetia"))
+        self.assertNotIn(self.roma.pk, scores)
+
+    def test_in_process_matches_alias_names(self):
+        scores = search_in_process("rhoma", 10)
+        self.assertEqual(scores[self.roma.pk][1], "Rhoma")
+
+    def test_folded_key_matches_spelling_variants(self):
+        scores = search_folded("Uinnegia", 10)
+        self.assertEqual(scores, {self.venezia.pk: (1.0, "Vinegia")})
+
+    def test_folded_prefix_scores_below_exact_key(self):
+        score, matched = search_folded("vine", 10)[self.venezia.pk]
+        self.assertEqual(matched, "Vinegia")
+        self.assertTrue(0.5 <= score < 1.0)
+
+    def test_results_are_ranked(self):
+        matches = search_toponyms("venezia")
+        self.assertEqual(matches[0].placename_id, "T1")
+        self.assertEqual(matches[0].slug, "venezia")
+        scores = [match.score for match in matches]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_results_are_capped(self):
+        Location.objects.bulk_create(
+            Location(placename_id=f"V{number}", name=f"Verona {number}")
+            for number in range(20)
+        )
+        self.assertEqual(len(search_in_process("verona", 5)), 21)
+        self.assertEqual(len(search_toponyms("verona", limit=5)), 5)
+
+    def test_empty_query_is_capped(self):
+        matches = search_toponyms("  ", limit=2)
+        self.assertEqual([match.name for match in matches], ["Roma", "Venezia"])
+        self.assertIsNone(matches[0].score)
+
+
+class ToponymSlugTests(TestCase):
+    def test_spelling_variant_redirects_to_the_toponym(self):
+        venezia = Location.objects.create(placename_id="T1", name="Venezia")
+        LocationAlias.objects.create(location=venezia, placename_from_mss="Vinegia")
+        self.assertEqual(resolve_toponym_slug("vinegia"), ("T1", "vinegia"))
+        self.assertEqual(resolve_toponym_slug("uinnegia"), ("T1", "venezia"))
+        self.assertIsNone(resolve_toponym_slug("roma"))
+
+        response = self.client.get(reverse("toponym_detail", args=["uinnegia"]))
+        self.assertRedirects(
+            response, venezia.get_absolute_url(), fetch_redirect_response=False
+        )
+
+    def test_shared_names_get_distinct_slugs(self):
+        first = Location.objects.create(placename_id="T1", name="Roma")
+        second = Location.objects.create(placename_id="T2", name="Roma")
+        third = Location.objects.create(name="Roma")
+        self.assertEqual(first.slug, "roma")
+        self.assertEqual(second.slug, "roma-t2")
+        self.assertEqual(third.slug, f"roma-{third.pk}")
+        for location in (first, second, third):
+            self.assertEqual(
+                resolve_toponym_slug(location.slug),
+                (location.placename_id, location.slug),
+            )
+
+    def test_slugs_stay_put(self):
+        first = Location.objects.create(placename_id="T1", name="Roma")
+        second = Location.objects.create(placename_id="T2", name="Roma")
+        first.name = "Roma antica"
+        first.save()
+        second.save()
+        self.assertEqual(second.slug, "roma-t2")
+        self.assertEqual(rebuild_slug_index()[0], 0)
+
+    def test_rebuild_disambiguates_shared_names(self):
+        Location.objects.create(placename_id="T1", name="Roma")
+        second = Location.objects.create(placename_id="T2", name="Milano")
+        Location.objects.filter(pk=second.pk).update(name="Roma", slug=None)
+        self.assertEqual(rebuild_slug_index()[0], 1)
+        second.refresh_from_db()
+        self.assertEqual(second.slug, "roma-t2")
+        self.assertEqual(resolve_toponym_slug("roma-t2"), ("T2", "roma-t2"))
+        self.assertEqual(resolve_toponym_slug("roma"), ("T1", "roma"))
+
+
+@mock.patch(
+    "manuscript.viewer.get_canvas_index",
+    return_value={
+        "pages": ["https://example.org/canvas/1", "https://example.org/canvas/2"]
+    },
+)
+class ViewerTargetTests(TestCase):
+    def test_unbuilt_table_falls_back_without_fetching(self, get_canvas_index):
+        manuscript = SingleManuscript.objects.create(
+            item_id=1, siglum="Urb1", iiif_url=MANIFEST
+        )
+        self.assertEqual(viewer_target(manuscript.pk, 2), (MANIFEST, None))
+        self.assertEqual(viewer_target("nonsense", 2), (MANIFEST, None))
+        get_canvas_index.assert_not_called()
+
+    def test_resolved_pages(self, get_canvas_index):
+        manuscript = SingleManuscript.objects.create(
+            item_id=1, siglum="Urb1", iiif_url=MANIFEST
+        )
+        resolve_viewer_pages()
+        self.assertEqual(
+            viewer_target(manuscript.pk, 2), (MANIFEST, "https://example.org/canvas/2")
+        )
+        self.assertEqual(viewer_target(manuscript.pk, 9), (MANIFEST, None))
+
+    def test_changed_manifest_is_marked_stale_on_save(self, get_canvas_index):
+        manuscript = SingleManuscript.objects.create(
+            item_id=1, siglum="Urb1", iiif_url=MANIFEST
+        )
+        resolve_viewer_pages()
+        get_canvas_index.reset_mock()
+
+        manuscript.save()
+        self.assertFalse(stale_manuscripts().exists())
+
+        manuscript.iiif_url = "https://example.org/iiif/other/manifest.json"
+        manuscript.save()
+        get_canvas_index.assert_not_called()
+        self.assertEqual(list(stale_manuscripts()), [manuscript])
+        self.assertEqual(viewer_target(manuscript.pk, 2), (manuscript.iiif_url, None))
+
+        resolve_viewer_pages(stale_manuscripts())
+        self.assertFalse(stale_manuscripts().exists())
+
+
+class FolioRangeIndexTests(TestCase):
+    def test_moving_a_folio_refreshes_both_manuscripts(self):
+        urb = SingleManuscript.objects.create(item_id=1, siglum="Urb1")
+        yale = SingleManuscript.objects.create(item_id=2, siglum="Yale3")
+        folio = Folio.objects.create(
+            manuscript=urb,
+            folio_number="1r",
+            line_code_range_start="01.01.01",
+            line_code_range_end="01.01.08",
+        )
+        self.assertEqual(len(FolioRangeIndex.for_manuscript(urb)), 1)
+        self.assertEqual(len(FolioRangeIndex.for_manuscript(yale)), 0)
+
+        folio.manuscript = yale
+        folio.save()
+        self.assertEqual(len(FolioRangeIndex.for_manuscript(urb)), 0)
+        self.assertEqual(len(FolioRangeIndex.for_manuscript(yale)), 1)
+
+
+class FolioImportTests(TestCase):
+    def test_row_links_the_stanzas_starting_on_the_folio(self):
+        SingleManuscript.objects.create(item_id=1, siglum="Urb1")
+        first, second, third = (
+            Stanza.objects.create(stanza_line_code_starts=code)
+            for code in ("01.01.01", "01.02.01", "01.03.01")
+        )
+        row = {
+            "manuscript": "Urb1",
+            "folio": "1r",
+            "line_code_starts": "01.01.01",
+            "next_start_line": "01.03.01",
+        }
+        FolioResource().import_row(row, None)
+        folio = Folio.objects.get(folio_number="1r")
+        self.assertEqual(set(folio.stanzas.all()), {first, second})
+
+        row.update(folio="1v", line_code_starts="01.03.01", next_start_line="-")
+        FolioResource().import_row(row, None)
+        folio = Folio.objects.get(folio_number="1v")
+        self.assertEqual(list(folio.stanzas.all()), [third])
+
+
+class MalformedManifestTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        iiif.local_manifests.clear()
+
+    def serve(self, content):
+        return mock.patch(
+            "manuscript.iiif.request_manifest", return_value=(200, content, None, None)
+        )
+
+    def test_non_object_manifest_is_unavailable(self):
+        with self.serve(b"[1, 2]"):
+            with self.assertRaises(iiif.ManifestUnavailable):
+                iiif.get_manifest(MANIFEST)
+
+    def test_odd_resources_are_skipped(self):
+        manifest = (
+            b'{"items": [{"type": "Canvas", "id": "c1", "label": "1r",'
+            b' "items": [{"items": [{"body": "not an image"}]}]}]}'
+        )
+        with self.serve(manifest):
+            results = iiif.get_manifest_projections({MANIFEST: ["1r"]}, deadline=5)
+        self.assertEqual(results[MANIFEST].status, iiif.READY)
+        self.assertIsNone(results[MANIFEST].value["canvases"][0]["thumbnail"])
+
+    def test_failing_call_fails_only_its_result(self):
+        def project(url):
+            if url == "bad":
+                raise AttributeError("'str' object has no attribute 'get'")
+            return url
+
+        results = iiif.resolve_batch(project, {"bad": ("bad",), "good": ("good",)})
+        self.assertEqual(results["bad"].status, iiif.FAILED)
+        self.assertEqual(results["good"], iiif.BatchResult("good", iiif.READY))
+
+
+@mock.patch("manuscript.iiif.MANIFEST_MIRROR", "")
+class WarmManifestsTests(TestCase):
+    """``warm_manifests`` against the stand-in manifest server."""
+
+    def setUp(self):
+        cache.clear()
+        iiif.local_manifests.clear()
+
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        manifest = {
+            "items": [
+                {"type": "Canvas", "id": "https://example.org/canvas/1", "label": "1r"},
+                {"type": "Canvas", "id": "https://example.org/canvas/2", "label": "1v"},
+            ]
+        }
+        digest = store_object(json.dumps(manifest).encode(), root.name)
+        index_path(root.name).write_text(
+            json.dumps({MANIFEST: {"sha256": digest, "key": url_key(MANIFEST)}})
+        )
+
+        server = make_mirror_server("127.0.0.1", 0, root.name)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.manifest_url = mirror_url(
+            MANIFEST, f"http://127.0.0.1:{server.server_address[1]}"
+        )
+
+        # A port nothing listens on
+        with socket.socket() as closed:
+            closed.bind(("127.0.0.1", 0))
+            port = closed.getsockname()[1]
+        self.unreachable_url = f"http://127.0.0.1:{port}/manifest.json"
+
+    def warm(self):
+        stdout = StringIO()
+        call_command(
+            "warm_manifests",
+            "--manifest-url",
+            self.manifest_url,
+            "--manifest-url",
+            self.unreachable_url,
+            stdout=stdout,
+        )
+        return stdout.getvalue()
+
+    def test_fills_the_cache(self):
+        output = self.warm()
+        self.assertIn("Warmed 1 of 2 manifests", output)
+        entry = cache.get(iiif.manifest_cache_key(self.manifest_url))
+        self.assertEqual(
+            entry["canvases"]["pages"],
+            ["https://example.org/canvas/1", "https://example.org/canvas/2"],
+        )
+        self.assertTrue(entry["etag"])
+
+    def test_caches_unreachable_manifests_as_failures(self):
+        self.warm()
+        self.assertIsNone(cache.get(iiif.manifest_cache_key(self.unreachable_url)))
+        self.assertIsNotNone(cache.get(iiif.failure_cache_key(self.unreachable_url)))
+        with mock.patch("manuscript.iiif.request_manifest") as request_manifest:
+            with self.assertRaises(iiif.ManifestUnavailable):
+                iiif.get_manifest(self.unreachable_url)
+        request_manifest.assert_not_called()
 
-# Create your tests here.
+    def test_revalidates_cached_manifests(self):
+        self.warm()
+        self.assertIn(f"{self.manifest_url}: not modified", self.warm())
@@ -0,0 +1,121 @@
+"""The gazetteer map's toponyms as one GeoJSON FeatureCollection.
+
+Every located toponym becomes a Point feature carrying its names and
+aliases. The collection is built from a single query: on PostgreSQL each
+toponym's aliases are gathered with ``jsonb_agg``, elsewhere the aliases are
+joined in and grouped in Python. The encoded feed and its gzipped copy are
+cached under the ``toponyms`` revision, which is also the feed's ETag, so it
+is rebuilt only after a toponym or alias changes.
+"""
+
+import gzip
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q, Value
+from django.db.models.functions import JSONObject
+
+from manuscript.models import Location, ToponymSlug
+from manuscript.revisions import TOPONYMS, current_revision
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+FEED_CACHE_TIMEOUT = getattr(settings, "TOPONYM_FEED_CACHE_TIMEOUT", 60 * 60 * 24)
+
+ALIAS_FIELDS = ("id", *ToponymSlug.ALIAS_NAME_FIELDS)
+LOCATION_FIELDS = ("id", "placename_id", "slug", "name", "modern_country")
+
+
+def dumps(data):
+    """Encode ``data`` as compact UTF-8 JSON, with orjson when installed."""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def located_toponyms():
+    return Location.objects.filter(latitude__isnull=False, longitude__isnull=False)
+
+
+def toponyms_with_aliases_postgres():
+    from django.contrib.postgres.aggregates import JSONBAgg
+
+    aliases = JSONBAgg(
+        JSONObject(**{field: f"locationalias__{field}" for field in ALIAS_FIELDS}),
+        filter=Q(locationalias__isnull=False),
+        ordering="locationalias__id",
+        default=Value("[]"),
+    )
+    return [
+        (toponym, toponym.pop("aliases"))
+        for toponym in located_toponyms()
+        .annotate(aliases=aliases)
+        .order_by("id")
+        .values(*LOCATION_FIELDS, "latitude", "longitude", "aliases")
+    ]
+
+
+def toponyms_with_aliases_joined():
+    alias_columns = [f"locationalias__{field}" for field in ALIAS_FIELDS]
+    toponyms = {}
+    for row in (
+        located_toponyms()
+        .order_by("id", "locationalias__id")
+        .values(*LOCATION_FIELDS, "latitude", "longitude", *alias_columns)
+    ):
+        alias = {
+            field: row.pop(column) for field, column in zip(ALIAS_FIELDS, alias_columns)
+        }
+        toponym, aliases = toponyms.setdefault(row["id"], (row, []))
+        if alias["id"] is not None:
+            aliases.append(alias)
+    return list(toponyms.values())
+
+
+def toponym_feature(toponym, aliases):
+    longitude = toponym.pop("longitude")
+    latitude = toponym.pop("latitude")
+    return {
+        "type": "Feature",
+        "id": toponym["id"],
+        "geometry": {"type": "Point", "coordinates": [longitude, latitude]},
+        "properties": {**toponym, "aliases": aliases},
+    }
+
+
+def build_feature_collection():
+    """Return the GeoJSON FeatureCollection of every located toponym."""
+    if connection.vendor == "postgresql":
+        toponyms = toponyms_with_aliases_postgres()
+    else:
+        toponyms = toponyms_with_aliases_joined()
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            toponym_feature(toponym, aliases) for toponym, aliases in toponyms
+        ],
+    }
+
+
+def feed_cache_key(revision):
+    return f"toponym_feed_{revision}"
+
+
+def get_toponym_feed(revision=None):
+    """Return ``(json, gzipped json)`` of the feed at the current (or given)
+    ``toponyms`` revision, building and caching it if needed.
+    """
+    if revision is None:
+        revision = current_revision(TOPONYMS)
+    cache_key = feed_cache_key(revision)
+    feed = cache.get(cache_key)
+    if feed is None:
+        content = dumps(build_feature_collection())
+        feed = (content, gzip.compress(content, compresslevel=6, mtime=0))
+        cache.set(cache_key, feed, FEED_CACHE_TIMEOUT)
+    return feed
@@ -0,0 +1,213 @@
+"""Ranked, typo-tolerant search over toponym names and their aliases.
+
+Spelling variants are found first through the folded search keys of
+``ToponymSlug`` (see ``manuscript.toponym_slugs``): a name whose key equals
+the query's scores 1, one whose key starts with it scores at least 0.5.
+
+On PostgreSQL the search runs on ``pg_trgm``: each alias name field and
+``Location.name`` has a trigram GIN index, candidates are found with the
+indexed word-similarity operator and ranked by ``word_similarity``. Other
+databases get the same ranking from a pure-Python implementation of the
+trigram measure, which scans the tables and is only meant for development.
+
+Either way the result is one ``ToponymMatch`` per toponym, best first, and
+never more than ``TOPONYM_SEARCH_LIMIT`` of them.
+"""
+
+import re
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
+
+from manuscript.models import Location, LocationAlias, ToponymSlug
+from manuscript.toponym_slugs import fold_name
+
+SEARCH_LIMIT = getattr(settings, "TOPONYM_SEARCH_LIMIT", 50)
+# Lowest word similarity (0 to 1) a name needs to match a query
+SIMILARITY_THRESHOLD = getattr(settings, "TOPONYM_SEARCH_THRESHOLD", 0.3)
+
+ALIAS_NAME_FIELDS = ToponymSlug.ALIAS_NAME_FIELDS
+
+ToponymMatch = namedtuple(
+    "ToponymMatch", ["location_id", "placename_id", "slug", "name", "matched", "score"]
+)
+
+# pg_trgm treats everything but letters and digits as a word boundary
+WORD = re.compile(r"[^\W_]+")
+
+
+def word_trigrams(word):
+    """The trigrams of a word in order, padded the way pg_trgm pads them."""
+    padded = f"  {word.lower()} "
+    return [padded[i : i + 3] for i in range(len(padded) - 2)]
+
+
+def trigrams(text):
+    return {gram for word in WORD.findall(text or "") for gram in word_trigrams(word)}
+
+
+def word_similarity(query, text):
+    """In-process counterpart of ``word_similarity(query, text)``: the best
+    similarity between the query's trigrams and any run of consecutive
+    trigrams within a word of ``text``.
+    """
+    query_grams = trigrams(query)
+    if not query_grams:
+        return 0.0
+    best = 0.0
+    for word in WORD.findall(text or ""):
+        grams = word_trigrams(word)
+        for start in range(len(grams)):
+            extent = set()
+            for gram in grams[start:]:
+                extent.add(gram)
+                shared = len(query_grams & extent)
+                best = max(best, shared / len(query_grams | extent))
+    return best
+
+
+def _matches(location_scores, limit):
+    """Turn ``{location_id: (score, matched name)}`` into ranked matches."""
+    ranked = sorted(location_scores.items(), key=lambda item: -item[1][0])[:limit]
+    locations = Location.objects.in_bulk([location_id for location_id, _ in ranked])
+    matches = [
+        ToponymMatch(
+            location_id=location_id,
+            placename_id=locations[location_id].placename_id,
+            slug=locations[location_id].get_slug(),
+            name=locations[location_id].name,
+            matched=matched,
+            score=score,
+        )
+        for location_id, (score, matched) in ranked
+        if location_id in locations and locations[location_id].placename_id
+    ]
+    matches.sort(key=lambda match: (-match.score, match.name.lower()))
+    return matches
+
+
+def _keep_best(scores, location_id, score, matched):
+    if score >= SIMILARITY_THRESHOLD and score > scores.get(location_id, (0, None))[0]:
+        scores[location_id] = (score, matched)
+
+
+def search_folded(query, limit):
+    """Score the toponyms with a name whose search key equals or starts with
+    the query's, with one lookup on the indexed key.
+    """
+    scores = {}
+    key = fold_name(query)
+    if not key:
+        return scores
+    names = (
+        ToponymSlug.objects.filter(search_key__startswith=key)
+        .order_by("search_key", "priority")
+        .values(
+            "location_id",
+            "search_key",
+            "priority",
+            "location__name",
+            *(f"alias__{field}" for field in ALIAS_NAME_FIELDS),
+        )[: limit * 4]
+    )
+    for row in names:
+        if row["priority"]:
+            matched = row[f"alias__{ALIAS_NAME_FIELDS[row['priority'] - 1]}"]
+        else:
+            matched = row["location__name"]
+        score = 0.5 + 0.5 * len(key) / len(row["search_key"])
+        _keep_best(scores, row["location_id"], score, matched)
+    return scores
+
+
+def search_in_process(query, limit):
+    scores = {}
+    for location_id, name in Location.objects.values_list("id", "name"):
+        _keep_best(scores, location_id, word_similarity(query, name), name)
+
+    for alias in LocationAlias.objects.exclude(location__isnull=True).values(
+        "location_id", *ALIAS_NAME_FIELDS
+    ):
+        for field in ALIAS_NAME_FIELDS:
+            name = alias[field]
+            if name:
+                _keep_best(
+                    scores, alias["location_id"], word_similarity(query, name), name
+                )
+    return scores
+
+
+def search_postgres(query, limit):
+    from django.contrib.postgres.search import TrigramWordSimilarity
+
+    scores = {}
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            # The threshold the indexed %> operator filters with
+            cursor.execute(
+                "SELECT set_config('pg_trgm.word_similarity_threshold', %s, true)",
+                [str(SIMILARITY_THRESHOLD)],
+            )
+
+        locations = (
+            Location.objects.filter(name__trigram_word_similar=query)
+            .annotate(score=TrigramWordSimilarity(query, "name"))
+            .order_by("-score")
+            .values_list("id", "score", "name")[:limit]
+        )
+        for location_id, score, name in locations:
+            _keep_best(scores, location_id, score, name)
+
+        matches_alias = Q()
+        for field in ALIAS_NAME_FIELDS:
+            matches_alias |= Q(**{f"{field}__trigram_word_similar": query})
+        field_scores = {
+            f"score_{field}": TrigramWordSimilarity(query, field)
+            for field in ALIAS_NAME_FIELDS
+        }
+        aliases = (
+            LocationAlias.objects.filter(matches_alias, location__isnull=False)
+            .annotate(**field_scores)
+            .annotate(score=Greatest(*(F(name) for name in field_scores)))
+            .order_by("-score")
+            .values("location_id", *ALIAS_NAME_FIELDS, *field_scores)[: limit * 4]
+        )
+        for alias in aliases:
+            for field in ALIAS_NAME_FIELDS:
+                score = alias[f"score_{field}"]
+                if score is not None:
+                    _keep_best(scores, alias["location_id"], score, alias[field])
+    return scores
+
+
+def first_toponyms(limit):
+    """The first ``limit`` named toponyms as unranked matches, by name."""
+    return [
+        ToponymMatch(location_id, placename_id, slug, name, None, None)
+        for location_id, placename_id, slug, name in Location.objects.exclude(
+            Q(placename_id__isnull=True) | Q(placename_id="") | Q(name="")
+        )
+        .order_by("name")
+        .values_list("id", "placename_id", "slug", "name")[:limit]
+    ]
+
+
+def search_toponyms(query, limit=SEARCH_LIMIT):
+    """Return up to ``limit`` toponyms whose name or alias names resemble
+    ``query``, best match first; the first ``limit`` by name for an empty
+    query.
+    """
+    query = (query or "").strip()
+    if not query:
+        return first_toponyms(limit)
+    scores = search_folded(query, limit)
+    if connection.vendor == "postgresql":
+        similar = search_postgres(query, limit)
+    else:
+        similar = search_in_process(query, limit)
+    for location_id, (score, matched) in similar.items():
+        _keep_best(scores, location_id, score, matched)
+    return _matches(scores, limit)
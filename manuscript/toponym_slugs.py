@@ -0,0 +1,175 @@
+"""The slug index behind ``toponym_by_slug``.
+
+Gazetteer URLs name a toponym by the slug of its name or of one of its
+aliases' names. A toponym's own slug is unique: where names collide, the
+later toponym's slug is suffixed with its placename ID (or its id). ``ToponymSlug`` stores every such slug with the toponym it
+leads to, so a URL resolves with a single indexed query instead of
+slugifying every toponym and alias in Python.
+
+Each row also stores a folded search key. Manuscript spellings of a name
+differ in diacritics, doubled consonants, u/v and i/j (and y); folding drops
+the accents with the slug, then the word breaks, writes v as u, j and y as i
+and collapses doubled letters, so "Vinegia", "Uinegia" and "Vinnegia" all
+become "uinegia". Queries folded the same way find every variant with one
+equality or prefix lookup on the indexed key.
+"""
+
+import re
+
+from django.db import transaction
+from django.utils.text import slugify
+
+from manuscript.models import Location, LocationAlias, ToponymSlug
+
+ORTHOGRAPHY = str.maketrans({"v": "u", "j": "i", "y": "i", "-": None, "_": None})
+DOUBLED = re.compile(r"([a-z])\1+")
+
+
+def fold_slug(slug):
+    """Return the search key of a slug."""
+    return DOUBLED.sub(r"\1", (slug or "").translate(ORTHOGRAPHY))[:255]
+
+
+def fold_name(name):
+    """Return the search key of a name or query."""
+    return fold_slug(slugify(name or ""))
+
+
+def slug_candidates(location):
+    """Return the slugs a toponym may take, in order of preference."""
+    slug = location.build_slug()
+    if not slug:
+        return []
+    candidates = [slug]
+    for suffix in (slugify(location.placename_id or ""), str(location.pk or "")):
+        if suffix:
+            candidates.append(f"{slug[:254 - len(suffix)]}-{suffix}")
+    return candidates
+
+
+def choose_slug(location, taken):
+    """Return the first slug the toponym may take that is not in ``taken``,
+    keeping its current slug while it still may. None if there is none.
+    """
+    candidates = slug_candidates(location)
+    if location.slug in candidates and location.slug not in taken:
+        return location.slug
+    return next((slug for slug in candidates if slug not in taken), None)
+
+
+def unique_slug(location):
+    """Return a slug for the toponym that no other toponym holds."""
+    taken = Location.objects.filter(slug__in=slug_candidates(location)).exclude(
+        pk=location.pk
+    )
+    return choose_slug(location, set(taken.values_list("slug", flat=True)))
+
+
+def location_slug_rows(location):
+    if not location.slug:
+        return []
+    return [
+        ToponymSlug(
+            slug=location.slug,
+            # Keyed on the name, not on a disambiguating suffix
+            search_key=fold_slug(location.build_slug()),
+            priority=0,
+            location_id=location.pk,
+        )
+    ]
+
+
+def alias_slug_rows(alias):
+    if alias.location_id is None:
+        return []
+    rows = []
+    seen = set()
+    for priority, field in enumerate(ToponymSlug.ALIAS_NAME_FIELDS, start=1):
+        slug = slugify(getattr(alias, field) or "")[:255]
+        if slug and slug not in seen:
+            seen.add(slug)
+            rows.append(
+                ToponymSlug(
+                    slug=slug,
+                    search_key=fold_slug(slug),
+                    priority=priority,
+                    location_id=alias.location_id,
+                    alias_id=alias.pk,
+                )
+            )
+    return rows
+
+
+def index_location(location):
+    """Bring the stored slug and index row of one toponym up to date."""
+    if not location.slug:
+        # Nameless toponyms only get an id-based slug once they have an id
+        location.slug = unique_slug(location)
+        Location.objects.filter(pk=location.pk).update(slug=location.slug)
+    with transaction.atomic():
+        ToponymSlug.objects.filter(location=location, alias__isnull=True).delete()
+        ToponymSlug.objects.bulk_create(location_slug_rows(location))
+
+
+def index_alias(alias):
+    """Bring the index rows of one alias up to date."""
+    with transaction.atomic():
+        ToponymSlug.objects.filter(alias=alias).delete()
+        ToponymSlug.objects.bulk_create(alias_slug_rows(alias))
+
+
+def rebuild_slug_index(batch_size=1000):
+    """Recompute every toponym slug and rebuild the index.
+
+    Returns ``(toponyms updated, index rows)``.
+    """
+    locations = list(Location.objects.order_by("placename_id", "id"))
+    # Slugs still valid stay put, so existing URLs keep working
+    taken = set()
+    unplaced = []
+    for location in locations:
+        if location.slug in slug_candidates(location) and location.slug not in taken:
+            taken.add(location.slug)
+        else:
+            unplaced.append(location)
+
+    changed = []
+    for location in unplaced:
+        slug = choose_slug(location, taken)
+        taken.add(slug)
+        if slug != location.slug:
+            location.slug = slug
+            changed.append(location)
+
+    rows = []
+    for location in locations:
+        rows.extend(location_slug_rows(location))
+    for alias in LocationAlias.objects.exclude(location__isnull=True):
+        rows.extend(alias_slug_rows(alias))
+
+    with transaction.atomic():
+        # Cleared first, so a slug can pass from one toponym to another
+        Location.objects.filter(pk__in=[location.pk for location in changed]).update(
+            slug=None
+        )
+        Location.objects.bulk_update(changed, ["slug"], batch_size=batch_size)
+        ToponymSlug.objects.all().delete()
+        ToponymSlug.objects.bulk_create(rows, batch_size=batch_size)
+    return len(changed), len(rows)
+
+
+def resolve_toponym_slug(slug):
+    """Return ``(placename ID, slug)`` of the toponym a slug leads to, or None.
+
+    A toponym's own name wins over alias names; among equals, the lowest
+    placename ID wins. When no name has the slug, a spelling variant with the
+    same search key is matched instead, and the toponym's own slug is returned
+    so the caller can redirect to it rather than serve it under another name.
+    """
+    matches = ToponymSlug.objects.order_by(
+        "priority", "location__placename_id", "location_id"
+    ).values_list("location__placename_id", "location__slug")
+    match = matches.filter(slug=slug).first()
+    if match is not None:
+        return match[0], slug
+    return matches.filter(search_key=fold_slug(slug)).first()
@@ -0,0 +1,232 @@
+"""Server-side clustering of the gazetteer map, served as tiles.
+
+Toponyms are projected to Web Mercator and clustered once per zoom level,
+from ``TOPONYM_CLUSTER_MAX_ZOOM`` down to 0. Each level merges the previous
+level's clusters that lie within ``TOPONYM_CLUSTER_RADIUS`` pixels of each
+other, so a cluster always splits into the clusters of the next zoom in.
+The levels are bucketed by tile, so a z/x/y tile is a dictionary lookup;
+above the maximum cluster zoom the map shows the toponyms themselves.
+
+Tiles come as GeoJSON or as Mapbox Vector Tiles. The cluster index is kept
+per process and rebuilt when the ``toponyms`` revision moves; encoded tiles
+are cached in the shared cache under that revision.
+"""
+
+import math
+import threading
+from collections import defaultdict, namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from manuscript import mvt
+from manuscript.models import Location
+from manuscript.revisions import TOPONYMS, current_revision
+from manuscript.toponym_feed import dumps
+
+# Pixel radius within which toponyms are clustered
+CLUSTER_RADIUS = getattr(settings, "TOPONYM_CLUSTER_RADIUS", 40)
+# Highest zoom with clusters; beyond it every toponym is shown on its own
+CLUSTER_MAX_ZOOM = getattr(settings, "TOPONYM_CLUSTER_MAX_ZOOM", 14)
+MAX_TILE_ZOOM = 22
+TILE_SIZE = 256
+TILE_CACHE_TIMEOUT = getattr(settings, "TOPONYM_TILE_CACHE_TIMEOUT", 60 * 60 * 24)
+
+MVT_LAYER = "toponyms"
+MAX_LATITUDE = 85.051129
+
+# ``x`` and ``y`` are Web Mercator coordinates scaled to 0..1. ``toponym``
+# is set for single toponyms, ``expansion_zoom`` (the zoom at which a
+# cluster splits) for clusters.
+MapItem = namedtuple("MapItem", ["x", "y", "count", "toponym", "expansion_zoom"])
+
+_index_lock = threading.Lock()
+_index = {}
+
+
+class InvalidTile(ValueError):
+    pass
+
+
+def project(longitude, latitude):
+    """Return the Web Mercator position of a coordinate, scaled to 0..1."""
+    sin = math.sin(math.radians(max(-MAX_LATITUDE, min(MAX_LATITUDE, latitude))))
+    x = (longitude + 180) / 360
+    y = 0.5 - math.log((1 + sin) / (1 - sin)) / (4 * math.pi)
+    return min(max(x, 0.0), 1.0), min(max(y, 0.0), 1.0)
+
+
+def unproject(x, y):
+    """Return ``(longitude, latitude)`` of a scaled Web Mercator position."""
+    longitude = x * 360 - 180
+    latitude = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y))))
+    return longitude, latitude
+
+
+def toponym_points():
+    points = []
+    for toponym in (
+        Location.objects.filter(latitude__isnull=False, longitude__isnull=False)
+        .order_by("id")
+        .values("id", "placename_id", "slug", "name", "longitude", "latitude")
+    ):
+        x, y = project(toponym.pop("longitude"), toponym.pop("latitude"))
+        points.append(MapItem(x, y, 1, toponym, None))
+    return points
+
+
+def cluster_level(items, zoom):
+    """Merge the items lying within ``CLUSTER_RADIUS`` pixels of each other
+    at ``zoom``.
+    """
+    radius = CLUSTER_RADIUS / (TILE_SIZE * 2**zoom)
+    grid = defaultdict(list)
+    for index, item in enumerate(items):
+        grid[int(item.x / radius), int(item.y / radius)].append(index)
+
+    taken = [False] * len(items)
+    clusters = []
+    for index, item in enumerate(items):
+        if taken[index]:
+            continue
+        taken[index] = True
+        members = [item]
+        cell_x, cell_y = int(item.x / radius), int(item.y / radius)
+        for neighbour_x in (cell_x - 1, cell_x, cell_x + 1):
+            for neighbour_y in (cell_y - 1, cell_y, cell_y + 1):
+                for other in grid.get((neighbour_x, neighbour_y), ()):
+                    if taken[other]:
+                        continue
+                    dx = items[other].x - item.x
+                    dy = items[other].y - item.y
+                    if dx * dx + dy * dy <= radius * radius:
+                        taken[other] = True
+                        members.append(items[other])
+
+        if len(members) == 1:
+            clusters.append(item)
+            continue
+        count = sum(member.count for member in members)
+        clusters.append(
+            MapItem(
+                x=sum(member.x * member.count for member in members) / count,
+                y=sum(member.y * member.count for member in members) / count,
+                count=count,
+                toponym=None,
+                expansion_zoom=zoom + 1,
+            )
+        )
+    return clusters
+
+
+def bucket_by_tile(items, zoom):
+    tiles = 2**zoom
+    buckets = defaultdict(list)
+    for item in items:
+        tile_x = min(int(item.x * tiles), tiles - 1)
+        tile_y = min(int(item.y * tiles), tiles - 1)
+        buckets[tile_x, tile_y].append(item)
+    return dict(buckets)
+
+
+def build_cluster_index(points):
+    """Return ``{zoom: {(x, y): [MapItem]}}`` from 0 to one past
+    ``CLUSTER_MAX_ZOOM``, where the items are the toponyms themselves.
+    """
+    levels = {CLUSTER_MAX_ZOOM + 1: bucket_by_tile(points, CLUSTER_MAX_ZOOM + 1)}
+    items = points
+    for zoom in range(CLUSTER_MAX_ZOOM, -1, -1):
+        items = cluster_level(items, zoom)
+        levels[zoom] = bucket_by_tile(items, zoom)
+    return levels
+
+
+def get_cluster_index(revision):
+    """Return the cluster index at a ``toponyms`` revision, building it at
+    most once per process and revision.
+    """
+    with _index_lock:
+        if _index.get("revision") != revision:
+            _index.update(
+                revision=revision, levels=build_cluster_index(toponym_points())
+            )
+        return _index["levels"]
+
+
+def tile_items(levels, z, x, y):
+    """Return the items in tile ``z/x/y``. Raises ``InvalidTile``."""
+    if not 0 <= z <= MAX_TILE_ZOOM or not (0 <= x < 2**z and 0 <= y < 2**z):
+        raise InvalidTile(f"No tile {z}/{x}/{y}")
+    top = CLUSTER_MAX_ZOOM + 1
+    if z <= top:
+        return levels[z].get((x, y), [])
+    # Deeper tiles filter the toponyms of the tile containing them
+    tiles = 2**z
+    return [
+        item
+        for item in levels[top].get((x >> (z - top), y >> (z - top)), [])
+        if min(int(item.x * tiles), tiles - 1) == x
+        and min(int(item.y * tiles), tiles - 1) == y
+    ]
+
+
+def item_properties(item):
+    if item.toponym is not None:
+        return dict(item.toponym)
+    return {
+        "cluster": True,
+        "count": item.count,
+        "expansion_zoom": item.expansion_zoom,
+    }
+
+
+def encode_geojson_tile(items):
+    features = []
+    for item in items:
+        longitude, latitude = unproject(item.x, item.y)
+        feature = {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [longitude, latitude]},
+            "properties": item_properties(item),
+        }
+        if item.toponym is not None:
+            feature["id"] = item.toponym["id"]
+        features.append(feature)
+    return dumps({"type": "FeatureCollection", "features": features})
+
+
+def encode_vector_tile(items, z, x, y):
+    tiles = 2**z
+    extent = mvt.DEFAULT_EXTENT
+    features = [
+        (
+            item.toponym["id"] if item.toponym is not None else None,
+            round((item.x * tiles - x) * extent),
+            round((item.y * tiles - y) * extent),
+            item_properties(item),
+        )
+        for item in items
+    ]
+    return mvt.encode_tile([mvt.encode_layer(MVT_LAYER, features, extent)])
+
+
+def tile_cache_key(revision, fmt, z, x, y):
+    return f"toponym_tile_{revision}_{fmt}_{z}_{x}_{y}"
+
+
+def get_toponym_tile(z, x, y, fmt="json", revision=None):
+    """Return the encoded ``json`` or ``mvt`` tile ``z/x/y`` of the clustered
+    toponyms. Raises ``InvalidTile``.
+    """
+    if revision is None:
+        revision = current_revision(TOPONYMS)
+    cache_key = tile_cache_key(revision, fmt, z, x, y)
+    content = cache.get(cache_key)
+    if content is None:
+        items = tile_items(get_cluster_index(revision), z, x, y)
+        if fmt == "mvt":
+            content = encode_vector_tile(items, z, x, y)
+        else:
+            content = encode_geojson_tile(items)
+        cache.set(cache_key, content, TILE_CACHE_TIMEOUT)
+    return content
@@ -21,6 +21,11 @@ urlpatterns = [
         views.manuscript_stanzas,
         name="manuscript_stanzas",
     ),
+    path(
+        "manuscripts/<str:siglum>/stanzas/book/<int:book_number>/",
+        views.manuscript_stanza_book,
+        name="manuscript_stanza_book",
+    ),
     # Toponym routes
     path("toponyms/", views.toponyms, name="toponyms"),
     path("toponyms/<slug:toponym_slug>/", views.toponym_by_slug, name="toponym_detail"),
@@ -31,7 +36,30 @@ urlpatterns = [
         views.mirador_view,
         name="mirador_view",
     ),
+    # Built-in IIIF image server for uploaded images
+    path("iiif/image/<str:identifier>", views.iiif_image_base, name="iiif_image_base"),
+    path(
+        "iiif/image/<str:identifier>/info.json",
+        views.iiif_image_info,
+        name="iiif_image_info",
+    ),
+    path(
+        "iiif/image/<str:identifier>/<str:region>/<str:size>/<str:rotation>/<str:filename>",
+        views.iiif_image,
+        name="iiif_image",
+    ),
+    path(
+        "manuscripts/<str:siglum>/iiif/manifest.json",
+        views.manuscript_image_manifest,
+        name="manuscript_image_manifest",
+    ),
     # API and annotations
+    path("api/toponyms.geojson", views.toponyms_geojson, name="toponyms_geojson"),
+    path(
+        "api/toponyms/tiles/<int:z>/<int:x>/<int:y>.<str:fmt>",
+        views.toponym_tile,
+        name="toponym_tile",
+    ),
     path("api/", include(router.urls)),
     path("text-annotations/create/", views.create_annotation, name="create_annotation"),
 ]
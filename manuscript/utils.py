@@ -1,30 +1,16 @@
-import json
-from datetime import timedelta
-from functools import lru_cache
+from manuscript import iiif
 
-import requests
-from django.core.cache import cache
+# The manuscript canvases were looked up in before each had its own manifest
+DEFAULT_MANIFEST_URL = "https://digi.vatlib.it/iiif/MSS_Urb.lat.752/manifest.json"
 
 
-@lru_cache(maxsize=1)
-def get_manifest():
+def get_manifest(manifest_url=DEFAULT_MANIFEST_URL):
     """
-    Fetch the IIIF manifest with in-memory caching
-    The lru_cache will keep the manifest in memory for the lifetime of the process
+    Fetch the IIIF manifest through the cached manifest client
     """
-    manifest_url = "https://digi.vatlib.it/iiif/MSS_Urb.lat.752/manifest.json"
-    response = requests.get(manifest_url)
-    return response.json()
+    return iiif.get_manifest(manifest_url)
 
 
-def get_canvas_id_for_folio(folio_number):
+def get_canvas_id_for_folio(folio_number, manifest_url=DEFAULT_MANIFEST_URL):
     """Look up the canvas ID for a given folio number (e.g., "1r")"""
-    try:
-        manifest = get_manifest()
-        for canvas in manifest["sequences"][0]["canvases"]:
-            if canvas["label"] == folio_number:
-                return canvas["@id"]
-        return None
-    except Exception as e:
-        print(f"Error fetching canvas ID for folio {folio_number}: {e}")
-        return None
+    return iiif.canvas_id_for_label(manifest_url, folio_number)
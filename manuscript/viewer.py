@@ -0,0 +1,161 @@
+"""Precomputed targets of the Mirador viewer page.
+
+``mirador_view`` used to pick a manuscript through a chain of fallback
+queries and download its manifest to find the canvas for a page. The
+``ViewerResolution`` table stores the outcome for every manuscript and page
+instead, so the view reads it with one indexed query. Rows are built from the
+manifests by ``manage.py resolve_viewer_pages`` only; requests and saves never
+fetch a manifest. When a manuscript is saved ``manuscript.signals`` points its
+page 0 row at a changed manifest and marks it stale, and ``manage.py
+resolve_viewer_pages --stale`` resolves its pages again.
+"""
+
+import logging
+
+from django.db import transaction
+from django.db.models import F, Q
+
+from manuscript.iiif import ManifestUnavailable, get_canvas_index
+from manuscript.models import SingleManuscript, ViewerResolution
+
+logger = logging.getLogger(__name__)
+
+
+def default_viewer_manuscript():
+    """The manuscript shown for manuscripts without a manifest."""
+    manuscripts = SingleManuscript.objects.order_by("pk")
+    return (
+        manuscripts.exclude(Q(iiif_url__isnull=True) | Q(iiif_url="")).first()
+        or manuscripts.filter(siglum="Urb1").first()
+    )
+
+
+def resolve_manuscript_pages(manuscript):
+    """Rebuild the viewer rows of one manuscript from its manifest.
+
+    Returns the number of pages resolved to a canvas. A manuscript whose
+    manifest can't be fetched keeps only its page 0 row.
+    """
+    rows = []
+    if manuscript.iiif_url:
+        rows.append(
+            ViewerResolution(
+                manuscript=manuscript, page_number=0, manifest_url=manuscript.iiif_url
+            )
+        )
+        try:
+            pages = get_canvas_index(manuscript.iiif_url)["pages"]
+        except ManifestUnavailable as e:
+            logger.warning(f"Could not resolve viewer pages of {manuscript}: {e}")
+            pages = []
+        rows.extend(
+            ViewerResolution(
+                manuscript=manuscript,
+                page_number=position + 1,
+                manifest_url=manuscript.iiif_url,
+                canvas_id=canvas_id,
+            )
+            for position, canvas_id in enumerate(pages)
+        )
+
+    with transaction.atomic():
+        ViewerResolution.objects.filter(manuscript=manuscript).delete()
+        ViewerResolution.objects.bulk_create(rows, batch_size=500)
+    return max(len(rows) - 1, 0)
+
+
+def mark_manuscript_stale(manuscript):
+    """Point a manuscript's viewer at its current manifest without fetching
+    it. If the manifest changed, its page rows are dropped and its page 0
+    row is marked stale until the pages are resolved again.
+    """
+    rows = ViewerResolution.objects.filter(manuscript=manuscript)
+    current = rows.filter(page_number=0).values_list("manifest_url", flat=True)
+    if manuscript.iiif_url and current.first() == manuscript.iiif_url:
+        return
+    with transaction.atomic():
+        rows.delete()
+        if manuscript.iiif_url:
+            ViewerResolution.objects.create(
+                manuscript=manuscript,
+                page_number=0,
+                manifest_url=manuscript.iiif_url,
+                stale=True,
+            )
+
+
+def stale_manuscripts():
+    return SingleManuscript.objects.filter(viewer_resolutions__stale=True).distinct()
+
+
+def resolve_default_viewer():
+    """Rebuild the row used for manuscripts without a manifest."""
+    manuscript = default_viewer_manuscript()
+    with transaction.atomic():
+        ViewerResolution.objects.filter(manuscript__isnull=True).delete()
+        ViewerResolution.objects.create(
+            manuscript=None,
+            page_number=0,
+            manifest_url=manuscript.iiif_url if manuscript else None,
+        )
+
+
+def resolve_viewer_pages(manuscripts=None):
+    """Rebuild the viewer rows of ``manuscripts`` (all by default) and the
+    default viewer row. Returns ``{manuscript: pages resolved}``.
+    """
+    if manuscripts is None:
+        manuscripts = SingleManuscript.objects.all()
+    resolved = {
+        manuscript: resolve_manuscript_pages(manuscript) for manuscript in manuscripts
+    }
+    resolve_default_viewer()
+    return resolved
+
+
+def find_viewer_target(manuscript_id, page_number):
+    """Return the stored ``(manifest_url, canvas_id)`` for the viewer of a
+    manuscript page, or None.
+
+    The exact page comes first, then the manuscript's page 0 row, then the
+    default viewer row; one query picks the best of them.
+    """
+    try:
+        manuscript_id = int(manuscript_id)
+    except (TypeError, ValueError):
+        manuscript_id = None
+    try:
+        page_number = int(page_number)
+    except (TypeError, ValueError):
+        page_number = 0
+
+    return (
+        ViewerResolution.objects.filter(
+            Q(manuscript_id=manuscript_id, page_number__in=(page_number, 0))
+            | Q(manuscript__isnull=True)
+        )
+        .order_by(F("manuscript_id").asc(nulls_last=True), "-page_number")
+        .values_list("manifest_url", "canvas_id")
+        .first()
+    )
+
+
+def viewer_target(manuscript_id, page_number):
+    """Return ``(manifest_url, canvas_id)`` for the viewer of a manuscript
+    page.
+
+    Until the table has been built the viewer opens the manuscript's own
+    manifest, or the default one, without a canvas.
+    """
+    target = find_viewer_target(manuscript_id, page_number)
+    if target is not None:
+        return target
+    manuscripts = SingleManuscript.objects.exclude(
+        Q(iiif_url__isnull=True) | Q(iiif_url="")
+    )
+    manuscript = (
+        manuscripts.filter(pk=manuscript_id).first()
+        if str(manuscript_id).isdigit()
+        else None
+    ) or default_viewer_manuscript()
+    return (manuscript.iiif_url if manuscript else None, None)
@@ -1,3 +1,4 @@
+import hashlib
 import json
 import logging
 import os
@@ -7,219 +8,180 @@ from collections import defaultdict
 from html import unescape
 from urllib.parse import urlparse
 
-import requests
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.core.cache import cache
-from django.db.models import Q
-from django.http import HttpRequest, JsonResponse
-from django.shortcuts import get_object_or_404, render
+from django.db.models import F, Q
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpRequest,
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseNotModified,
+    HttpResponseRedirect,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.shortcuts import get_object_or_404, redirect, render
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.cache import add_never_cache_headers, patch_vary_headers
 from django.utils.text import slugify
+from django.views.decorators.cache import cache_control
 from django.views.decorators.csrf import ensure_csrf_cookie
-from django.views.decorators.http import require_GET, require_POST
+from django.views.decorators.http import condition, require_GET, require_POST
 from django.views.generic import DetailView
 from rest_framework import viewsets
 
+from manuscript.edition import (
+    TranslationPairing,
+    get_edition_layout,
+    layout_book_numbers,
+    manuscript_edition_layout,
+    mark_folio_change,
+    paired_books_from_layout,
+    process_stanzas,
+    stanza_folios_prefetch,
+)
+from manuscript.iiif import (
+    PENDING,
+    READY,
+    get_manifest_projections,
+)
+from manuscript.iiif_image import (
+    InvalidImageRequest,
+    get_image_source,
+    has_local_images,
+    image_info,
+    image_manifest,
+    render_image,
+)
 from manuscript.models import (
+    EditionLayout,
     Folio,
     Location,
     LocationAlias,
     SingleManuscript,
     Stanza,
     StanzaTranslated,
-    line_code_to_numeric,
     parse_line_code,
 )
+from manuscript.revisions import TOPONYMS, cache_page_by_revision, current_revision
 from manuscript.serializers import SingleManuscriptSerializer, ToponymSerializer
+from manuscript.toponym_feed import get_toponym_feed
+from manuscript.toponym_search import search_toponyms as search_toponym_names
+from manuscript.toponym_slugs import resolve_toponym_slug
+from manuscript.toponym_tiles import InvalidTile, get_toponym_tile
+from manuscript.viewer import viewer_target
 from pages.models import AboutPage, SitePage
 from textannotation.models import TextAnnotation
 
 logger = logging.getLogger(__name__)
 
 
-def get_manifest_data(manifest_url):
-    """Fetch and cache IIIF manifest data."""
-    cache_key = f"iiif_manifest_{manifest_url}"
-    cached_data = cache.get(cache_key)
-
-    if cached_data:
-        return cached_data
-
-    # Fetch and cache for 24 hours if not in cache
-    response = requests.get(manifest_url)
-    response.raise_for_status()
-    manifest_data = response.json()
-    cache.set(cache_key, manifest_data, 60 * 60 * 24)
-
-    return manifest_data
-
-
+@cache_page_by_revision()
 def manuscript_stanzas(request, siglum):
     # Get the requested manuscript
     manuscript = get_object_or_404(SingleManuscript, siglum=siglum)
     logger.info(f"Loading manuscript_stanzas for {siglum}")
 
-    # Get all folios for this manuscript
-    folios = manuscript.folio_set.all().order_by("folio_number")
-    logger.info(f"Found {folios.count()} folios for manuscript {siglum}")
-
-    # Try to find stanzas linked to this manuscript's folios
-    if folios.exists():
-        # If we have folios, try to use them to find matching stanzas
-        logger.info(f"Using folios to find stanzas for {siglum}")
-        stanzas = Stanza.objects.filter(
-            folios__in=folios, folios__manuscript=manuscript
-        ).distinct()
-
-        if stanzas.count() == 0:
-            logger.info(
-                f"No stanzas found using folios for {siglum}, using all stanzas with line codes"
-            )
-            stanzas = Stanza.objects.exclude(stanza_line_code_starts__isnull=True)
-    else:
-        # No folios, so just use all stanzas with line codes
-        logger.info(
-            f"No folios found for {siglum}, using all stanzas with line codes"
-        )
-        stanzas = Stanza.objects.exclude(stanza_line_code_starts__isnull=True)
-
-    logger.info(f"Found {stanzas.count()} total stanzas")
+    # The paired-books structure is precomputed and stored per manuscript
+    layout = get_edition_layout(manuscript)
 
-    # Get translated stanzas for all stanzas
-    translated_stanzas = StanzaTranslated.objects.filter(stanza__in=stanzas).distinct()
-    logger.info(f"Found {translated_stanzas.count()} translated stanzas")
+    # Get all manuscripts for the dropdown
+    manuscripts = SingleManuscript.objects.all()
 
-    # Process stanzas into books structure
-    books = process_stanzas(stanzas)
-    translated_books = process_stanzas(translated_stanzas, is_translated=True)
-    logger.info(f"Processed stanzas into {len(books)} books")
+    context = {
+        "manuscripts": manuscripts,
+        "default_manuscript": manuscript,
+        "manuscript": {
+            "iiif_url": manuscript.iiif_url if manuscript.iiif_url else None
+        },
+        "has_known_folios": True,
+    }
+    book_numbers = layout_book_numbers(layout)
 
-    # Build paired books structure (will be sorted by book number)
-    paired_books = {}
+    # ?mode=full streams every book, hydrating each just before it is sent
+    if request.GET.get("mode") == "full":
+        books = (
+            (number, paired_books_from_layout(layout, [number])[number])
+            for number in book_numbers
+        )
+        return stream_edition(request, context, books)
 
-    # Prepare folio mapping if we have folios
-    has_folio_mapping = False
-    line_code_to_folio = {}
-
-    if folios.exists():
-        # Try to build a map of line codes to folios
-        for folio in folios:
-            if folio.line_code_range_start and folio.line_code_range_end:
-                try:
-                    start_code = line_code_to_numeric(folio.line_code_range_start)
-                    end_code = line_code_to_numeric(folio.line_code_range_end)
-
-                    # Skip if we couldn't parse the codes
-                    if start_code is None or end_code is None:
-                        continue
-
-                    # Add codes to the map
-                    for code in range(start_code, end_code + 1):
-                        line_code_to_folio[code] = folio
-
-                    has_folio_mapping = True
-                    logger.info(
-                        f"Mapped codes {start_code}-{end_code} to folio {folio.folio_number}"
-                    )
-                except Exception as e:
-                    logger.warning(f"Error mapping folio {folio.folio_number}: {e}")
-
-    # Process each book
-    for book_number, stanza_dict in books.items():
-        paired_books[book_number] = []
-        current_folio = None
+    # Reader mode renders the first book only; the others are fetched from
+    # manuscript_stanza_book as the reader scrolls
+    paired_books = paired_books_from_layout(layout, book_numbers[:1])
+    next_book = book_numbers[1] if len(book_numbers) > 1 else None
 
-        # Sort stanza numbers for consistent ordering
-        sorted_stanza_numbers = sorted(stanza_dict.keys())
+    # Count the total stanzas we're sending to the template
+    total_stanzas = sum(len(book) for book in paired_books.values())
+    logger.info(f"Rendering template with {total_stanzas} stanza pairs")
 
-        for stanza_number in sorted_stanza_numbers:
-            original_stanzas = stanza_dict[stanza_number]
+    return render(
+        request,
+        "stanzas.html",
+        {**context, "paired_books": paired_books, "next_book": next_book},
+    )
 
-            # Get corresponding translated stanzas
-            translated_stanza_group = translated_books.get(book_number, {}).get(
-                stanza_number, []
-            )
 
-            # If no translations found or this is Yale3 manuscript, use FK relationship instead
-            if (not translated_stanza_group or siglum == "Yale3") and original_stanzas:
-                # Create a map of original stanza IDs
-                original_ids = [s.id for s in original_stanzas]
-                # Find translations directly linked to these stanzas
-                linked_translations = [
-                    ts for ts in translated_stanzas if ts.stanza_id in original_ids
-                ]
-                if linked_translations:
-                    # Override the translations with the directly linked ones
-                    translated_stanza_group = linked_translations
-                    
-            # Ensure translations are always sorted by line code
-            if translated_stanza_group:
-                translated_stanza_group = sorted(
-                    translated_stanza_group, 
-                    key=lambda s: line_code_to_numeric(s.stanza_line_code_starts)
-                )
+def stanza_book_etag(request, siglum, book_number):
+    # Stored layouts are rebuilt (and re-stamped) whenever their stanzas change
+    updated_at = (
+        EditionLayout.objects.filter(manuscript__siglum=siglum)
+        .values_list("updated_at", flat=True)
+        .first()
+    )
+    if updated_at is None:
+        return None
+    reader = "reader" if request.GET.get("reader") else "book"
+    return f"{siglum}-{book_number}-{reader}-{updated_at.timestamp()}"
 
-            # Create the stanza group - we'll show all stanzas for now
-            # This ensures manuscripts without folios still show stanzas
-            stanza_group = {
-                "original": original_stanzas,
-                "translated": translated_stanza_group,
-            }
 
-            # If we have a folio mapping, try to add folio information
-            if has_folio_mapping and original_stanzas:
-                first_stanza = original_stanzas[0]
-                if first_stanza.stanza_line_code_starts:
-                    try:
-                        stanza_code = line_code_to_numeric(
-                            first_stanza.stanza_line_code_starts
-                        )
-                        if stanza_code in line_code_to_folio:
-                            matching_folio = line_code_to_folio[stanza_code]
-
-                            # If this is a new folio, mark it in the stanza group
-                            if current_folio is None or matching_folio != current_folio:
-                                current_folio = matching_folio
-                                stanza_group["new_folio"] = True
-                                stanza_group["current_folio"] = current_folio
-                                logger.info(
-                                    f"New folio for stanza {stanza_number}: {current_folio.folio_number}"
-                                )
-
-                                # Associate the stanza with this folio if not already done
-                                if not first_stanza.folios.filter(
-                                    id=matching_folio.id
-                                ).exists():
-                                    first_stanza.folios.add(matching_folio)
-                    except Exception as e:
-                        logger.warning(
-                            f"Error determining folio for stanza {first_stanza.id}: {e}"
-                        )
-
-            # Add the stanza group to the book
-            paired_books[book_number].append(stanza_group)
+@require_GET
+@cache_control(public=True, no_cache=True)
+@condition(etag_func=stanza_book_etag)
+def manuscript_stanza_book(request, siglum, book_number):
+    """One book of a manuscript's stanza pairs, as an HTML fragment.
 
-    # Get all manuscripts for the dropdown
-    manuscripts = SingleManuscript.objects.all()
+    With ``?reader=1`` the fragment ends in a placeholder that loads the next
+    book once it scrolls into view.
+    """
+    manuscript = get_object_or_404(SingleManuscript, siglum=siglum)
+    edition_layout = manuscript_edition_layout(manuscript)
+    layout = edition_layout.layout
 
-    # Count the total stanzas we're sending to the template
-    total_stanzas = sum(len(book) for book in paired_books.values())
-    logger.info(f"Rendering template with {total_stanzas} stanza pairs")
+    book_numbers = layout_book_numbers(layout)
+    if book_number not in book_numbers:
+        raise Http404(f"{siglum} has no book {book_number}")
 
-    return render(
-        request,
-        "stanzas.html",
-        {
-            "paired_books": paired_books,
-            "manuscripts": manuscripts,
-            "default_manuscript": manuscript,
-            "manuscript": {
-                "iiif_url": manuscript.iiif_url if manuscript.iiif_url else None
-            },
-            "folios": folios,
-            "has_known_folios": True,
-        },
+    reader = bool(request.GET.get("reader"))
+    cache_key = (
+        f"stanza_book_{manuscript.pk}_{book_number}_{reader}_"
+        f"{edition_layout.updated_at.timestamp()}"
     )
+    html = cache.get(cache_key)
+    if html is None:
+        position = book_numbers.index(book_number)
+        next_book = None
+        if reader and position + 1 < len(book_numbers):
+            next_book = book_numbers[position + 1]
+
+        html = render_to_string(
+            "partials/stanza_book.html",
+            {
+                "book_number": book_number,
+                "stanza_pairs": paired_books_from_layout(layout, [book_number])[
+                    book_number
+                ],
+                "next_book": next_book,
+                "default_manuscript": manuscript,
+            },
+        )
+        cache.set(cache_key, html, 60 * 60 * 24)
+
+    return HttpResponse(html)
 
 
 @require_POST
@@ -336,28 +298,6 @@ def get_annotation(request, annotation_id):
         return JsonResponse({"error": str(e)}, status=500)
 
 
-def process_stanzas(stanzas, is_translated=False):
-    books = defaultdict(lambda: defaultdict(list))
-    for stanza in stanzas:
-        book_number = int(stanza.stanza_line_code_starts.split(".")[0])
-        stanza_number = int(stanza.stanza_line_code_starts.split(".")[1])
-
-        if is_translated:
-            stanza.unescaped_stanza_text = unescape(stanza.stanza_text)
-        else:
-            stanza.unescaped_stanza_text = unescape(stanza.stanza_text)
-
-        books[book_number][stanza_number].append(stanza)
-        
-        # Sort stanzas within each stanza number by line code for proper ordering
-        books[book_number][stanza_number].sort(
-            key=lambda s: line_code_to_numeric(s.stanza_line_code_starts)
-        )
-
-    # Return books with keys sorted by book number
-    return {k: dict(v) for k, v in sorted(books.items())}
-
-
 def index(request: HttpRequest):
     from pages.models import HomeIntroduction
 
@@ -472,120 +412,184 @@ def talks(request):
 
 
 def mirador_view(request, manuscript_id, page_number):
-    try:
-        manuscript = SingleManuscript.objects.get(id=manuscript_id)
-    except SingleManuscript.DoesNotExist:
-        # Try to find any available manuscript with IIIF URL as fallback
-        manuscript = SingleManuscript.objects.filter(iiif_url__isnull=False).exclude(iiif_url="").first()
-        if not manuscript:
-            # If still no manuscript found, try Urb1 as last resort
-            manuscript = SingleManuscript.objects.filter(siglum="Urb1").first()
-
-    if not manuscript or not manuscript.iiif_url:
-        # Find any manuscript with a valid IIIF URL
-        manuscript = SingleManuscript.objects.filter(iiif_url__isnull=False).exclude(iiif_url="").first()
-        if not manuscript:
-            # If no manuscripts with IIIF URLs exist, try Urb1
-            manuscript = SingleManuscript.objects.filter(siglum="Urb1").first()
-
-    # Fetch manifest data to calculate canvas_id if page_number is provided
-    canvas_id = None
-    try:
-        manifest_data = get_manifest_data(manuscript.iiif_url)
-
-        # If page_number is provided, calculate the canvas_id
-        if page_number and manifest_data:
-            try:
-                # Convert page_number to integer and get the corresponding canvas
-                page_idx = int(page_number) - 1  # Convert to 0-indexed
-                if "sequences" in manifest_data and len(manifest_data["sequences"]) > 0:
-                    canvases = manifest_data["sequences"][0].get("canvases", [])
-                    if 0 <= page_idx < len(canvases):
-                        canvas_id = canvases[page_idx]["@id"]
-                        logger.info(f"Resolved page {page_number} to canvas_id: {canvas_id}")
-            except (ValueError, KeyError, IndexError) as e:
-                logger.warning(f"Could not resolve page_number {page_number} to canvas_id: {e}")
-
-    except requests.RequestException:
-        # Fallback to any available manuscript with working IIIF
-        manuscript = SingleManuscript.objects.filter(iiif_url__isnull=False).exclude(iiif_url="").first()
-        if not manuscript:
-            manuscript = SingleManuscript.objects.filter(siglum="Urb1").first()
+    # Resolved ahead of time by manage.py resolve_viewer_pages
+    manifest_url, canvas_id = viewer_target(manuscript_id, page_number)
 
     return render(
         request,
         "manuscript/mirador.html",
         {
-            "manifest_url": manuscript.iiif_url,
+            "manifest_url": manifest_url,
             "canvas_id": canvas_id,
         },
     )
 
 
-def get_canvas_url_for_folio(manuscript_manifest, folio):
+IIIF_IMAGE_CONTENT_TYPE = (
+    'application/ld+json;profile="http://iiif.io/api/image/3/context.json"'
+)
+IIIF_PRESENTATION_CONTENT_TYPE = (
+    'application/ld+json;profile="http://iiif.io/api/presentation/3/context.json"'
+)
+
+
+def iiif_image_url(request, identifier):
+    return request.build_absolute_uri(reverse("iiif_image_base", args=[identifier]))
+
+
+@require_GET
+def iiif_image_base(request, identifier):
+    response = HttpResponseRedirect(
+        reverse("iiif_image_info", args=[identifier]), status=303
+    )
+    response["Access-Control-Allow-Origin"] = "*"
+    return response
+
+
+@require_GET
+def iiif_image_info(request, identifier):
+    source = get_image_source(identifier)
+    if source is None:
+        raise Http404("No such image")
+    response = JsonResponse(
+        image_info(source, iiif_image_url(request, identifier)),
+        content_type=IIIF_IMAGE_CONTENT_TYPE,
+    )
+    response["Access-Control-Allow-Origin"] = "*"
+    return response
+
+
+@require_GET
+def iiif_image(request, identifier, region, size, rotation, filename):
+    """Serve an image region. The tiles and sizes listed in info.json are
+    stored on disk on first request; anything else is rendered each time.
     """
-    Find the correct canvas URL from the manifest for a given folio
+    source = get_image_source(identifier)
+    if source is None:
+        raise Http404("No such image")
+    quality, _, fmt = filename.partition(".")
+    try:
+        image = render_image(source, region, size, rotation, quality, fmt)
+    except InvalidImageRequest as e:
+        return HttpResponseBadRequest(str(e))
+
+    etag = f'"{hashlib.md5(image.key.encode()).hexdigest()}"'
+    if request.headers.get("If-None-Match") == etag:
+        response = HttpResponseNotModified()
+    elif image.path is not None:
+        response = FileResponse(open(image.path, "rb"), content_type=image.content_type)
+    else:
+        response = HttpResponse(image.content, content_type=image.content_type)
+    response["ETag"] = etag
+    response["Cache-Control"] = "public, max-age=86400"
+    response["Access-Control-Allow-Origin"] = "*"
+    return response
+
+
+@require_GET
+def manuscript_image_manifest(request, siglum):
+    """A IIIF manifest of a manuscript's uploaded images, served by the
+    built-in image server.
     """
-    folio_label = folio.folio_number
+    manuscript = get_object_or_404(SingleManuscript, siglum=siglum)
+    manifest_url = request.build_absolute_uri()
+    cache_key = (
+        f"iiif_image_manifest_{hashlib.md5(manifest_url.encode()).hexdigest()}_"
+        f"{current_revision()}"
+    )
+    manifest = cache.get(cache_key)
+    if manifest is None:
+        manifest = image_manifest(
+            manuscript,
+            manifest_url,
+            lambda identifier: iiif_image_url(request, identifier),
+        )
+        cache.set(cache_key, manifest, 60 * 60 * 24)
+    if not manifest["items"]:
+        raise Http404("This manuscript has no uploaded images")
 
-    # Find the matching canvas in the manifest
-    for canvas in manuscript_manifest["sequences"][0]["canvases"]:
-        if canvas["label"].lower() == folio_label.lower():
-            return canvas["@id"]
+    response = JsonResponse(manifest, content_type=IIIF_PRESENTATION_CONTENT_TYPE)
+    response["Access-Control-Allow-Origin"] = "*"
+    return response
 
-    return None
 
+# Stands in for the book sections when stanzas.html is rendered for streaming
+STREAM_MARKER = "<!-- stanza books -->"
 
-def stanzas(request: HttpRequest):
-    folios = Folio.objects.all()
-    stanzas = (
-        Stanza.objects.prefetch_related("annotations")
-        .all()
-        .order_by("stanza_line_code_starts")
+
+def stream_edition(request, context, books):
+    """Stream stanzas.html with its book sections rendered one at a time.
+
+    ``books`` yields ``(book_number, stanza_pairs)``; each is rendered and
+    sent before the next is built, so the page head reaches the browser at
+    once and only one book is held in memory.
+    """
+    page = render_to_string(
+        "stanzas.html",
+        {**context, "paired_books": {}, "stream_marker": STREAM_MARKER},
+        request=request,
     )
+    head, tail = page.split(STREAM_MARKER, 1)
 
-    translated_stanzas = (
-        StanzaTranslated.objects.prefetch_related("annotations")
-        .all()
-        .order_by("stanza_line_code_starts")
+    def sections():
+        yield head
+        for book_number, stanza_pairs in books:
+            yield render_to_string(
+                "partials/stanza_book.html",
+                {
+                    "book_number": book_number,
+                    "stanza_pairs": stanza_pairs,
+                    "default_manuscript": context["default_manuscript"],
+                },
+            )
+        yield tail
+
+    response = StreamingHttpResponse(sections())
+    # Don't let a proxy collect the whole page before passing it on
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def stanza_books():
+    """Yield ``(book_number, stanza_groups)`` for every book of the poem,
+    querying one book at a time."""
+    book_numbers = (
+        Stanza.objects.exclude(stanza_line_code_starts_numeric__isnull=True)
+        .annotate(book_number=F("stanza_line_code_starts_numeric") / 10000)
+        .values_list("book_number", flat=True)
+        .distinct()
+        .order_by("book_number")
     )
-    manuscripts = SingleManuscript.objects.all()
-    # Try to get Urb1 as default, but fall back to first available manuscript
-    default_manuscript = SingleManuscript.objects.filter(siglum="Urb1").first()
-    if not default_manuscript:
-        default_manuscript = SingleManuscript.objects.first()
+    for book_number in book_numbers:
+        book_range = (book_number * 10000, book_number * 10000 + 9999)
+        stanzas = (
+            Stanza.objects.prefetch_related("annotations", stanza_folios_prefetch())
+            .filter(stanza_line_code_starts_numeric__in_range=book_range)
+            .order_by("stanza_line_code_starts")
+        )
+        translated_stanzas = list(
+            StanzaTranslated.objects.prefetch_related("annotations")
+            .filter(
+                Q(stanza_line_code_starts_numeric__in_range=book_range)
+                | Q(stanza__in=stanzas)
+            )
+            .order_by("stanza_line_code_starts")
+        )
 
-    books = process_stanzas(stanzas)
-    translated_books = process_stanzas(translated_stanzas)
+        books = process_stanzas(stanzas)
+        for translated in translated_stanzas:
+            translated.unescaped_stanza_text = unescape(translated.stanza_text or "")
+        pairing = TranslationPairing(translated_stanzas)
 
-    # Group stanzas by folio within each book
-    paired_books = {}
-    for book_number, stanza_dict in sorted(books.items()):  # Sort by book number
-        paired_books[book_number] = []
+        # Group stanzas by folio within the book
+        stanza_groups = []
         current_folio = None
 
-        for stanza_number, original_stanzas in stanza_dict.items():
-            # Get corresponding translated stanzas
-            translated_stanza_group = translated_books.get(book_number, {}).get(
-                stanza_number, []
+        for stanza_number, original_stanzas in books.get(book_number, {}).items():
+            translated_stanza_group = pairing.translations_for(
+                book_number, stanza_number, original_stanzas
             )
 
-            # If we can't find translations by line code, try using the FK relationship
-            if not translated_stanza_group and original_stanzas:
-                original_ids = [s.id for s in original_stanzas]
-                linked_translations = [
-                    ts for ts in translated_stanzas if ts.stanza_id in original_ids
-                ]
-                if linked_translations:
-                    translated_stanza_group = linked_translations
-                    
-            # Ensure translations are always sorted by line code
-            if translated_stanza_group:
-                translated_stanza_group = sorted(
-                    translated_stanza_group, 
-                    key=lambda s: line_code_to_numeric(s.stanza_line_code_starts)
-                )
-
             # Add folio information
             stanza_group = {
                 "original": original_stanzas,
@@ -594,53 +598,26 @@ def stanzas(request: HttpRequest):
 
             # Check if this is a new folio by looking at the first stanza's folios
             if original_stanzas:
-                # Get the first stanza's folios ordered by folio_number
-                stanza_folios = original_stanzas[0].folios.order_by("folio_number")
-
-                # If the stanza has any folios and the current folio has changed
-                if stanza_folios.exists() and (
-                    current_folio is None or stanza_folios.first() != current_folio
-                ):
-                    current_folio = stanza_folios.first()
-                    stanza_group["new_folio"] = True
-                    stanza_group["show_viewer"] = (
-                        True  # Only show viewer for new folios
-                    )
-                    # Optionally add information about all folios this stanza appears on
-                    stanza_group["folios"] = list(
-                        stanza_folios.values_list("folio_number", flat=True)
-                    )
-                else:
-                    stanza_group["new_folio"] = False
-
-            paired_books[book_number].append(stanza_group)
-    # paired_books = {}
-    # for book_number, stanza_dict in books.items():
-    #     paired_books[book_number] = []
-    #     current_folio = None
-    #
-    #     for stanza_number, original_stanzas in stanza_dict.items():
-    #         # Get corresponding translated stanzas
-    #         translated_stanza_group = translated_books.get(book_number, {}).get(
-    #             stanza_number, []
-    #         )
-    #
-    #         # Add folio information
-    #         stanza_group = {
-    #             "original": original_stanzas,
-    #             "translated": translated_stanza_group,
-    #         }
-    #
-    #         # Check if this is a new folio
-    #         if original_stanzas and original_stanzas[0].related_folio != current_folio:
-    #             current_folio = original_stanzas[0].related_folio
-    #             stanza_group["new_folio"] = True
-    #             stanza_group["show_viewer"] = True  # Only show viewer for new folios
-    #         else:
-    #             stanza_group["new_folio"] = False
-    #
-    #         paired_books[book_number].append(stanza_group)
-    #
+                current_folio = mark_folio_change(
+                    stanza_group, original_stanzas[0], current_folio
+                )
+                # Only show viewer for new folios
+                if stanza_group["new_folio"]:
+                    stanza_group["show_viewer"] = True
+
+            stanza_groups.append(stanza_group)
+
+        yield book_number, stanza_groups
+
+
+def stanzas(request: HttpRequest):
+    folios = Folio.objects.all()
+    manuscripts = SingleManuscript.objects.all()
+    # Try to get Urb1 as default, but fall back to first available manuscript
+    default_manuscript = SingleManuscript.objects.filter(siglum="Urb1").first()
+    if not default_manuscript:
+        default_manuscript = SingleManuscript.objects.first()
+
     manuscript_data = {
         "iiif_url": (
             default_manuscript.iiif_url
@@ -649,16 +626,16 @@ def stanzas(request: HttpRequest):
         )
     }
 
-    return render(
+    # The complete poem is streamed book by book
+    return stream_edition(
         request,
-        "stanzas.html",
         {
-            "paired_books": paired_books,
             "manuscripts": manuscripts,
             "default_manuscript": default_manuscript,
             "manuscript": manuscript_data,
             "folios": folios,
         },
+        stanza_books(),
     )
 
 
@@ -670,40 +647,38 @@ class ManuscriptViewer(DetailView):
         context = super().get_context_data(**kwargs)
         stanza = self.get_object()
 
-        if stanza.related_folio:
-            manuscript = stanza.get_manuscript()
+        folio = (
+            stanza.folios.select_related("manuscript").order_by("folio_number").first()
+        )
+        if folio:
+            manuscript = folio.manuscript
 
-            related_stanzas = (
-                Stanza.objects.filter(related_folio=stanza.related_folio)
-                .exclude(id=stanza.id)
-                .order_by("stanza_line_code_starts")
+            related_stanzas = folio.stanzas.exclude(id=stanza.id).order_by(
+                "stanza_line_code_starts"
             )
 
             context.update(
                 {
                     "manifest_url": manuscript.iiif_url if manuscript else None,
-                    "canvas_id": (
-                        stanza.related_folio.get_canvas_id()
-                        if stanza.related_folio
-                        else None
-                    ),
+                    # Stored by resolve_folio_canvases, no manifest lookup needed
+                    "canvas_id": folio.canvas_id,
                     "related_stanzas": related_stanzas,
-                    "folio_number": stanza.related_folio.number,
+                    "folio_number": folio.folio_number,
                     "line_range": {
-                        "start": stanza.parse_line_code(stanza.stanza_line_code_starts),
-                        "end": stanza.parse_line_code(stanza.stanza_line_code_ends),
+                        "start": parse_line_code(stanza.stanza_line_code_starts),
+                        "end": parse_line_code(stanza.stanza_line_code_ends),
                     },
                 }
             )
 
-            return context
+        return context
 
 
 def manuscripts(request: HttpRequest):
     """View for displaying all manuscripts with proper folio grouping"""
     folios = Folio.objects.all()
     stanzas = (
-        Stanza.objects.prefetch_related("annotations", "folios")
+        Stanza.objects.prefetch_related("annotations", stanza_folios_prefetch())
         .all()
         .order_by("stanza_line_code_starts")
     )
@@ -750,19 +725,9 @@ def manuscripts(request: HttpRequest):
 
             # Check if this is a new folio by looking at the first stanza's folios
             if original_stanzas:
-                # Get the first stanza's folios ordered by folio_number
-                stanza_folios = original_stanzas[0].folios.order_by("folio_number")
-
-                # If the stanza has any folios and the current folio has changed
-                if stanza_folios.exists() and (
-                    current_folio is None or stanza_folios.first() != current_folio
-                ):
-                    current_folio = stanza_folios.first()
-                    stanza_pair["new_folio"] = True
-                    # Add information about all folios this stanza appears on
-                    stanza_pair["folios"] = list(
-                        stanza_folios.values_list("folio_number", flat=True)
-                    )
+                current_folio = mark_folio_change(
+                    stanza_pair, original_stanzas[0], current_folio
+                )
 
             paired_books[book_number].append(stanza_pair)
 
@@ -787,6 +752,7 @@ def manuscripts(request: HttpRequest):
     )
 
 
+@cache_page_by_revision()
 def manuscript(request: HttpRequest, siglum: str):
     get_manuscript = get_object_or_404(
         SingleManuscript.objects.select_related("library").prefetch_related(
@@ -850,6 +816,14 @@ def manuscript(request: HttpRequest, siglum: str):
 
         folio.related_locations.sort(key=lambda x: x["sort_name"])
 
+    # Manuscripts without a remote manifest can be viewed from their uploads.
+    # Root-relative, since the page is cached for every host.
+    local_manifest_url = None
+    if not get_manuscript.iiif_url and has_local_images(get_manuscript):
+        local_manifest_url = reverse(
+            "manuscript_image_manifest", args=[get_manuscript.siglum]
+        )
+
     return render(
         request,
         "manuscript_single.html",
@@ -857,6 +831,7 @@ def manuscript(request: HttpRequest, siglum: str):
             "manuscript": get_manuscript,
             "folios": folios,
             "iiif_manifest": get_manuscript.iiif_url,
+            "local_manifest_url": local_manifest_url,
         },
     )
 
@@ -895,49 +870,23 @@ def get_toponym_slug(toponym_name):
     return slugify(toponym_name)
 
 
+@cache_page_by_revision()
 def toponym_by_slug(request: HttpRequest, toponym_slug: str):
     """View a toponym by its slugified name"""
-    # Try to find the toponym based on slugified name
-    location = None
-
-    # First try to find by name
-    locations = Location.objects.all()
-    for loc in locations:
-        if slugify(loc.name) == toponym_slug:
-            location = loc
-            break
-
-    # If not found by name, check aliases
-    if location is None:
-        aliases = LocationAlias.objects.all()
-        for alias in aliases:
-            # Check all the possible name fields
-            name_fields = [
-                alias.placename_from_mss,
-                alias.placename_standardized,
-                alias.placename_modern,
-                alias.placename_alias,
-                alias.placename_ancient,
-            ]
-
-            for name in name_fields:
-                if name and slugify(name) == toponym_slug:
-                    location = alias.location
-                    break
-
-            if location:
-                break
-
-    if location is None:
-        # If still not found, return 404
-        from django.http import Http404
-
+    # Names and alias names are indexed by slug in ToponymSlug
+    resolved = resolve_toponym_slug(toponym_slug)
+    if resolved is None:
         raise Http404(f"No toponym found with slug: {toponym_slug}")
+    placename_id, slug = resolved
+    if slug != toponym_slug:
+        # A spelling variant: send the reader to the toponym's own URL
+        return redirect("toponym_detail", toponym_slug=slug)
 
     # Redirect to existing view using placename_id
-    return toponym(request, location.placename_id)
+    return toponym(request, placename_id)
 
 
+@cache_page_by_revision()
 def toponyms(request: HttpRequest):
     """View for displaying all toponyms with proper slugs"""
     # Get unique and sorted Location objects
@@ -947,31 +896,28 @@ def toponyms(request: HttpRequest):
         .exclude(
             Q(name="") | Q(name__isnull=True)
         )  # Exclude locations with empty names
-        .values("name", "placename_id", "id")
+        .values("name", "placename_id", "id", "slug")
         .distinct()
         .order_by("name")
     )
 
-    # Add slug to each object and ensure it's not empty
+    # Slugs are stored on save; fall back for rows not yet backfilled
     toponyms_with_slugs = []
     for obj in toponym_objects:
-        if obj["name"]:  # Double check name is not empty
-            slug = slugify(obj["name"])
-            if not slug:
-                # Generate a fallback slug
-                if obj["placename_id"]:
-                    slug = slugify(obj["placename_id"])
-                else:
-                    slug = f"toponym-{obj['id']}"
-
-            obj["slug"] = slug
-            toponyms_with_slugs.append(obj)
+        if not obj["slug"]:
+            obj["slug"] = (
+                slugify(obj["name"])
+                or slugify(obj["placename_id"])
+                or f"toponym-{obj['id']}"
+            )
+        toponyms_with_slugs.append(obj)
 
     return render(
         request, "gazetteer/gazetteer_index.html", {"aliases": toponyms_with_slugs}
     )
 
 
+@cache_page_by_revision()
 def toponym(request: HttpRequest, placename_id: str):
     filtered_toponym = get_object_or_404(Location, placename_id=placename_id)
     filtered_manuscripts = SingleManuscript.objects.filter(
@@ -980,16 +926,6 @@ def toponym(request: HttpRequest, placename_id: str):
     filtered_folios = filtered_toponym.folio_set.all()
     filtered_linecodes = filtered_toponym.line_codes.all()
 
-    manuscripts_with_iiif = filtered_manuscripts.exclude(
-        Q(iiif_url__isnull=True) | Q(iiif_url="")
-    ).values_list("siglum", "iiif_url")
-
-    iiif_urls = dict(manuscripts_with_iiif)
-
-    iiif_manifest = {
-        siglum: get_manifest_data(url) for siglum, url in manuscripts_with_iiif
-    }
-
     # First get aliases with related data
     aliases = filtered_toponym.locationalias_set.all().prefetch_related(
         "manuscripts", "folios"
@@ -1031,15 +967,34 @@ def toponym(request: HttpRequest, placename_id: str):
                 name.strip() for name in alias.placename_ancient.split(",")
             )
 
-    # After aliases are processed, then handle IIIF URLs and manifests
+    # After aliases are processed, project the manifests onto the folios
+    # that mention the toponym rather than passing whole manifests along
     manuscripts_with_iiif = filtered_manuscripts.exclude(
         Q(iiif_url__isnull=True) | Q(iiif_url="")
-    ).values_list("siglum", "iiif_url")
-
-    iiif_urls = dict(manuscripts_with_iiif)
-    iiif_manifest = {
-        siglum: get_manifest_data(url) for siglum, url in manuscripts_with_iiif
-    }
+    ).values_list("id", "siglum", "iiif_url")
+
+    folio_numbers = defaultdict(list)
+    for manuscript_id, folio_number in filtered_folios.values_list(
+        "manuscript_id", "folio_number"
+    ):
+        folio_numbers[manuscript_id].append(folio_number)
+
+    iiif_urls = {}
+    folios_by_url = defaultdict(list)
+    for manuscript_id, siglum, url in manuscripts_with_iiif:
+        iiif_urls[siglum] = url
+        folios_by_url[url].extend(folio_numbers[manuscript_id])
+
+    # Resolved concurrently; manifests not ready in time are marked pending
+    projections = get_manifest_projections(folios_by_url)
+    iiif_manifest = {}
+    for manuscript_id, siglum, url in manuscripts_with_iiif:
+        projection, status = projections[url]
+        iiif_manifest[siglum] = {
+            **(projection if status == READY else {"canvases": []}),
+            "manuscript_id": manuscript_id,
+            "status": status,
+        }
 
     # Process line codes
     line_codes = [{"line_code": lc.code} for lc in filtered_linecodes]
@@ -1054,26 +1009,69 @@ def toponym(request: HttpRequest, placename_id: str):
         "line_codes": line_codes,
     }
 
-    return render(request, "gazetteer/gazetteer_single.html", context)
+    response = render(request, "gazetteer/gazetteer_single.html", context)
+    if any(manifest["status"] == PENDING for manifest in iiif_manifest.values()):
+        # Cache the page once every manifest has loaded
+        add_never_cache_headers(response)
+    return response
+
+
+def accepts_gzip(request):
+    return "gzip" in request.headers.get("Accept-Encoding", "")
+
+
+def toponym_feed_etag(request):
+    encoding = "gzip" if accepts_gzip(request) else "identity"
+    return f"toponyms-{current_revision(TOPONYMS)}-{encoding}"
+
+
+@require_GET
+@cache_control(public=True, no_cache=True)
+@condition(etag_func=toponym_feed_etag)
+def toponyms_geojson(request):
+    """Every located toponym with its aliases, as a GeoJSON FeatureCollection."""
+    content, compressed = get_toponym_feed()
+    if accepts_gzip(request):
+        response = HttpResponse(compressed, content_type="application/geo+json")
+        response["Content-Encoding"] = "gzip"
+    else:
+        response = HttpResponse(content, content_type="application/geo+json")
+    patch_vary_headers(response, ["Accept-Encoding"])
+    return response
+
+
+TOPONYM_TILE_CONTENT_TYPES = {
+    "json": "application/geo+json",
+    "mvt": "application/vnd.mapbox-vector-tile",
+}
+
+
+def toponym_tile_etag(request, z, x, y, fmt):
+    return f"toponyms-{current_revision(TOPONYMS)}-{fmt}-{z}-{x}-{y}"
+
+
+@require_GET
+@cache_control(public=True, no_cache=True)
+@condition(etag_func=toponym_tile_etag)
+def toponym_tile(request, z, x, y, fmt):
+    """One z/x/y tile of the clustered gazetteer map, as GeoJSON or MVT."""
+    if fmt not in TOPONYM_TILE_CONTENT_TYPES:
+        raise Http404(f"No {fmt} tiles")
+    try:
+        content = get_toponym_tile(z, x, y, fmt)
+    except InvalidTile as e:
+        raise Http404(str(e))
+    response = HttpResponse(content, content_type=TOPONYM_TILE_CONTENT_TYPES[fmt])
+    response["Access-Control-Allow-Origin"] = "*"
+    return response
 
 
 def search_toponyms(request):
     query = request.GET.get("q", "")
     try:
-        if query:
-            alias_results = LocationAlias.objects.filter(
-                Q(placename_modern__icontains=query)
-                | Q(placename_ancient__icontains=query)
-                | Q(placename_from_mss__icontains=query)
-                | Q(
-                    location__name__icontains=query
-                )  # Follow the relationship to Location's name field
-            ).distinct()
-        else:
-            alias_results = LocationAlias.objects.all()
-        return render(
-            request, "gazetteer/gazetteer_results.html", {"aliases": alias_results}
-        )
+        # Ranked by trigram similarity over names and alias names, capped
+        matches = search_toponym_names(query)
+        return render(request, "gazetteer/gazetteer_results.html", {"matches": matches})
     except Exception as e:
         logger.error("Error in search_toponyms: %s", e)
         return JsonResponse({"error": str(e)}, status=500)
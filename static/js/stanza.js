@@ -84,3 +84,41 @@ function updateLineCodeDisplay(mode) {
     }
   });
 }
+
+// Reader mode: books after the first are loaded into placeholders as they
+// scroll into view. Anchors into a book that hasn't loaded yet (the book
+// select, or a line code in the URL) load the books before it first.
+function loadUntilAnchor(anchorId) {
+  if (!anchorId) return;
+
+  const anchor = document.getElementById(anchorId);
+  if (anchor) {
+    anchor.scrollIntoView();
+    return;
+  }
+
+  const placeholder = document.querySelector(".stanza-book-placeholder");
+  if (!placeholder || typeof htmx === "undefined") return;
+
+  document.body.addEventListener(
+    "htmx:afterSettle",
+    () => loadUntilAnchor(anchorId),
+    { once: true }
+  );
+  htmx.trigger(placeholder, "load-book");
+}
+
+function loadUntilHash() {
+  loadUntilAnchor(decodeURIComponent(window.location.hash.slice(1)));
+}
+
+document.addEventListener("DOMContentLoaded", loadUntilHash);
+window.addEventListener("hashchange", loadUntilHash);
+
+// Keep the chosen line code display for books loaded later
+document.addEventListener("htmx:afterSettle", () => {
+  const lineCodeDisplay = document.getElementById("lineCodeDisplay");
+  if (lineCodeDisplay && lineCodeDisplay.value !== "full") {
+    lineCodeDisplay.dispatchEvent(new Event("change"));
+  }
+});
@@ -175,10 +175,20 @@ const TifySync = {
     });
 
     // Observe all folio dividers
-    const dividers = document.querySelectorAll('.folio-divider');
+    this.observeFolioDividers(document);
+
+    // Books loaded later in reader mode bring their own dividers
+    document.body.addEventListener('htmx:afterSettle', () => {
+      this.observeFolioDividers(document);
+    });
+  },
+
+  observeFolioDividers(root) {
+    const dividers = root.querySelectorAll('.folio-divider:not([data-observed])');
     console.log('Found folio dividers:', dividers.length);
     
     dividers.forEach(divider => {
+      divider.dataset.observed = 'true';
       this.observer.observe(divider);
       console.log('Observing divider with folio:', divider.dataset.folioNumber);
     });